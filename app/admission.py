@@ -0,0 +1,186 @@
+"""
+Admission Control for GitHub Gists API
+Gradient concurrency limit that sheds load with a fast 503 before latency runs away
+"""
+import json
+import math
+import os
+import time
+from typing import Callable, Optional
+
+from prometheus_client import Counter, Gauge
+
+from app.limiter import upstream_limiter
+from app.loop_monitor import loop_monitor
+
+# Configuration from environment
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_INITIAL_LIMIT = int(os.environ.get("ADMISSION_INITIAL_LIMIT", 100))
+ADMISSION_MIN_LIMIT = int(os.environ.get("ADMISSION_MIN_LIMIT", 10))
+ADMISSION_MAX_LIMIT = int(os.environ.get("ADMISSION_MAX_LIMIT", 1000))
+ADMISSION_MAX_LOOP_LAG = float(os.environ.get("ADMISSION_MAX_LOOP_LAG", 0.25))  # Seconds
+ADMISSION_MAX_UPSTREAM_QUEUE = int(os.environ.get("ADMISSION_MAX_UPSTREAM_QUEUE", 100))
+ADMISSION_HIT_HEADROOM = float(os.environ.get("ADMISSION_HIT_HEADROOM", 1.5))  # Extra room for cache hits
+ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", 1))
+# Profiles hold a request open for seconds on purpose, which would read as latency
+ADMISSION_EXEMPT_PATHS = frozenset({"/", "/health", "/metrics", "/admin/profile"})
+
+# Prometheus metrics
+ADMISSION_SHED = Counter(
+    "admission_shed_total",
+    "Requests rejected with 503 by admission control",
+    ["reason", "kind"],
+)
+ADMISSION_LIMIT = Gauge(
+    "admission_concurrency_limit",
+    "Current adaptive concurrency limit",
+    multiprocess_mode="liveall",
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "admission_in_flight",
+    "Requests admitted and not yet finished",
+    multiprocess_mode="livesum",
+)
+
+
+class GradientLimit:
+    """
+    Adaptive concurrency limit in the style of Netflix's gradient limiter.
+
+    A fast and a slow moving average of request latency are compared: while
+    recent latency stays near the long-run baseline the limit grows by about
+    ``sqrt(limit)``, and when it rises the limit shrinks in proportion.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        min_limit: int,
+        max_limit: int,
+        tolerance: float = 2.0,
+        smoothing: float = 0.2,
+    ):
+        self._min = min_limit
+        self._max = max_limit
+        self._tolerance = tolerance
+        self._smoothing = smoothing
+        self._short_rtt: Optional[float] = None
+        self._long_rtt: Optional[float] = None
+        self.limit = float(initial)
+        ADMISSION_LIMIT.set(self.limit)
+
+    def on_sample(self, rtt: float, in_flight: int) -> None:
+        """Update the limit from one finished request's latency."""
+        if self._short_rtt is None or self._long_rtt is None:
+            self._short_rtt = self._long_rtt = rtt
+        self._short_rtt += 0.1 * (rtt - self._short_rtt)
+        self._long_rtt += 0.01 * (rtt - self._long_rtt)
+
+        gradient = max(0.5, min(1.0, self._tolerance * self._long_rtt / max(self._short_rtt, 1e-6)))
+        if gradient >= 1.0 and in_flight < self.limit / 2:
+            return  # Demand is well under the limit; latency says nothing about capacity
+        target = self.limit * gradient + math.sqrt(self.limit)
+        limit = (1 - self._smoothing) * self.limit + self._smoothing * target
+        self.limit = max(self._min, min(self._max, limit))
+        ADMISSION_LIMIT.set(self.limit)
+
+
+class AdmissionController:
+    """Decides whether a request may start, preferring likely cache hits."""
+
+    def __init__(self, limit: GradientLimit):
+        self._limit = limit
+        self.in_flight = 0
+
+    @property
+    def limit(self) -> float:
+        """Current concurrency limit."""
+        return self._limit.limit
+
+    def reject_reason(self, cache_hit: bool) -> Optional[str]:
+        """Return why a request should be shed, or None to admit it."""
+        if cache_hit:
+            if self.in_flight >= self._limit.limit * ADMISSION_HIT_HEADROOM:
+                return "concurrency"
+            if loop_monitor.lag > 2 * ADMISSION_MAX_LOOP_LAG:
+                return "loop_lag"
+            return None
+        if self.in_flight >= self._limit.limit:
+            return "concurrency"
+        if loop_monitor.lag > ADMISSION_MAX_LOOP_LAG:
+            return "loop_lag"
+        if upstream_limiter.queue_depth >= ADMISSION_MAX_UPSTREAM_QUEUE:
+            return "upstream_queue"
+        return None
+
+    def admit(self) -> None:
+        self.in_flight += 1
+        ADMISSION_IN_FLIGHT.set(self.in_flight)
+
+    def finish(self, rtt: float) -> None:
+        self._limit.on_sample(rtt, self.in_flight)
+        self.in_flight -= 1
+        ADMISSION_IN_FLIGHT.set(self.in_flight)
+
+
+class AdmissionMiddleware:
+    """
+    Pure ASGI middleware answering with a fast 503 once the service is past capacity.
+
+    ``is_cache_hit(scope)`` predicts whether a request can be answered from
+    the cache; those requests get extra headroom and ignore the upstream queue.
+    Health, metrics and profiling paths are never shed.
+    """
+
+    def __init__(self, app, controller: AdmissionController, is_cache_hit: Callable[[dict], bool]):
+        self.app = app
+        self._controller = controller
+        self._is_cache_hit = is_cache_hit
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ADMISSION_ENABLED or scope["path"] in ADMISSION_EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        cache_hit = self._is_cache_hit(scope)
+        reason = self._controller.reject_reason(cache_hit)
+        if reason is not None:
+            ADMISSION_SHED.labels(reason=reason, kind="hit" if cache_hit else "miss").inc()
+            await _send_overloaded(send)
+            return
+
+        # Latency for the limit is time to first byte, so long streams don't read as slowness
+        responded_at: Optional[float] = None
+
+        async def send_wrapper(message):
+            nonlocal responded_at
+            if message["type"] == "http.response.start":
+                responded_at = time.perf_counter()
+            await send(message)
+
+        self._controller.admit()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self._controller.finish((responded_at or time.perf_counter()) - start)
+
+
+async def _send_overloaded(send) -> None:
+    body = json.dumps({"detail": "Service overloaded. Please try again later."}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(ADMISSION_RETRY_AFTER).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+# Global controller instance (installed as middleware in app.main)
+admission_controller = AdmissionController(
+    GradientLimit(ADMISSION_INITIAL_LIMIT, ADMISSION_MIN_LIMIT, ADMISSION_MAX_LIMIT)
+)
@@ -0,0 +1,153 @@
+"""
+Content-Addressed File Store for GitHub Gists API
+Keeps gist file contents on disk by SHA-256 so identical files are stored once
+"""
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+from pathlib import Path
+import tempfile
+from typing import AsyncIterator, Dict, Optional
+
+from prometheus_client import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment
+GIST_CONTENT_DIR = os.environ.get("GIST_CONTENT_DIR", "/tmp/gist-content")  # nosec B108 - emptyDir in k8s
+GIST_CONTENT_MAX_BYTES = int(os.environ.get("GIST_CONTENT_MAX_BYTES", 256 * 1024 * 1024))
+GIST_CONTENT_MAX_FILE_BYTES = int(os.environ.get("GIST_CONTENT_MAX_FILE_BYTES", 10 * 1024 * 1024))
+
+# Prometheus metrics
+CONTENT_STORE_BYTES = Gauge(
+    "gist_content_store_bytes",
+    "Bytes of gist file content held on disk",
+    multiprocess_mode="liveall",
+)
+CONTENT_STORE_FILES = Gauge(
+    "gist_content_store_files",
+    "Distinct gist file contents held on disk",
+    multiprocess_mode="liveall",
+)
+CONTENT_STORE_LOOKUPS = Counter(
+    "gist_content_store_lookups_total",
+    "Gist file content lookups by result",
+    ["result"],
+)
+CONTENT_STORE_EVICTIONS = Counter(
+    "gist_content_store_evictions_total",
+    "Gist file contents evicted from disk",
+)
+
+
+class ContentTooLarge(Exception):
+    """Raised when a file exceeds the per-file size cap."""
+
+
+class ContentStore:
+    """
+    Content-addressed on-disk store with a total size cap and LRU eviction.
+
+    Files live at ``<root>/<digest[:2]>/<digest>``. ``raw_url`` values map to
+    digests, so the same content reached through different gists or forks is
+    written once. Least recently served contents are evicted first.
+    """
+
+    def __init__(self, root: str, max_bytes: int, max_file_bytes: int):
+        self._root = Path(root)
+        self._max_bytes = max_bytes
+        self._max_file_bytes = max_file_bytes
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # digest -> size, LRU first
+        self._urls: Dict[str, str] = {}  # raw_url -> digest
+        self._size = 0
+
+    @property
+    def max_file_bytes(self) -> int:
+        """Largest single file the store accepts."""
+        return self._max_file_bytes
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Return store statistics."""
+        return {"files": len(self._entries), "bytes": self._size, "max_bytes": self._max_bytes}
+
+    def _path(self, digest: str) -> Path:
+        return self._root / digest[:2] / digest
+
+    def lookup(self, raw_url: str) -> Optional[Path]:
+        """Return the stored file for ``raw_url`` and mark it recently used."""
+        digest = self._urls.get(raw_url)
+        if digest is not None and digest not in self._entries:
+            del self._urls[raw_url]
+            digest = None
+        if digest is None:
+            CONTENT_STORE_LOOKUPS.labels(result="miss").inc()
+            return None
+        CONTENT_STORE_LOOKUPS.labels(result="hit").inc()
+        self._entries.move_to_end(digest)
+        return self._path(digest)
+
+    async def store(self, raw_url: str, chunks: AsyncIterator[bytes]) -> Path:
+        """Write streamed content to disk, deduplicating by SHA-256 digest."""
+        tmp_dir = self._root / "tmp"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        sha = hashlib.sha256()
+        size = 0
+        tmp_file = tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False)
+        tmp_path = Path(tmp_file.name)
+        try:
+            with tmp_file as f:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > self._max_file_bytes:
+                        raise ContentTooLarge(f"{raw_url} exceeds {self._max_file_bytes} bytes")
+                    sha.update(chunk)
+                    f.write(chunk)
+
+            digest = sha.hexdigest()
+            path = self._path(digest)
+            if digest in self._entries:
+                tmp_path.unlink()
+                self._entries.move_to_end(digest)
+            else:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp_path, path)
+                self._entries[digest] = size
+                self._size += size
+                self._evict(keep=digest)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+        self._urls[raw_url] = digest
+        CONTENT_STORE_BYTES.set(self._size)
+        CONTENT_STORE_FILES.set(len(self._entries))
+        return path
+
+    def _evict(self, keep: str) -> None:
+        """Evict least recently used contents until the store fits its cap."""
+        while self._size > self._max_bytes and len(self._entries) > 1:
+            digest, size = next(iter(self._entries.items()))
+            if digest == keep:
+                self._entries.move_to_end(digest)
+                continue
+            del self._entries[digest]
+            self._size -= size
+            self._path(digest).unlink(missing_ok=True)
+            CONTENT_STORE_EVICTIONS.inc()
+            logger.info("Evicted gist content %s (%d bytes)", digest[:12], size)
+
+    def clear(self) -> None:
+        """Remove all stored contents."""
+        for digest in list(self._entries):
+            self._path(digest).unlink(missing_ok=True)
+        self._entries.clear()
+        self._urls.clear()
+        self._size = 0
+        CONTENT_STORE_BYTES.set(0)
+        CONTENT_STORE_FILES.set(0)
+
+
+# Global store instance
+content_store = ContentStore(GIST_CONTENT_DIR, GIST_CONTENT_MAX_BYTES, GIST_CONTENT_MAX_FILE_BYTES)
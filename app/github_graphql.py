@@ -0,0 +1,116 @@
+"""
+GitHub GraphQL Backend for GitHub Gists API
+Fetches the first page of gists for many users in a single GraphQL query
+"""
+import os
+from typing import Any, Dict, List, Optional
+
+import httpx
+from prometheus_client import Counter
+
+# Configuration from environment
+GITHUB_GRAPHQL_URL = os.environ.get("GITHUB_GRAPHQL_URL", "https://api.github.com/graphql")
+GRAPHQL_BATCH_SIZE = int(os.environ.get("GRAPHQL_BATCH_SIZE", 25))  # Aliased users per query
+
+# Prometheus metrics
+GITHUB_GRAPHQL_REQUESTS = Counter(
+    "github_graphql_requests_total",
+    "Total GitHub GraphQL API requests",
+    ["status"],
+)
+
+# Only the fields GistInfo needs
+GIST_SELECTION = """
+    gists(first: $first, privacy: PUBLIC, orderBy: {field: CREATED_AT, direction: DESC}) {
+      totalCount
+      pageInfo { hasNextPage }
+      nodes {
+        name
+        description
+        url
+        createdAt
+        files { name size language { name } }
+      }
+    }
+"""
+
+
+class GraphQLError(Exception):
+    """Raised when the GraphQL endpoint returns no usable data."""
+
+
+def build_query(count: int) -> str:
+    """Build a query aliasing ``count`` users as u0..u{count-1}."""
+
+    params = ", ".join(f"$l{i}: String!" for i in range(count))
+    users = "\n".join(f"  u{i}: user(login: $l{i}) {{{GIST_SELECTION}  }}" for i in range(count))
+    return f"query($first: Int!, {params}) {{\n{users}\n}}"
+
+
+def cache_key(username: str, per_page: int) -> str:
+    """
+    Cache key for a user's first page fetched over GraphQL.
+
+    GraphQL gist files carry no ``raw_url`` or MIME ``type``, so these records
+    are kept apart from the REST page entries (``gists:{u}:page1:...``).
+    """
+
+    return f"gists:{username}:graphql:per_page{per_page}"
+
+
+def to_gist_record(node: Dict[str, Any]) -> Dict[str, Any]:
+    """Map a GraphQL gist node onto the GistInfo shape (files lack ``raw_url`` and ``type``)."""
+
+    return {
+        "id": node["name"],
+        "description": node.get("description"),
+        "url": node["url"],
+        "created_at": node["createdAt"],
+        "files": {
+            f["name"]: {
+                "filename": f["name"],
+                "language": (f.get("language") or {}).get("name"),
+                "size": f.get("size"),
+            }
+            for f in node.get("files") or []
+        },
+    }
+
+
+async def fetch_users_gists(
+    client: httpx.AsyncClient, usernames: List[str], per_page: int
+) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    Fetch the first ``per_page`` gists for each user in one GraphQL call.
+
+    Returns ``{username: {"gists": [...], "total": int, "has_next": bool}}``,
+    with ``None`` for users that do not exist.
+    """
+
+    variables: Dict[str, Any] = {"first": per_page}
+    variables.update({f"l{i}": username for i, username in enumerate(usernames)})
+
+    response = await client.post(
+        GITHUB_GRAPHQL_URL,
+        json={"query": build_query(len(usernames)), "variables": variables},
+    )
+    GITHUB_GRAPHQL_REQUESTS.labels(status=response.status_code).inc()
+    response.raise_for_status()
+
+    data = response.json().get("data")
+    if not data:
+        raise GraphQLError(str(response.json().get("errors", "no data")))
+
+    results: Dict[str, Optional[Dict[str, Any]]] = {}
+    for i, username in enumerate(usernames):
+        user = data.get(f"u{i}")
+        if user is None:
+            results[username] = None
+            continue
+        gists = user["gists"]
+        results[username] = {
+            "gists": [to_gist_record(node) for node in gists["nodes"]],
+            "total": gists["totalCount"],
+            "has_next": gists["pageInfo"]["hasNextPage"],
+        }
+    return results
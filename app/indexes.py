@@ -0,0 +1,400 @@
+"""
+In-Memory Gist Indexes for GitHub Gists API
+Secondary indexes over cached gist records, kept in step with the cache
+"""
+from bisect import bisect_left, insort
+from collections import OrderedDict
+import heapq
+from itertools import islice
+import math
+import os
+import re
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Configuration from environment
+SEARCH_INDEX_MAX_DOCS = int(os.environ.get("SEARCH_INDEX_MAX_DOCS", 50000))
+
+# Prometheus metrics
+GIST_INDEX_LOOKUPS = Counter(
+    "gist_index_lookups_total",
+    "Gist id index lookups by result",
+    ["result"],
+)
+GIST_INDEX_HIT_RATIO = Gauge(
+    "gist_index_hit_ratio",
+    "Fraction of gist id lookups answered from cached lists",
+    multiprocess_mode="liveall",
+)
+GIST_INDEX_SIZE = Gauge(
+    "gist_index_size",
+    "Distinct gists reachable through the gist id index",
+    multiprocess_mode="liveall",
+)
+SEARCH_INDEX_DOCS = Gauge(
+    "gist_search_index_documents",
+    "Gists held in the full-text search index",
+    multiprocess_mode="liveall",
+)
+SEARCH_INDEX_POSTINGS = Gauge(
+    "gist_search_index_postings",
+    "Term postings held in the full-text search index",
+    multiprocess_mode="liveall",
+)
+SEARCH_INDEX_EVICTIONS = Counter(
+    "gist_search_index_evictions_total",
+    "Gists dropped from the search index to stay under SEARCH_INDEX_MAX_DOCS",
+)
+SEARCH_INDEX_BUILD_SECONDS = Histogram(
+    "gist_search_index_build_seconds",
+    "Time spent indexing one gist into the full-text search index",
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01),
+)
+
+
+class GistIdIndex:
+    """
+    Maps gist id to the cached records that contain it.
+
+    Subscribed to the cache: every cached payload with a ``gists`` list adds
+    its records under the cache key, and evictions remove them again. A gist
+    stays indexed while at least one cache entry holds it.
+
+    Attached secondary indexes see each distinct gist once: ``add`` when it
+    first appears (or a newer record replaces it) and ``remove`` when the
+    last unexpired cache entry holding it expires or goes away. Expired
+    entries linger in the cache for its stale window; ``expire`` (run by the
+    cache sweep) takes their gists out of the secondary indexes, so queries
+    never check freshness themselves.
+    """
+
+    def __init__(self):
+        self._refs: Dict[str, Dict[str, Any]] = {}  # gist id -> {cache key: record}
+        self._payloads: Dict[str, Any] = {}  # cache key -> payload, to find the records behind expired keys
+        self._expired: Set[str] = set()  # cache keys already dropped from secondary indexes
+        self._indexed: Dict[str, Any] = {}  # gist id -> record given to secondary indexes
+        self._secondary: List[Any] = []
+        self._hits = 0
+        self._misses = 0
+
+    def attach(self, index: Any) -> None:
+        """Attach a secondary index with ``add(gist)`` and ``remove(gist)``."""
+        self._secondary.append(index)
+        for gist in self._indexed.values():
+            index.add(gist)
+
+    def on_set(self, key: str, value: Any) -> None:
+        """Index the records of a newly cached payload."""
+        if value.get("source") == "graphql":
+            return  # Partial records (no raw_url); detail and file lookups need REST ones
+        self._payloads[key] = value
+        for gist in value.get("gists", ()):
+            self._refs.setdefault(gist.id, {})[key] = gist
+            self._reindex(gist.id)
+        GIST_INDEX_SIZE.set(len(self._refs))
+
+    def on_evict(self, key: str, value: Any) -> None:
+        """Drop the records of an evicted payload."""
+        self._payloads.pop(key, None)
+        self._expired.discard(key)
+        for gist in value.get("gists", ()):
+            refs = self._refs.get(gist.id)
+            if refs is None:
+                continue
+            refs.pop(key, None)
+            if not refs:
+                del self._refs[gist.id]
+            self._reindex(gist.id)
+        GIST_INDEX_SIZE.set(len(self._refs))
+
+    def expire(self, is_fresh: Callable[[str], bool]) -> int:
+        """
+        Take the gists of newly expired cache entries out of secondary indexes.
+
+        Gists still held by an unexpired entry stay indexed under that
+        record. Costs one freshness check per cache entry, so it runs
+        periodically rather than per query. Returns the entries expired.
+        """
+        expired = [key for key in self._payloads if key not in self._expired and not is_fresh(key)]
+        for key in expired:
+            self._expired.add(key)
+            for gist in self._payloads[key].get("gists", ()):
+                self._reindex(gist.id)
+        return len(expired)
+
+    def _reindex(self, gist_id: str) -> None:
+        """Give secondary indexes the newest unexpired record of ``gist_id``, or none."""
+        live = [gist for key, gist in self._refs.get(gist_id, {}).items() if key not in self._expired]
+        current = live[-1] if live else None
+        previous = self._indexed.get(gist_id)
+        if previous is current:
+            return
+        for index in self._secondary:
+            if previous is not None:
+                index.remove(previous)
+            if current is not None:
+                index.add(current)
+        if current is None:
+            del self._indexed[gist_id]
+        else:
+            self._indexed[gist_id] = current
+
+    def get(self, gist_id: str, is_fresh: Callable[[str], bool]) -> Optional[Any]:
+        """Return a record for ``gist_id`` from any unexpired cache entry."""
+        for key, gist in self._refs.get(gist_id, {}).items():
+            if is_fresh(key):
+                self._record(hit=True)
+                return gist
+        self._record(hit=False)
+        return None
+
+    def _record(self, hit: bool) -> None:
+        if hit:
+            self._hits += 1
+        else:
+            self._misses += 1
+        GIST_INDEX_LOOKUPS.labels(result="hit" if hit else "miss").inc()
+        GIST_INDEX_HIT_RATIO.set(self._hits / (self._hits + self._misses))
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """Return index statistics."""
+        total = self._hits + self._misses
+        return {
+            "size": len(self._refs),
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": self._hits / total if total > 0 else 0,
+        }
+
+
+def _discard(items: List[Tuple[str, str]], item: Tuple[str, str]) -> bool:
+    """Remove ``item`` from sorted ``items`` if present; returns whether it was."""
+    i = bisect_left(items, item)
+    if i < len(items) and items[i] == item:
+        del items[i]
+        return True
+    return False
+
+
+def file_extension(filename: str) -> Optional[str]:
+    """Lower-cased extension without the dot, or None."""
+    ext = os.path.splitext(filename)[1]
+    return ext[1:].lower() if len(ext) > 1 else None
+
+
+class GistFilterIndex:
+    """
+    Posting lists per language and file extension plus a ``created_at`` index.
+
+    Every list holds ``(created_at, gist id)`` pairs in ascending order, so a
+    date range is two binary searches and a single-filter page is a slice off
+    the end of its list. With several filters the in-range slices are
+    intersected for the total and the page is read newest first from the
+    narrowest one; matches are never sorted.
+    ``created_at`` values are ISO 8601 strings, which sort chronologically.
+    """
+
+    def __init__(self):
+        self._records: Dict[str, Any] = {}
+        self._by_language: Dict[str, List[Tuple[str, str]]] = {}
+        self._by_extension: Dict[str, List[Tuple[str, str]]] = {}
+        self._created: List[Tuple[str, str]] = []  # (created_at, gist id), ascending
+
+    def _terms(self, gist: Any) -> Tuple[Set[str], Set[str]]:
+        languages, extensions = set(), set()
+        for filename, file_info in gist.files.items():
+            language = file_info.get("language") if isinstance(file_info, dict) else None
+            if language:
+                languages.add(language.lower())
+            ext = file_extension(filename)
+            if ext:
+                extensions.add(ext)
+        return languages, extensions
+
+    def add(self, gist: Any) -> None:
+        self._records[gist.id] = gist
+        item = (gist.created_at, gist.id)
+        languages, extensions = self._terms(gist)
+        for language in languages:
+            insort(self._by_language.setdefault(language, []), item)
+        for ext in extensions:
+            insort(self._by_extension.setdefault(ext, []), item)
+        insort(self._created, item)
+
+    def remove(self, gist: Any) -> None:
+        self._records.pop(gist.id, None)
+        item = (gist.created_at, gist.id)
+        languages, extensions = self._terms(gist)
+        for postings, terms in ((self._by_language, languages), (self._by_extension, extensions)):
+            for term in terms:
+                items = postings.get(term)
+                if items is not None and _discard(items, item) and not items:
+                    del postings[term]
+        _discard(self._created, item)
+
+    def query(
+        self,
+        language: Optional[str] = None,
+        extension: Optional[str] = None,
+        created_after: Optional[str] = None,
+        created_before: Optional[str] = None,
+        offset: int = 0,
+        limit: int = 30,
+    ) -> Tuple[int, List[Any]]:
+        """
+        Return ``(total, records)`` matching all filters, newest first.
+
+        ``created_after`` is inclusive and ``created_before`` exclusive; both
+        compare as string prefixes, so ``2024-01-01`` works as well as a full
+        timestamp.
+        """
+        postings = []
+        if language is not None:
+            postings.append(self._by_language.get(language.lower(), []))
+        if extension is not None:
+            postings.append(self._by_extension.get(extension.lower().lstrip("."), []))
+
+        def date_range(items: List[Tuple[str, str]]) -> Tuple[int, int]:
+            lo = bisect_left(items, (created_after,)) if created_after else 0
+            hi = bisect_left(items, (created_before,)) if created_before else len(items)
+            return lo, max(lo, hi)
+
+        # Walk the list with the fewest gists in range; the rest are membership checks
+        ranges = sorted(((items, *date_range(items)) for items in postings or [self._created]),
+                        key=lambda r: r[2] - r[1])
+        walked, lo, hi = ranges[0]
+
+        if len(ranges) == 1:
+            page = walked[max(lo, hi - offset - limit):max(lo, hi - offset)]
+            page.reverse()
+            return hi - lo, [self._records[gist_id] for _, gist_id in page]
+
+        # Several filters: intersect the in-range slices, then read the page off the walked list
+        matched = set(walked[lo:hi]).intersection(*(items[i:j] for items, i, j in ranges[1:]))
+        newest_first = (walked[i] for i in range(hi - 1, lo - 1, -1))
+        page = list(islice((item for item in newest_first if item in matched), offset, offset + limit))
+        return len(matched), [self._records[gist_id] for _, gist_id in page]
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Return index statistics."""
+        return {
+            "gists": len(self._records),
+            "languages": len(self._by_language),
+            "extensions": len(self._by_extension),
+        }
+
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lower-cased alphanumeric tokens."""
+    return TOKEN_RE.findall(text.lower())
+
+
+class GistSearchIndex:
+    """
+    Token inverted index over gist descriptions and file names, ranked with BM25.
+
+    Bounded to ``max_docs`` gists; when full, the gists indexed longest ago
+    are dropped first. A dropped gist comes back the next time it is cached.
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, max_docs: int):
+        self._max_docs = max_docs
+        self._postings: Dict[str, Dict[str, int]] = {}  # term -> {gist id: term frequency}
+        self._docs: "OrderedDict[str, Tuple[Any, Dict[str, int], int]]" = OrderedDict()  # id -> (gist, tf, length)
+        self._total_length = 0
+        self._posting_count = 0
+
+    def _document_terms(self, gist: Any) -> Dict[str, int]:
+        tokens = tokenize(gist.description or "")
+        for filename in gist.files:
+            tokens.extend(tokenize(filename))
+        terms: Dict[str, int] = {}
+        for token in tokens:
+            terms[token] = terms.get(token, 0) + 1
+        return terms
+
+    def add(self, gist: Any) -> None:
+        start = time.perf_counter()
+        self.remove(gist)
+        terms = self._document_terms(gist)
+        length = sum(terms.values())
+        self._docs[gist.id] = (gist, terms, length)
+        for term, tf in terms.items():
+            self._postings.setdefault(term, {})[gist.id] = tf
+        self._total_length += length
+        self._posting_count += len(terms)
+        while len(self._docs) > self._max_docs:
+            self.remove(self._docs[next(iter(self._docs))][0])
+            SEARCH_INDEX_EVICTIONS.inc()
+        SEARCH_INDEX_BUILD_SECONDS.observe(time.perf_counter() - start)
+        self._update_metrics()
+
+    def remove(self, gist: Any) -> None:
+        entry = self._docs.pop(gist.id, None)
+        if entry is None:
+            return
+        _, terms, length = entry
+        for term in terms:
+            postings = self._postings[term]
+            del postings[gist.id]
+            if not postings:
+                del self._postings[term]
+        self._total_length -= length
+        self._posting_count -= len(terms)
+        self._update_metrics()
+
+    def search(self, query: str, offset: int = 0, limit: int = 30) -> Tuple[int, List[Tuple[float, Any]]]:
+        """Return ``(total, [(score, record), ...])`` for the best BM25 matches."""
+        n = len(self._docs)
+        if not n:
+            return 0, []
+        avg_length = self._total_length / n
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for gist_id, tf in postings.items():
+                length = self._docs[gist_id][2]
+                norm = tf + self.K1 * (1 - self.B + self.B * length / avg_length)
+                scores[gist_id] = scores.get(gist_id, 0.0) + idf * tf * (self.K1 + 1) / norm
+
+        ranked = heapq.nlargest(
+            offset + limit,
+            scores.items(),
+            key=lambda item: (item[1], self._docs[item[0]][0].created_at),
+        )
+        return len(scores), [(score, self._docs[gist_id][0]) for gist_id, score in ranked[offset:]]
+
+    def _update_metrics(self) -> None:
+        SEARCH_INDEX_DOCS.set(len(self._docs))
+        SEARCH_INDEX_POSTINGS.set(self._posting_count)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Return index statistics."""
+        return {
+            "documents": len(self._docs),
+            "terms": len(self._postings),
+            "postings": self._posting_count,
+            "max_documents": self._max_docs,
+        }
+
+
+# Global index instances (gist_index is subscribed to gists_cache in app.main)
+gist_index = GistIdIndex()
+filter_index = GistFilterIndex()
+search_index = GistSearchIndex(max_docs=SEARCH_INDEX_MAX_DOCS)
+gist_index.attach(filter_index)
+gist_index.attach(search_index)
@@ -0,0 +1,141 @@
+"""
+Upstream Concurrency Limiter for GitHub Gists API
+Bounds in-flight GitHub calls and queues waiters fairly per username
+"""
+from collections import OrderedDict, deque
+import asyncio
+import os
+import time
+from typing import Deque
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Configuration from environment
+UPSTREAM_MAX_CONCURRENCY = int(os.environ.get("UPSTREAM_MAX_CONCURRENCY", 10))
+UPSTREAM_QUEUE_TIMEOUT = float(os.environ.get("UPSTREAM_QUEUE_TIMEOUT", 5.0))
+
+# Prometheus metrics
+UPSTREAM_IN_FLIGHT = Gauge(
+    "upstream_requests_in_flight",
+    "GitHub API requests currently in flight",
+    multiprocess_mode="livesum",
+)
+UPSTREAM_QUEUE_DEPTH = Gauge(
+    "upstream_queue_depth",
+    "Requests waiting for an upstream slot",
+    multiprocess_mode="livesum",
+)
+UPSTREAM_QUEUE_WAIT = Histogram(
+    "upstream_queue_wait_seconds",
+    "Time spent waiting for an upstream slot",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+UPSTREAM_QUEUE_TIMEOUTS = Counter(
+    "upstream_queue_timeouts_total",
+    "Requests that gave up waiting for an upstream slot",
+)
+
+
+class UpstreamQueueTimeout(Exception):
+    """Raised when a request waits longer than the queue timeout for a slot."""
+
+
+class FairLimiter:
+    """
+    Global concurrency limit with round-robin queueing per key.
+
+    Waiters are grouped by key (the GitHub username). When a slot frees up it
+    is handed to the oldest waiter of the next key in rotation, so a single
+    hot username cannot starve the others.
+    """
+
+    def __init__(self, limit: int = 10, queue_timeout: float = 5.0):
+        self._limit = limit
+        self._queue_timeout = queue_timeout
+        self._in_flight = 0
+        self._queues: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self._waiting = 0
+
+    @property
+    def queue_timeout(self) -> float:
+        """Maximum seconds a request waits for a slot."""
+        return self._queue_timeout
+
+    @property
+    def in_flight(self) -> int:
+        """Number of slots currently held."""
+        return self._in_flight
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of requests waiting for a slot."""
+        return self._waiting
+
+    def try_acquire(self) -> bool:
+        """Take a slot without waiting; fails if the limit is reached or others are queued."""
+        if self._in_flight < self._limit and not self._waiting:
+            self._in_flight += 1
+            UPSTREAM_IN_FLIGHT.set(self._in_flight)
+            return True
+        return False
+
+    async def acquire(self, key: str) -> None:
+        """Wait for a slot, raising UpstreamQueueTimeout after the queue timeout."""
+        if self.try_acquire():
+            UPSTREAM_QUEUE_WAIT.observe(0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(key, deque()).append(future)
+        self._set_waiting(self._waiting + 1)
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self._queue_timeout)
+        except asyncio.TimeoutError:
+            if self._discard(key, future):
+                UPSTREAM_QUEUE_TIMEOUTS.inc()
+                raise UpstreamQueueTimeout(f"Upstream queue wait exceeded {self._queue_timeout}s")
+            # Slot was granted just as we timed out - keep it
+        except asyncio.CancelledError:
+            if not self._discard(key, future):
+                self.release()
+            raise
+        finally:
+            UPSTREAM_QUEUE_WAIT.observe(time.monotonic() - start)
+
+    def release(self) -> None:
+        """Release a slot, handing it to the next waiter in round-robin order."""
+        while self._queues:
+            key, queue = next(iter(self._queues.items()))
+            future = queue.popleft()
+            if queue:
+                self._queues.move_to_end(key)
+            else:
+                del self._queues[key]
+            self._set_waiting(self._waiting - 1)
+            if not future.done():
+                # Slot is transferred directly; in-flight count is unchanged
+                future.set_result(None)
+                return
+        self._in_flight -= 1
+        UPSTREAM_IN_FLIGHT.set(self._in_flight)
+
+    def _discard(self, key: str, future: asyncio.Future) -> bool:
+        """Remove a waiter from its queue; False if it was already granted a slot."""
+        queue = self._queues.get(key)
+        if queue is None or future not in queue:
+            return False
+        queue.remove(future)
+        if not queue:
+            del self._queues[key]
+        self._set_waiting(self._waiting - 1)
+        future.cancel()
+        return True
+
+    def _set_waiting(self, value: int) -> None:
+        self._waiting = value
+        UPSTREAM_QUEUE_DEPTH.set(value)
+
+
+# Global limiter instance
+upstream_limiter = FairLimiter(limit=UPSTREAM_MAX_CONCURRENCY, queue_timeout=UPSTREAM_QUEUE_TIMEOUT)
@@ -0,0 +1,108 @@
+"""
+Event Loop Monitor for GitHub Gists API
+Samples event-loop lag and, in debug mode, reports the stack of callbacks that block the loop
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+from prometheus_client import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment
+LOOP_LAG_INTERVAL = float(os.environ.get("LOOP_LAG_INTERVAL", 0.5))  # Seconds between lag samples
+LOOP_BLOCK_DEBUG = os.environ.get("LOOP_BLOCK_DEBUG", "false").lower() == "true"
+LOOP_BLOCK_THRESHOLD = float(os.environ.get("LOOP_BLOCK_THRESHOLD", 0.1))  # Seconds before a stall is reported
+
+# Prometheus metrics
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "Delay between when a loop timer was due and when it ran",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+EVENT_LOOP_BLOCKS = Counter(
+    "event_loop_blocked_total",
+    "Stalls longer than LOOP_BLOCK_THRESHOLD caught by the debug watchdog",
+)
+
+
+class LoopMonitor:
+    """
+    Measures how late the event loop runs a periodic timer.
+
+    With ``debug`` on, a watchdog thread also checks that the timer keeps
+    firing; when the loop stalls past ``block_threshold`` it logs the loop
+    thread's current stack, i.e. the code that is blocking it.
+    """
+
+    def __init__(self, interval: float, block_threshold: float, debug: bool = False):
+        self._debug = debug
+        self._threshold = block_threshold
+        # Beats must come often enough for the watchdog to notice a stall
+        self._tick = min(interval, block_threshold / 2) if debug else interval
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._loop_thread_id = 0
+        self._last_beat = time.monotonic()
+        self.lag = 0.0  # Most recent lag sample in seconds
+        self.last_block: Optional[str] = None  # Stack of the most recent reported stall
+
+    def start(self) -> None:
+        """Start sampling on the running loop (and the watchdog in debug mode)."""
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._sample())
+        if self._debug:
+            self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._watchdog.start()
+            logger.info("Event loop watchdog started (threshold %.3fs)", self._threshold)
+
+    async def stop(self) -> None:
+        """Stop sampling and the watchdog."""
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1)
+
+    async def _sample(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            due = loop.time() + self._tick
+            await asyncio.sleep(self._tick)
+            self.lag = max(0.0, loop.time() - due)
+            self._last_beat = time.monotonic()
+            EVENT_LOOP_LAG.observe(self.lag)
+
+    def _watch(self) -> None:
+        reported = False
+        while not self._stop.wait(self._tick):
+            stalled = time.monotonic() - self._last_beat - self._tick
+            if stalled < self._threshold:
+                reported = False
+                continue
+            if reported:
+                continue
+            reported = True
+            frame = sys._current_frames().get(self._loop_thread_id)  # pylint: disable=protected-access
+            if frame is None:
+                continue
+            self.last_block = "".join(traceback.format_stack(frame))
+            EVENT_LOOP_BLOCKS.inc()
+            logger.warning("Event loop blocked for %.3fs in:\n%s", stalled, self.last_block)
+
+
+# Global monitor instance (started from the app lifespan)
+loop_monitor = LoopMonitor(LOOP_LAG_INTERVAL, LOOP_BLOCK_THRESHOLD, debug=LOOP_BLOCK_DEBUG)
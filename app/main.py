@@ -6,22 +6,76 @@ Features:
 - Fetch public gists for any GitHub user
 - Pagination support (page, per_page parameters)
 - In-memory caching with TTL (5 minutes default)
+- Bounded upstream concurrency with per-user fair queueing
+- Full-history fetch (`/{username}/all`) with concurrent page fetches
+- Batch endpoint (`POST /batch`) for many usernames with a deadline
+- GraphQL upstream backend that fetches many users' gists per call
+- Gist file content proxy backed by a content-addressed disk store
+- Gist detail endpoint served from cached user lists via a gist id index
+- Filter query over cached gists by language, extension and date (`/gists/query`)
+- BM25 full-text search over cached gist descriptions and file names (`/gists/search`)
+- Per-user aggregate statistics (`/{username}/stats`) updated incrementally on refresh
+- Merged multi-user timeline (`/gists/timeline`) with cursor pagination
+- Organization-wide gist fan-out (`/orgs/{org}/gists`) streamed within a GitHub call budget
+- Low-priority next-page prefetch with accuracy and latency-saved metrics
+- Sparse fieldsets (`fields=`) to project gists down to the fields a client needs
+- Per-stage latency histograms and `Server-Timing` response headers
+- OpenTelemetry tracing with ratio sampling, slow/errored traces always kept,
+  and cache lookup, upstream fetch and serialize child spans
+- Event-loop lag histogram and an optional blocking-call watchdog
+- Adaptive admission control that sheds load with a fast 503, preferring cache hits
+- Per-client token-bucket rate limits, stricter for `use_cache=false`
+- Token-protected sampling profiler (`/admin/profile`) returning collapsed stacks
+- Memory introspection (`/admin/memory`): per-user cache size estimates and tracemalloc diffs
 - Prometheus metrics for observability
 - GitHub token support for higher rate limits
 """
+import asyncio
+import base64
+import gzip
 from contextlib import asynccontextmanager
 from dataclasses import dataclass, field
+from functools import lru_cache
+import heapq
+import hmac
+from itertools import islice
+import json
 import logging
 import os
+from pathlib import Path as FilePath
+import re
+from urllib.parse import parse_qs
 import time
-from typing import Any, Dict, List, Optional
+import tracemalloc
+from typing import Annotated, Any, AsyncGenerator, AsyncIterator, Dict, FrozenSet, List, Optional, Protocol, Set, Tuple
 
 import httpx
 from fastapi import FastAPI, HTTPException, Path, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, PlainTextResponse
-from pydantic import BaseModel
-from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, TypeAdapter
+from starlette.routing import Match
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from app import github_graphql, timing, tracing
+from app.admission import AdmissionMiddleware, admission_controller
+from app.content_store import ContentTooLarge, content_store
+from app.indexes import filter_index, gist_index, search_index
+from app.limiter import UpstreamQueueTimeout, upstream_limiter
+from app.loop_monitor import loop_monitor
+from app.memory import TRACEMALLOC_MAX_FRAMES, allocation_tracker, cache_sizer, rss_bytes
+from app.profiler import PROFILE_MAX_RATE, PROFILE_MAX_SECONDS, ProfilerBusy, collapse, profiler
+from app.rate_limit import RateLimitMiddleware, bypass_buckets, bypasses_cache, json_body, normal_buckets
+from app.user_stats import user_stats
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -30,6 +84,26 @@ GITHUB_API_URL = "https://api.github.com"
 GITHUB_TOKEN = os.environ.get("GITHUB_TOKEN")
 TIMEOUT = 10.0
 CACHE_TTL = int(os.environ.get("CACHE_TTL", 300))  # 5 minutes default
+CACHE_STALE_TTL = int(os.environ.get("CACHE_STALE_TTL", 300))  # Stale data kept for degraded responses
+CACHE_SWEEP_INTERVAL = int(os.environ.get("CACHE_SWEEP_INTERVAL", 60))  # Seconds between expiry sweeps
+FULL_HISTORY_PER_PAGE = 100  # GitHub maximum
+FULL_HISTORY_CONCURRENCY = int(os.environ.get("FULL_HISTORY_CONCURRENCY", 4))
+FULL_HISTORY_MAX_GISTS = int(os.environ.get("FULL_HISTORY_MAX_GISTS", 3000))
+BATCH_MAX_USERS = int(os.environ.get("BATCH_MAX_USERS", 200))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", 10))
+BATCH_DEADLINE = float(os.environ.get("BATCH_DEADLINE", 8.0))
+UPSTREAM_BACKEND = os.environ.get("UPSTREAM_BACKEND", "auto").lower()  # auto, rest or graphql
+GRAPHQL_MIN_USERS = int(os.environ.get("GRAPHQL_MIN_USERS", 3))  # Batch size at which auto picks GraphQL
+PREFETCH_ENABLED = os.environ.get("PREFETCH_ENABLED", "true").lower() == "true"
+ORG_FANOUT_CONCURRENCY = int(os.environ.get("ORG_FANOUT_CONCURRENCY", 8))  # Members fetched at once
+ORG_CALL_BUDGET = int(os.environ.get("ORG_CALL_BUDGET", 200))  # Default upstream calls per org request
+ORG_MAX_CALL_BUDGET = int(os.environ.get("ORG_MAX_CALL_BUDGET", 1000))
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")  # Set for multi-worker aggregation
+METRICS_MIN_INTERVAL = float(os.environ.get("METRICS_MIN_INTERVAL", 1.0))  # Seconds an exposition is reused
+METRICS_GZIP = os.environ.get("METRICS_GZIP", "true").lower() == "true"
+TIMELINE_MAX_USERS = int(os.environ.get("TIMELINE_MAX_USERS", 50))
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")  # Bearer token for /admin endpoints; unset disables them
+PREFETCH_MIN_RATE_REMAINING = int(os.environ.get("PREFETCH_MIN_RATE_REMAINING", 100))  # GitHub quota kept in reserve
 
 
 # ============================================================================
@@ -42,14 +116,33 @@ class CacheEntry:
     expires_at: float
 
 
+class CacheListener(Protocol):
+    """Receives cache writes and removals (used to maintain secondary indexes)."""
+
+    def on_set(self, key: str, value: Any) -> None: ...
+
+    def on_evict(self, key: str, value: Any) -> None: ...
+
+
 class SimpleCache:
-    """Simple in-memory cache with TTL support."""
+    """Simple in-memory cache with TTL support.
+
+    Expired entries are kept for an extra ``stale_ttl`` seconds so that
+    ``get_stale`` can serve them when GitHub is unavailable or overloaded.
+    Subscribed listeners are told about every set and every removal.
+    """
     
-    def __init__(self, default_ttl: int = 300):
+    def __init__(self, default_ttl: int = 300, stale_ttl: int = 0):
         self._cache: Dict[str, CacheEntry] = {}
         self._default_ttl = default_ttl
+        self._stale_ttl = stale_ttl
         self._hits = 0
         self._misses = 0
+        self._listeners: List[CacheListener] = []
+    
+    def subscribe(self, listener: CacheListener) -> None:
+        """Register a listener for sets and evictions."""
+        self._listeners.append(listener)
     
     def get(self, key: str) -> Optional[Any]:
         """Get value from cache if exists and not expired."""
@@ -58,33 +151,67 @@ class SimpleCache:
             self._misses += 1
             return None
         
-        if time.time() > entry.expires_at:
-            del self._cache[key]
+        now = time.time()
+        if now > entry.expires_at:
+            if now > entry.expires_at + self._stale_ttl:
+                self._evict(key)
             self._misses += 1
             return None
         
         self._hits += 1
         return entry.data
     
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """Look up several keys in one pass; returns only fresh hits."""
+        found = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                found[key] = value
+        return found
+    
+    def get_stale(self, key: str) -> Optional[Any]:
+        """Get value even if expired, as long as it is within the stale window."""
+        entry = self._cache.get(key)
+        if entry is None or time.time() > entry.expires_at + self._stale_ttl:
+            return None
+        return entry.data
+    
+    def is_fresh(self, key: str) -> bool:
+        """True if the key holds an unexpired entry (does not count as a hit or miss)."""
+        entry = self._cache.get(key)
+        return entry is not None and time.time() <= entry.expires_at
+    
     def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
         """Set value in cache with TTL."""
+        if key in self._cache:
+            self._evict(key)
         expires_at = time.time() + (ttl or self._default_ttl)
         self._cache[key] = CacheEntry(data=value, expires_at=expires_at)
+        for listener in self._listeners:
+            listener.on_set(key, value)
     
     def clear(self) -> None:
         """Clear all cache entries."""
-        self._cache.clear()
+        for key in list(self._cache):
+            self._evict(key)
         self._hits = 0
         self._misses = 0
     
     def cleanup_expired(self) -> int:
         """Remove expired entries and return count of removed items."""
         now = time.time()
-        expired_keys = [k for k, v in self._cache.items() if now > v.expires_at]
+        expired_keys = [k for k, v in self._cache.items() if now > v.expires_at + self._stale_ttl]
         for key in expired_keys:
-            del self._cache[key]
+            self._evict(key)
         return len(expired_keys)
     
+    def _evict(self, key: str) -> None:
+        """Remove an entry and notify listeners."""
+        entry = self._cache.pop(key)
+        for listener in self._listeners:
+            listener.on_evict(key, entry.data)
+    
     @property
     def stats(self) -> Dict[str, Any]:
         """Return cache statistics."""
@@ -97,7 +224,10 @@ class SimpleCache:
 
 
 # Global cache instance
-gists_cache = SimpleCache(default_ttl=CACHE_TTL)
+gists_cache = SimpleCache(default_ttl=CACHE_TTL, stale_ttl=CACHE_STALE_TTL)
+gists_cache.subscribe(gist_index)
+gists_cache.subscribe(user_stats)
+gists_cache.subscribe(cache_sizer)
 
 # Prometheus metrics
 REQUEST_COUNT = Counter(
@@ -113,6 +243,7 @@ REQUEST_LATENCY = Histogram(
 ACTIVE_REQUESTS = Gauge(
     "http_requests_active",
     "Currently active HTTP requests",
+    multiprocess_mode="livesum",
 )
 GITHUB_API_REQUESTS = Counter(
     "github_api_requests_total",
@@ -127,6 +258,20 @@ CACHE_MISSES = Counter(
     "cache_misses_total",
     "Total cache misses",
 )
+PREFETCHES = Counter(
+    "prefetch_requests_total",
+    "Next-page prefetch attempts by result",
+    ["result"],
+)
+PREFETCH_OUTCOMES = Counter(
+    "prefetch_outcomes_total",
+    "Prefetched pages that were served (used) or evicted unserved (wasted)",
+    ["outcome"],
+)
+PREFETCH_LATENCY_SAVED = Histogram(
+    "prefetch_latency_saved_seconds",
+    "Upstream latency avoided by serving a prefetched page",
+)
 
 
 class GistInfo(BaseModel):
@@ -139,6 +284,15 @@ class GistInfo(BaseModel):
     files: Dict[str, Any]
 
 
+class UpstreamGist(GistInfo):
+    """Gist as returned by the GitHub API (``html_url`` becomes ``url``)."""
+
+    url: str = Field(validation_alias="html_url")
+
+
+UPSTREAM_GISTS_ADAPTER = TypeAdapter(List[UpstreamGist])
+
+
 class HealthResponse(BaseModel):
     """Health check response"""
 
@@ -154,6 +308,68 @@ class PaginatedResponse(BaseModel):
     cache: Dict[str, Any]
 
 
+# GitHub login: alphanumerics and hyphens, at most 39 characters. Anything else
+# (slashes, dot segments) would change the upstream path the name is spliced into.
+USERNAME_PATTERN = r"^[A-Za-z0-9](?:[A-Za-z0-9-]{0,38})$"
+
+
+class BatchRequest(BaseModel):
+    """Batch request for several users' gists"""
+
+    usernames: List[Annotated[str, Field(pattern=USERNAME_PATTERN)]] = Field(
+        ..., min_length=1, max_length=BATCH_MAX_USERS
+    )
+    page: int = Field(1, ge=1, le=100)
+    per_page: int = Field(30, ge=1, le=100)
+    use_cache: bool = True
+    deadline_seconds: float = Field(BATCH_DEADLINE, gt=0, le=60)
+
+
+class BatchResult(BaseModel):
+    """Per-user batch result: either data or an error"""
+
+    data: Optional[List[GistInfo]] = None
+    pagination: Optional[Dict[str, Any]] = None
+    cache: Optional[Dict[str, Any]] = None
+    error: Optional[Dict[str, Any]] = None
+
+
+class BatchResponse(BaseModel):
+    """Batch response keyed by username"""
+
+    results: Dict[str, BatchResult]
+    partial: bool
+
+
+class UserStatsResponse(BaseModel):
+    """Aggregate statistics over a user's gist history"""
+
+    username: str
+    gist_count: int
+    total_files: int
+    total_file_size: int
+    languages: Dict[str, int]
+    files_per_gist: Dict[str, int]
+    mean_files_per_gist: float
+    activity: Dict[str, int]
+    truncated: bool
+    cache: Dict[str, Any]
+
+
+class TimelineGist(GistInfo):
+    """Gist tagged with the user whose list it came from"""
+
+    username: str
+
+
+class TimelineResponse(BaseModel):
+    """Merged timeline page with an opaque continuation cursor"""
+
+    data: List[TimelineGist]
+    next_cursor: Optional[str]
+    errors: Dict[str, Dict[str, Any]]
+
+
 class CacheStatsResponse(BaseModel):
     """Cache statistics response"""
     
@@ -164,10 +380,65 @@ class CacheStatsResponse(BaseModel):
     ttl_seconds: int
 
 
+class CacheOwnerSize(BaseModel):
+    """Estimated cache memory held for one username"""
+
+    username: str
+    entries: int
+    estimated_bytes: int
+
+
+class AllocationSite(BaseModel):
+    """Allocation growth at one source line between two tracemalloc snapshots"""
+
+    location: str
+    size_diff: int
+    size: int
+    count_diff: int
+    count: int
+
+
+class MemoryResponse(BaseModel):
+    """Memory introspection response"""
+
+    rss_bytes: Optional[int]
+    cache_entries: int
+    cache_estimated_bytes: int
+    cache_by_username: List[CacheOwnerSize]
+    metric_series: int
+    tracemalloc: bool
+    traced_bytes: int = 0
+    traced_peak_bytes: int = 0
+    top_allocations: List[AllocationSite] = []
+
+
 # Shared HTTP client
 http_client: httpx.AsyncClient | None = None
 
 
+def _http_client() -> httpx.AsyncClient:
+    """The shared client; raises 500 until startup has created it."""
+
+    if http_client is None:
+        raise HTTPException(status_code=500, detail="Service not ready")
+    return http_client
+
+
+# Last X-RateLimit-Remaining seen from GitHub (None until the first response)
+github_rate_remaining: Optional[int] = None
+
+
+async def _sweep_cache() -> None:
+    """Periodically drop expired cache entries so indexes see expirations promptly."""
+
+    while True:
+        await asyncio.sleep(CACHE_SWEEP_INTERVAL)
+        gist_index.expire(gists_cache.is_fresh)
+        removed = gists_cache.cleanup_expired()
+        if removed:
+            logger.info("Cache sweep removed %d expired entries", removed)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Initialize HTTP client on startup and close on shutdown."""
@@ -185,10 +456,17 @@ async def lifespan(app: FastAPI):
         follow_redirects=True,
         headers=headers,
     )
+    sweeper = asyncio.create_task(_sweep_cache())
+    loop_monitor.start()
     logger.info("App started")
     try:
         yield
     finally:
+        sweeper.cancel()
+        await loop_monitor.stop()
+        if PROMETHEUS_MULTIPROC_DIR:
+            # Drop this worker's live gauges from the aggregate
+            multiprocess.mark_process_dead(os.getpid())
         if http_client:
             await http_client.aclose()
         logger.info("App stopped")
@@ -200,49 +478,215 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+# Browser access. Allowed origins may also read the timing headers (Server-Timing and resource timing)
+CORS_ALLOW_ORIGINS = ["*"]  # Allow all origins for development
+CORS_EXPOSE_HEADERS = [
+    "Server-Timing", "Retry-After", "X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset",
+]
+
+
+def _timing_allow_origin(scope: Dict[str, Any]) -> Optional[bytes]:
+    """The request's ``Origin`` if it is allowed, for ``Timing-Allow-Origin``."""
+
+    for name, value in scope["headers"]:
+        if name == b"origin":
+            allowed = "*" in CORS_ALLOW_ORIGINS or value.decode("latin-1") in CORS_ALLOW_ORIGINS
+            return value if allowed else None
+    return None
+
+
+# Label values for requests that match no route, and for unexpected methods
+UNMATCHED_ROUTE = "unmatched"
+KNOWN_METHODS = frozenset({"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"})
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording request count, latency and in-flight gauge.
+
+    Requests are labelled by route template (``/{username}``), read from
+    ``scope["route"]`` once routing has run (or matched here for requests
+    an inner middleware answered before routing), so the number of series
+    is bounded by the number of routes rather than by distinct URLs. Stage
+    timings collected during the request are added as a ``Server-Timing``
+    header (with ``Timing-Allow-Origin`` for allowed browser origins) and
+    observed per stage.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        stages = timing.begin_request()
+        timing_origin = _timing_allow_origin(scope)
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                timing.response_started(stages)
+                if timing.SERIALIZE in stages:
+                    tracing.record_span("serialize", stages[timing.SERIALIZE])
+                header = timing.server_timing(stages, time.perf_counter() - start_time)
+                message["headers"] = [*message.get("headers", ()), (b"server-timing", header)]
+                if timing_origin is not None:
+                    message["headers"].append((b"timing-allow-origin", timing_origin))
+            await send(message)
+
+        ACTIVE_REQUESTS.inc()
+        start_time = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start_time
+            ACTIVE_REQUESTS.dec()
+            endpoint = _route_template(scope)
+            method = scope["method"] if scope["method"] in KNOWN_METHODS else "OTHER"
+            REQUEST_COUNT.labels(method=method, endpoint=endpoint, status=status_code).inc()
+            REQUEST_LATENCY.labels(method=method, endpoint=endpoint).observe(duration)
+            timing.observe(endpoint, stages)
+
+
+def _route_template(scope: Dict[str, Any]) -> str:
+    """Path template of the route serving ``scope``, else UNMATCHED_ROUTE."""
+
+    route = scope.get("route")
+    if route is None:
+        # Shed or rate-limited before routing; match here so those responses keep their endpoint label
+        route = next((r for r in app.router.routes if r.matches(scope)[0] is Match.FULL), None)
+    return getattr(route, "path", UNMATCHED_ROUTE)
+
+
+def _likely_cache_hit(scope: Dict[str, Any]) -> bool:
+    """
+    Guess from the path and query whether a request can be served without GitHub.
+
+    Used by admission control to keep serving cache hits when shedding load.
+    """
+
+    if bypasses_cache(scope):
+        return False
+    params = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    parts = scope["path"].strip("/").split("/")
+    if len(parts) == 2 and parts[0] == "gists" and parts[1] in ("query", "search"):
+        return True
+    try:
+        if len(parts) == 1 and parts[0] and "cursor" not in params:
+            page = int(params.get("page", ["1"])[0])
+            per_page = int(params.get("per_page", ["30"])[0])
+            return gists_cache.is_fresh(f"gists:{parts[0]}:page{page}:per_page{per_page}")
+    except ValueError:
+        return False
+    if len(parts) == 1 or (len(parts) == 2 and parts[1] in ("all", "stats")):
+        return gists_cache.is_fresh(f"gists:{parts[0]}:all")
+    return False
+
+
+def _request_cost(scope: Dict[str, Any], body: bytes) -> int:
+    """
+    Rate-limit tokens for a request: the users or GitHub calls it can fan out to.
+
+    Batch and timeline requests pay per username and org requests per
+    budgeted call; everything else costs one token. Malformed requests cost
+    one token and are rejected by validation.
+    """
+
+    path = scope["path"]
+    try:
+        if path == "/batch":
+            usernames = json_body(body).get("usernames")
+            return max(1, len(set(usernames))) if isinstance(usernames, list) else 1
+        params = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        if path == "/gists/timeline":
+            return max(1, len({u.strip() for u in params.get("usernames", [""])[0].split(",") if u.strip()}))
+        parts = path.strip("/").split("/")
+        if len(parts) == 3 and parts[0] == "orgs" and parts[2] == "gists":
+            return max(1, int(params.get("budget", [ORG_CALL_BUDGET])[0]))
+    except (TypeError, ValueError):
+        pass
+    return 1
+
+
+# Middleware, innermost first (each one added wraps those before it).
+# Shed requests are rejected before any other work, but still counted and given CORS headers
+app.add_middleware(AdmissionMiddleware, controller=admission_controller, is_cache_hit=_likely_cache_hit)
+# Outside admission, so a client over its rate never takes an admission slot
+app.add_middleware(RateLimitMiddleware, normal=normal_buckets, bypass=bypass_buckets, cost=_request_cost)
+app.add_middleware(MetricsMiddleware)
 # Add CORS middleware to allow browser requests
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # Allow all origins for development
+    allow_origins=CORS_ALLOW_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=CORS_EXPOSE_HEADERS,
 )
+# OpenTelemetry wraps the whole stack; a no-op unless installed and OTEL_ENABLED
+tracing.setup_tracing(app)
 
 
-@app.middleware("http")
-async def metrics_middleware(request: Request, call_next):
-    """Middleware to track request metrics."""
+def _metrics_registry() -> CollectorRegistry:
+    """Registry to expose: all workers' files in multiprocess mode, else this process."""
 
-    ACTIVE_REQUESTS.inc()
-    start_time = time.time()
-    try:
-        response = await call_next(request)
-        duration = time.time() - start_time
+    if not PROMETHEUS_MULTIPROC_DIR:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
 
-        REQUEST_COUNT.labels(
-            method=request.method,
-            endpoint=request.url.path,
-            status=response.status_code,
-        ).inc()
 
-        REQUEST_LATENCY.labels(
-            method=request.method,
-            endpoint=request.url.path,
-        ).observe(duration)
+class MetricsExposition:
+    """Encoded /metrics output, regenerated at most once per ``min_interval``."""
+
+    def __init__(self, registry: CollectorRegistry, min_interval: float):
+        self._registry = registry
+        self._min_interval = min_interval
+        self._generated_at = float("-inf")
+        self._body = b""
+        self._gzipped: Optional[bytes] = None
+
+    def render(self, want_gzip: bool) -> bytes:
+        """Return the exposition, gzip-compressed if requested."""
+
+        now = time.monotonic()
+        if now - self._generated_at >= self._min_interval:
+            self._body = generate_latest(self._registry)
+            self._gzipped = None
+            self._generated_at = now
+        if not want_gzip:
+            return self._body
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self._body, compresslevel=5)
+        return self._gzipped
 
-        return response
-    finally:
-        ACTIVE_REQUESTS.dec()
+
+metrics_exposition = MetricsExposition(_metrics_registry(), METRICS_MIN_INTERVAL)
 
 
 @app.get("/metrics")
-async def metrics():
-    """Prometheus metrics endpoint."""
+async def metrics(request: Request):
+    """
+    Prometheus metrics endpoint.
+
+    The encoded output is reused for METRICS_MIN_INTERVAL seconds and
+    gzip-compressed when the scraper accepts it. With PROMETHEUS_MULTIPROC_DIR
+    set, metrics from every worker are aggregated.
+    """
 
-    return PlainTextResponse(
-        content=generate_latest().decode("utf-8"),
+    want_gzip = METRICS_GZIP and "gzip" in request.headers.get("accept-encoding", "")
+    headers = {"Vary": "Accept-Encoding"}
+    if want_gzip:
+        headers["Content-Encoding"] = "gzip"
+    return Response(
+        content=metrics_exposition.render(want_gzip),
         media_type=CONTENT_TYPE_LATEST,
+        headers=headers,
     )
 
 
@@ -281,13 +725,1387 @@ async def clear_cache():
     return {"message": "Cache cleared successfully"}
 
 
+# ============================================================================
+# Admin Endpoints
+# ============================================================================
+def _require_admin(request: Request) -> None:
+    """Reject the request unless it carries ``Authorization: Bearer <ADMIN_TOKEN>``."""
+
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token", headers={"WWW-Authenticate": "Bearer"})
+
+
+@app.get("/admin/profile", response_class=PlainTextResponse)
+async def profile(
+    request: Request,
+    seconds: float = Query(10.0, gt=0, le=PROFILE_MAX_SECONDS, description="How long to sample"),
+    rate: int = Query(100, ge=1, le=PROFILE_MAX_RATE, description="Samples per second"),
+) -> PlainTextResponse:
+    """
+    Sample the stacks of all threads for `seconds` and return collapsed stacks.
+
+    Each line is `thread;outermost;...;innermost count`, ready for
+    `flamegraph.pl` or speedscope. The event loop thread shows up as
+    `MainThread`; while it waits in `select` the service is idle. Sampling
+    runs in a separate thread, so the service keeps serving meanwhile.
+    Requires `Authorization: Bearer <ADMIN_TOKEN>`.
+    """
+
+    _require_admin(request)
+    try:
+        stacks, passes = await asyncio.to_thread(profiler.profile, seconds, rate)
+    except ProfilerBusy:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    logger.info("Profiled %d threads for %.1fs (%d samples)", len({s[0] for s in stacks}), seconds, passes)
+    return PlainTextResponse(collapse(stacks), headers={"X-Profile-Samples": str(passes)})
+
+
+@app.get("/admin/memory", response_model=MemoryResponse)
+async def memory(
+    request: Request,
+    top: int = Query(20, ge=1, le=200, description="Usernames and allocation sites to list"),
+) -> MemoryResponse:
+    """
+    Report where memory goes: cache size by username, metric series and allocation growth.
+
+    Cache sizes are deep-size estimates kept up to date as entries are set
+    and evicted. While tracemalloc is on (`POST /admin/memory/tracemalloc`),
+    `top_allocations` lists the source lines whose allocations grew most
+    since the previous call. Requires `Authorization: Bearer <ADMIN_TOKEN>`.
+    """
+
+    _require_admin(request)
+    report = MemoryResponse(
+        rss_bytes=rss_bytes(),
+        cache_entries=len(cache_sizer),
+        cache_estimated_bytes=cache_sizer.total_bytes,
+        cache_by_username=[
+            CacheOwnerSize(username=owner, entries=entries, estimated_bytes=size)
+            for owner, entries, size in cache_sizer.top(top)
+        ],
+        metric_series=sum(len(metric.samples) for metric in REGISTRY.collect()),
+        tracemalloc=allocation_tracker.tracing,
+    )
+    if allocation_tracker.tracing:
+        report.traced_bytes, report.traced_peak_bytes = tracemalloc.get_traced_memory()
+        report.top_allocations = [AllocationSite(**site) for site in allocation_tracker.diff(top)]
+    return report
+
+
+@app.post("/admin/memory/tracemalloc")
+async def toggle_tracemalloc(
+    request: Request,
+    enabled: bool = Query(..., description="Start (`true`) or stop (`false`) allocation tracing"),
+    frames: int = Query(1, ge=1, le=TRACEMALLOC_MAX_FRAMES, description="Stack frames stored per allocation"),
+):
+    """
+    Start or stop tracemalloc.
+
+    Tracing slows allocation-heavy code noticeably and costs memory per live
+    allocation, so leave it on only while investigating. Requires
+    `Authorization: Bearer <ADMIN_TOKEN>`.
+    """
+
+    _require_admin(request)
+    if enabled:
+        allocation_tracker.start(frames)
+    else:
+        allocation_tracker.stop()
+    logger.info("tracemalloc %s", "started" if enabled else "stopped")
+    return {"tracemalloc": allocation_tracker.tracing}
+
+
+def _parse_link_header(link_header: str) -> Dict[str, str]:
+    """Parse a GitHub ``Link`` header into a ``{rel: url}`` mapping."""
+
+    links = {}
+    for part in link_header.split(","):
+        url, _, params = part.partition(";")
+        url = url.strip()
+        if not url.startswith("<") or not url.endswith(">"):
+            continue
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "rel":
+                links[value.strip('"')] = url[1:-1]
+    return links
+
+
+def _page_number(url: Optional[str]) -> Optional[int]:
+    """Extract the ``page`` query parameter from a Link URL."""
+
+    if not url:
+        return None
+    page = httpx.URL(url).params.get("page")
+    return int(page) if page and page.isdigit() else None
+
+
+async def _github_get(
+    url: str,
+    queue_key: str,
+    not_found: str,
+    params: Optional[Dict[str, Any]] = None,
+    low_priority: bool = False,
+) -> Tuple[bytes, httpx.Headers]:
+    """
+    GET a GitHub URL, waiting for a fair upstream slot first.
+
+    Returns the raw body and headers. Upstream errors are translated to
+    HTTPException (``not_found`` is the 404 detail); UpstreamQueueTimeout is
+    left for the caller so it can fall back to stale data. Low-priority
+    requests never queue: they raise UpstreamQueueTimeout unless a slot is idle.
+    """
+
+    global github_rate_remaining
+    span_attributes = {"github.queue_key": queue_key, "github.low_priority": low_priority}
+    with tracing.create_span("github.fetch", span_attributes) as span:
+        try:
+            if low_priority:
+                if not upstream_limiter.try_acquire():
+                    raise UpstreamQueueTimeout("No idle upstream slot for low-priority request")
+            else:
+                with timing.stage(timing.UPSTREAM_QUEUE):
+                    await upstream_limiter.acquire(queue_key)
+            try:
+                sent_at = time.perf_counter()
+                async with _http_client().stream("GET", url, params=params) as response:
+                    timing.record(timing.UPSTREAM_WAIT, time.perf_counter() - sent_at)
+                    GITHUB_API_REQUESTS.labels(status=response.status_code).inc()
+                    span.set_attribute("http.status_code", response.status_code)
+                    remaining = response.headers.get("X-RateLimit-Remaining")
+                    if remaining is not None and remaining.isdigit():
+                        github_rate_remaining = int(remaining)
+
+                    if response.status_code == 404:
+                        logger.warning("Not found: %s", url)
+                        raise HTTPException(status_code=404, detail=not_found)
+
+                    if response.status_code == 403:
+                        logger.error("GitHub API rate limit exceeded")
+                        raise HTTPException(
+                            status_code=429,
+                            detail="GitHub API rate limit exceeded. Please try again later.",
+                        )
+
+                    response.raise_for_status()
+                    with timing.stage(timing.UPSTREAM_TRANSFER):
+                        body = await response.aread()
+            finally:
+                upstream_limiter.release()
+
+        except (HTTPException, UpstreamQueueTimeout):
+            raise
+        except httpx.TimeoutException:
+            logger.error("Timeout fetching %s", url)
+            raise HTTPException(status_code=504, detail="GitHub API timeout")
+        except httpx.HTTPStatusError as exc:
+            logger.error("HTTP error: %s", exc)
+            raise HTTPException(
+                status_code=exc.response.status_code,
+                detail=f"GitHub error: {exc.response.status_code}",
+            )
+        except Exception as exc:  # pylint: disable=broad-except
+            logger.error("Error: %s", exc)
+            raise HTTPException(status_code=500, detail="Internal error")
+
+    return body, response.headers
+
+
+async def _fetch_gists_page(username: str, page: int, per_page: int, low_priority: bool = False) -> Dict[str, Any]:
+    """
+    Fetch one page of a user's gists from GitHub.
+
+    The body is validated straight from bytes, which is cheaper in CPU and
+    Python heap than ``response.json()`` but peaks higher in RSS while parsing.
+    """
+
+    logger.info("Fetching gists for %s (page %d, per_page %d)", username, page, per_page)
+    body, headers = await _github_get(
+        f"{GITHUB_API_URL}/users/{username}/gists",
+        queue_key=username,
+        not_found=f"User '{username}' not found",
+        params={"page": page, "per_page": per_page},
+        low_priority=low_priority,
+    )
+
+    # Validate straight from bytes - fields GistInfo doesn't expose are skipped
+    # without ever becoming Python objects. pydantic-core parses the whole body
+    # into a tree outside the Python heap first, hence the higher RSS peak
+    # (about 44MB vs 28MB for a 7MB body; GitHub pages are at most a few hundred KB)
+    with timing.stage(timing.PARSE):
+        gists = UPSTREAM_GISTS_ADAPTER.validate_json(body)
+
+    # Parse Link header for pagination info
+    links = _parse_link_header(headers.get("Link", ""))
+
+    pagination_info = {
+        "page": page,
+        "per_page": per_page,
+        "count": len(gists),
+        "has_next": "next" in links,
+        "has_prev": "prev" in links,
+        "last_page": _page_number(links.get("last")) or page,
+    }
+
+    logger.info("Found %d gists for %s (page %d)", len(gists), username, page)
+    return {"gists": gists, "pagination": pagination_info}
+
+
+async def _load_gist(gist_id: str) -> GistInfo:
+    """
+    Return a single gist from the cache or GitHub (``GET /gists/{gist_id}``).
+
+    File contents included in the upstream response are dropped before caching.
+    """
+
+    cache_key = f"gist:{gist_id}"
+    cached_data = gists_cache.get(cache_key)
+    if cached_data is not None:
+        CACHE_HITS.inc()
+        return cached_data["gists"][0]
+
+    CACHE_MISSES.inc()
+    logger.info("Fetching gist %s", gist_id)
+    try:
+        body, _ = await _github_get(
+            f"{GITHUB_API_URL}/gists/{gist_id}",
+            queue_key=gist_id,
+            not_found=f"Gist '{gist_id}' not found",
+        )
+    except UpstreamQueueTimeout:
+        return _serve_stale_or_503(cache_key)[0]["gists"][0]
+
+    gist = UpstreamGist.model_validate_json(body)
+    gist.files = {
+        name: {k: v for k, v in file_info.items() if k not in ("content", "truncated")}
+        for name, file_info in gist.files.items()
+    }
+    gists_cache.set(cache_key, {"gists": [gist]})
+    return gist
+
+
+async def _find_gist(gist_id: str) -> GistInfo:
+    """Return a gist from any cached list via the id index, else from GitHub."""
+
+    gist = gist_index.get(gist_id, gists_cache.is_fresh)
+    if gist is not None:
+        return gist
+    return await _load_gist(gist_id)
+
+
+# In-progress content downloads, so concurrent requests share one fetch
+_content_downloads: Dict[str, "asyncio.Task[FilePath]"] = {}
+
+
+async def _download_content(raw_url: str, queue_key: str) -> FilePath:
+    """Stream a raw gist file from GitHub into the content store."""
+
+    try:
+        await upstream_limiter.acquire(queue_key)
+        try:
+            async with _http_client().stream("GET", raw_url) as response:
+                GITHUB_API_REQUESTS.labels(status=response.status_code).inc()
+                response.raise_for_status()
+                return await content_store.store(raw_url, response.aiter_bytes())
+        finally:
+            upstream_limiter.release()
+    except ContentTooLarge:
+        raise HTTPException(status_code=413, detail="Gist file is too large to proxy")
+    except UpstreamQueueTimeout:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many pending GitHub requests. Please try again later.",
+            headers={"Retry-After": str(max(1, int(upstream_limiter.queue_timeout)))},
+        )
+    except httpx.TimeoutException:
+        logger.error("Timeout fetching %s", raw_url)
+        raise HTTPException(status_code=504, detail="GitHub API timeout")
+    except httpx.HTTPError as exc:
+        logger.error("Error fetching %s: %s", raw_url, exc)
+        raise HTTPException(status_code=502, detail="Failed to fetch gist file from GitHub")
+
+
+async def _load_content(raw_url: str, queue_key: str) -> FilePath:
+    """Return the on-disk path for a raw gist file, downloading it once if needed."""
+
+    path = content_store.lookup(raw_url)
+    if path is not None:
+        return path
+
+    task = _content_downloads.get(raw_url)
+    if task is None:
+        task = asyncio.create_task(_download_content(raw_url, queue_key))
+        _content_downloads[raw_url] = task
+        task.add_done_callback(lambda _: _content_downloads.pop(raw_url, None))
+    return await asyncio.shield(task)
+
+
+def _serve_stale_or_503(cache_key: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Degrade after an upstream queue timeout: stale cached data, else 503."""
+
+    stale_data = gists_cache.get_stale(cache_key)
+    if stale_data is not None:
+        logger.warning("Upstream queue full - serving stale data for %s", cache_key)
+        return stale_data, {"hit": True, "stale": True, "ttl_seconds": CACHE_TTL}
+    logger.error("Upstream queue full - no stale data for %s", cache_key)
+    raise HTTPException(
+        status_code=503,
+        detail="Too many pending GitHub requests. Please try again later.",
+        headers={"Retry-After": str(max(1, int(upstream_limiter.queue_timeout)))},
+    )
+
+
+async def _load_gists_page(
+    username: str, page: int, per_page: int, use_cache: bool = True
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Return one page of gists from the cache or GitHub.
+
+    Returns the cached payload (``gists`` and ``pagination``) together with the
+    cache metadata for the response. When no upstream slot frees up within the
+    queue timeout, stale cached data is served instead, or a 503 is raised.
+    """
+
+    # Generate cache key
+    cache_key = f"gists:{username}:page{page}:per_page{per_page}"
+
+    # Check cache first
+    if use_cache:
+        with timing.stage(timing.CACHE), tracing.create_span("cache.lookup", {"cache.key": cache_key}) as span:
+            cached_data = gists_cache.get(cache_key)
+            span.set_attribute("cache.hit", cached_data is not None)
+        if cached_data is not None:
+            logger.info("Cache hit for %s (page %d)", username, page)
+            CACHE_HITS.inc()
+            prefetch_tracker.consume(cache_key)
+            return cached_data, {"hit": True, "ttl_seconds": CACHE_TTL}
+
+        # A prefetch of this page is already on its way; wait for it rather than fetching twice
+        prefetch = prefetch_tracker.in_flight(cache_key)
+        if prefetch is not None:
+            with timing.stage(timing.UPSTREAM_WAIT):
+                await asyncio.wait((prefetch,))  # Its errors are its own; a failed prefetch falls through
+            cached_data = gists_cache.get(cache_key)
+            if cached_data is not None:
+                CACHE_HITS.inc()
+                prefetch_tracker.consume(cache_key)
+                return cached_data, {"hit": True, "ttl_seconds": CACHE_TTL}
+
+    CACHE_MISSES.inc()
+
+    try:
+        data = await _fetch_gists_page(username, page, per_page)
+    except UpstreamQueueTimeout:
+        return _serve_stale_or_503(cache_key)
+
+    # Cache the result
+    gists_cache.set(cache_key, data)
+    return data, {"hit": False, "ttl_seconds": CACHE_TTL}
+
+
+async def _iter_all_gist_pages(username: str) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    Yield a user's gist pages from GitHub in page order.
+
+    Page 1 is fetched first to learn the last page from the ``Link`` header;
+    the remaining pages are then fetched concurrently (at most
+    FULL_HISTORY_CONCURRENCY at a time, and only up to FULL_HISTORY_MAX_GISTS)
+    while earlier pages are being consumed. Closing the iterator early cancels
+    any fetches still pending.
+    """
+
+    per_page = FULL_HISTORY_PER_PAGE
+    max_pages = -(-FULL_HISTORY_MAX_GISTS // per_page)
+    semaphore = asyncio.Semaphore(FULL_HISTORY_CONCURRENCY)
+
+    async def fetch(page: int) -> Dict[str, Any]:
+        async with semaphore:
+            return await _fetch_gists_page(username, page, per_page)
+
+    first = await _fetch_gists_page(username, 1, per_page)
+    last_page = first["pagination"]["last_page"]
+    tasks = [asyncio.create_task(fetch(page)) for page in range(2, min(last_page, max_pages) + 1)]
+    try:
+        yield first
+        for task in tasks:
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def _timeline_key(gist: GistInfo) -> Tuple[str, str]:
+    """Sort key for newest-first gist lists."""
+
+    return gist.created_at, gist.id
+
+
+def _assemble_all_gists(pages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Combine fetched pages into the single cached full-history payload."""
+
+    gists = [g for data in pages for g in data["gists"]]
+    truncated = pages[0]["pagination"]["last_page"] > len(pages) or len(gists) > FULL_HISTORY_MAX_GISTS
+    # Newest first by (created_at, id); GitHub's order is already close, so this is near-linear
+    gists.sort(key=_timeline_key, reverse=True)
+    gists = gists[:FULL_HISTORY_MAX_GISTS]
+    return {
+        "gists": gists,
+        "pagination": {
+            "count": len(gists),
+            "pages": len(pages),
+            "per_page": FULL_HISTORY_PER_PAGE,
+            "truncated": truncated,
+            "max_gists": FULL_HISTORY_MAX_GISTS,
+        },
+    }
+
+
+async def _load_all_gists(username: str, use_cache: bool = True) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Return a user's full gist history from the cache or GitHub.
+
+    The result is capped at FULL_HISTORY_MAX_GISTS and cached as a single entry.
+    """
+
+    cache_key = f"gists:{username}:all"
+
+    if use_cache:
+        with timing.stage(timing.CACHE), tracing.create_span("cache.lookup", {"cache.key": cache_key}) as span:
+            cached_data = gists_cache.get(cache_key)
+            span.set_attribute("cache.hit", cached_data is not None)
+        if cached_data is not None:
+            logger.info("Cache hit for %s (all)", username)
+            CACHE_HITS.inc()
+            return cached_data, {"hit": True, "ttl_seconds": CACHE_TTL}
+
+    CACHE_MISSES.inc()
+
+    try:
+        pages = [data async for data in _iter_all_gist_pages(username)]
+    except UpstreamQueueTimeout:
+        return _serve_stale_or_503(cache_key)
+
+    data = _assemble_all_gists(pages)
+    gists_cache.set(cache_key, data)
+    logger.info("Assembled %d gists for %s from %d pages", len(data["gists"]), username, len(pages))
+    return data, {"hit": False, "ttl_seconds": CACHE_TTL}
+
+
+# Result of one user's batch fetch: (payload, cache info) or the error raised
+BatchOutcome = Tuple[str, Any]
+
+
+def _use_graphql(page: int, user_count: int) -> bool:
+    """Pick the GraphQL backend for first-page fetches of enough users at once."""
+
+    if UPSTREAM_BACKEND == "rest" or page != 1 or not GITHUB_TOKEN:
+        return False
+    return UPSTREAM_BACKEND == "graphql" or user_count >= GRAPHQL_MIN_USERS
+
+
+async def _fetch_batch_graphql(usernames: List[str], per_page: int) -> Optional[List[BatchOutcome]]:
+    """
+    Fetch page 1 for several users with one GraphQL query and cache each result.
+
+    Results are cached under their own key (see ``github_graphql.cache_key``)
+    because GraphQL file records lack ``raw_url`` and ``type``.
+
+    Returns None if the GraphQL call itself fails (transport error, GraphQL
+    error, or a body that does not parse or validate), so the caller can fall
+    back to per-user REST fetches.
+    """
+
+    try:
+        await upstream_limiter.acquire("graphql")
+        try:
+            results = await github_graphql.fetch_users_gists(_http_client(), usernames, per_page)
+        finally:
+            upstream_limiter.release()
+    except UpstreamQueueTimeout:
+        outcomes: List[BatchOutcome] = []
+        for username in usernames:
+            try:
+                outcomes.append((username, _serve_stale_or_503(github_graphql.cache_key(username, per_page))))
+            except HTTPException as exc:
+                outcomes.append((username, exc))
+        return outcomes
+    except (httpx.HTTPError, github_graphql.GraphQLError, ValueError) as exc:
+        # ValueError covers JSON decoding and pydantic validation of the response
+        logger.warning("GraphQL batch failed (%s) - falling back to REST", exc)
+        return None
+
+    outcomes = []
+    for username in usernames:
+        result = results[username]
+        if result is None:
+            outcomes.append((username, HTTPException(status_code=404, detail=f"User '{username}' not found")))
+            continue
+        gists = [GistInfo(**record) for record in result["gists"]]
+        data = {
+            "gists": gists,
+            "pagination": {
+                "page": 1,
+                "per_page": per_page,
+                "count": len(gists),
+                "has_next": result["has_next"],
+                "has_prev": False,
+                "last_page": max(1, -(-result["total"] // per_page)),
+            },
+            "source": "graphql",
+        }
+        # Cached apart from REST pages, which GET /{username} and the file proxy rely on
+        gists_cache.set(github_graphql.cache_key(username, per_page), data)
+        outcomes.append((username, (data, {"hit": False, "ttl_seconds": CACHE_TTL})))
+    return outcomes
+
+
+def _batch_cache_keys(username: str, batch: BatchRequest) -> List[str]:
+    """Cache keys that can answer a batch entry: the REST page, then the GraphQL first page."""
+
+    keys = [f"gists:{username}:page{batch.page}:per_page{batch.per_page}"]
+    if batch.page == 1:
+        keys.append(github_graphql.cache_key(username, batch.per_page))
+    return keys
+
+
+async def _fetch_batch_rest(username: str, page: int, per_page: int) -> BatchOutcome:
+    """Fetch one user's page over REST for a batch."""
+
+    try:
+        return username, await _load_gists_page(username, page, per_page, use_cache=False)
+    except HTTPException as exc:
+        return username, exc
+
+
+def _start_batch_fetches(batch: BatchRequest, usernames: List[str]) -> List[asyncio.Task]:
+    """
+    Start upstream fetches for batch cache misses.
+
+    Each task resolves to a list of ``(username, outcome)`` pairs. First-page
+    batches of GRAPHQL_MIN_USERS or more users go through GraphQL in chunks of
+    GRAPHQL_BATCH_SIZE; everything else is one REST call per user. At most
+    BATCH_CONCURRENCY upstream calls run at once, including the per-user REST
+    fallback of a failed GraphQL chunk.
+    """
+
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def fetch_user(username: str) -> List[BatchOutcome]:
+        async with semaphore:
+            return [await _fetch_batch_rest(username, batch.page, batch.per_page)]
+
+    if _use_graphql(batch.page, len(usernames)):
+        size = github_graphql.GRAPHQL_BATCH_SIZE
+
+        async def fetch_chunk(chunk: List[str]) -> List[BatchOutcome]:
+            async with semaphore:
+                outcomes = await _fetch_batch_graphql(chunk, batch.per_page)
+            if outcomes is None:
+                fallbacks = await asyncio.gather(*(fetch_user(u) for u in chunk))
+                outcomes = [outcome for user_outcomes in fallbacks for outcome in user_outcomes]
+            return outcomes
+
+        return [
+            asyncio.create_task(fetch_chunk(usernames[i:i + size]))
+            for i in range(0, len(usernames), size)
+        ]
+
+    return [asyncio.create_task(fetch_user(u)) for u in usernames]
+
+
+# ============================================================================
+# Next-Page Prefetch
+# ============================================================================
+class PrefetchTracker:
+    """
+    Remembers prefetched pages until they are served or evicted.
+
+    Subscribed to the cache so that pages evicted (or overwritten) before any
+    client asked for them are counted as wasted prefetches.
+    """
+
+    def __init__(self):
+        self._pending: Dict[str, float] = {}  # cache key -> upstream seconds saved when served
+        self._in_flight: Dict[str, asyncio.Task] = {}
+
+    def should_prefetch(self, cache_key: str) -> bool:
+        return cache_key not in self._in_flight and cache_key not in self._pending
+
+    def in_flight(self, cache_key: str) -> Optional[asyncio.Task]:
+        """The running prefetch task for ``cache_key``, if any."""
+        return self._in_flight.get(cache_key)
+
+    def start(self, cache_key: str, task: asyncio.Task) -> None:
+        self._in_flight[cache_key] = task
+
+    def finish(self, cache_key: str, fetch_seconds: Optional[float]) -> None:
+        self._in_flight.pop(cache_key, None)
+        if fetch_seconds is not None:
+            self._pending[cache_key] = fetch_seconds
+
+    def consume(self, cache_key: str) -> None:
+        """Record that a cached page was served; counts it if it was prefetched."""
+        saved = self._pending.pop(cache_key, None)
+        if saved is not None:
+            PREFETCH_OUTCOMES.labels(outcome="used").inc()
+            PREFETCH_LATENCY_SAVED.observe(saved)
+
+    def on_set(self, key: str, value: Any) -> None:
+        pass
+
+    def on_evict(self, key: str, value: Any) -> None:
+        if self._pending.pop(key, None) is not None:
+            PREFETCH_OUTCOMES.labels(outcome="wasted").inc()
+
+
+prefetch_tracker = PrefetchTracker()
+gists_cache.subscribe(prefetch_tracker)
+_prefetch_tasks: set = set()  # Strong references so background tasks aren't garbage collected
+
+
+def _maybe_prefetch(username: str, page: int, per_page: int) -> None:
+    """Prefetch ``page`` in the background if it isn't cached and quota allows."""
+
+    cache_key = f"gists:{username}:page{page}:per_page{per_page}"
+    if not PREFETCH_ENABLED or page > 100 or gists_cache.is_fresh(cache_key):
+        return
+    if not prefetch_tracker.should_prefetch(cache_key):
+        return
+    if github_rate_remaining is None or github_rate_remaining < PREFETCH_MIN_RATE_REMAINING:
+        PREFETCHES.labels(result="skipped_budget").inc()
+        return
+
+    task = asyncio.create_task(_prefetch_page(username, page, per_page, cache_key))
+    prefetch_tracker.start(cache_key, task)
+    _prefetch_tasks.add(task)
+    task.add_done_callback(_prefetch_tasks.discard)
+
+
+async def _prefetch_page(username: str, page: int, per_page: int, cache_key: str) -> None:
+    """Fetch a page at low priority (only on an idle upstream slot) and cache it."""
+
+    timing.detach()
+    start = time.monotonic()
+    fetch_seconds = None
+    try:
+        data = await _fetch_gists_page(username, page, per_page, low_priority=True)
+        fetch_seconds = time.monotonic() - start
+        gists_cache.set(cache_key, data)
+        PREFETCHES.labels(result="issued").inc()
+        logger.info("Prefetched %s (page %d)", username, page)
+    except UpstreamQueueTimeout:
+        PREFETCHES.labels(result="skipped_busy").inc()
+    except HTTPException:
+        PREFETCHES.labels(result="failed").inc()
+    finally:
+        prefetch_tracker.finish(cache_key, fetch_seconds)
+
+
+# ============================================================================
+# NDJSON Streaming
+# ============================================================================
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def _wants_ndjson(request: Request) -> bool:
+    """True when the client asked for newline-delimited JSON."""
+
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def _ndjson_error(exc: Exception, **extra: Any) -> str:
+    """Format an error as an NDJSON line (the status line has already been sent)."""
+
+    if isinstance(exc, HTTPException):
+        error = {"status": exc.status_code, "detail": exc.detail}
+    elif isinstance(exc, UpstreamQueueTimeout):
+        error = {"status": 503, "detail": "Too many pending GitHub requests. Please try again later."}
+    else:
+        error = {"status": 500, "detail": "Internal error"}
+    return json.dumps({**extra, "error": error}) + "\n"
+
+
+async def _stream_all_gists(
+    username: str, first: Dict[str, Any], pages: AsyncGenerator[Dict[str, Any], None]
+) -> AsyncIterator[str]:
+    """Stream a user's full history one gist per line from page 1 on, caching it once complete."""
+
+    fetched = [first]
+    count = 0
+    try:
+        data: Optional[Dict[str, Any]] = first
+        while data is not None:
+            for gist in data["gists"][:FULL_HISTORY_MAX_GISTS - count]:
+                yield gist.model_dump_json() + "\n"
+            count += len(data["gists"])
+            data = await anext(pages, None)
+            if data is not None:
+                fetched.append(data)
+    except (HTTPException, UpstreamQueueTimeout) as exc:
+        yield _ndjson_error(exc)
+        return
+    finally:
+        await pages.aclose()
+
+    gists_cache.set(f"gists:{username}:all", _assemble_all_gists(fetched))
+
+
+async def _stream_batch(batch: BatchRequest, usernames: List[str]) -> AsyncIterator[str]:
+    """Stream batch results one gist per line, in the order users complete."""
+
+    def lines(username: str, gists: List[GistInfo]) -> str:
+        prefix = '{"username": ' + json.dumps(username) + ', "gist": '
+        return "".join(prefix + gist.model_dump_json() + "}\n" for gist in gists)
+
+    remaining = []
+    for username in usernames:
+        cached = gists_cache.get_many(_batch_cache_keys(username, batch)) if batch.use_cache else {}
+        if cached:
+            key, cached_data = next(iter(cached.items()))
+            CACHE_HITS.inc()
+            prefetch_tracker.consume(key)
+            yield lines(username, cached_data["gists"])
+        else:
+            remaining.append(username)
+
+    tasks = _start_batch_fetches(batch, remaining)
+    done_users = set()
+    try:
+        for next_done in asyncio.as_completed(tasks, timeout=batch.deadline_seconds):
+            for username, outcome in await next_done:
+                done_users.add(username)
+                if isinstance(outcome, HTTPException):
+                    yield _ndjson_error(outcome, username=username)
+                else:
+                    yield lines(username, outcome[0]["gists"])
+    except asyncio.TimeoutError:
+        logger.warning("Batch stream deadline hit after %.1fs", batch.deadline_seconds)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    for username in remaining:
+        if username not in done_users:
+            yield _ndjson_error(HTTPException(status_code=504, detail="Deadline exceeded"), username=username)
+
+
+# ============================================================================
+# Organization Fan-Out
+# ============================================================================
+class CallBudget:
+    """Upstream calls one request may still make."""
+
+    def __init__(self, calls: int):
+        self.limit = calls
+        self.used = 0
+
+    def take(self) -> bool:
+        """Spend one call; False once the budget is exhausted."""
+
+        if self.used >= self.limit:
+            return False
+        self.used += 1
+        return True
+
+
+async def _fetch_org_members(org: str, page: int) -> Tuple[List[str], int]:
+    """Fetch one page of org member logins; returns (logins, last page)."""
+
+    body, headers = await _github_get(
+        f"{GITHUB_API_URL}/orgs/{org}/members",
+        queue_key=f"org:{org}",
+        not_found=f"Organization '{org}' not found",
+        params={"page": page, "per_page": FULL_HISTORY_PER_PAGE},
+    )
+    links = _parse_link_header(headers.get("Link", ""))
+    return [member["login"] for member in json.loads(body)], _page_number(links.get("last")) or page
+
+
+async def _load_member_gists(username: str, budget: CallBudget) -> Tuple[List[GistInfo], int, bool]:
+    """
+    Collect a member's gists from cached entries, fetching missing pages within ``budget``.
+
+    Returns (gists, upstream calls made, complete).
+    """
+
+    cached_data = gists_cache.get(f"gists:{username}:all")
+    if cached_data is not None:
+        CACHE_HITS.inc()
+        return cached_data["gists"], 0, True
+
+    gists: List[GistInfo] = []
+    calls = 0
+    page = 1
+    while len(gists) < FULL_HISTORY_MAX_GISTS:
+        if not gists_cache.is_fresh(f"gists:{username}:page{page}:per_page{FULL_HISTORY_PER_PAGE}"):
+            if not budget.take():
+                return gists, calls, False
+            calls += 1
+        data, _ = await _load_gists_page(username, page, FULL_HISTORY_PER_PAGE)
+        gists.extend(data["gists"])
+        if not data["pagination"]["has_next"]:
+            break
+        page += 1
+    return gists[:FULL_HISTORY_MAX_GISTS], calls, True
+
+
+async def _stream_org_gists(
+    org: str, first_members: List[str], last_page: int, budget: CallBudget
+) -> AsyncIterator[str]:
+    """
+    Stream every member's gists as members complete, then a summary line.
+
+    Member pages are listed while earlier members are already being fetched
+    (at most ORG_FANOUT_CONCURRENCY at a time). Members reached after the
+    budget runs out are skipped and named in the summary.
+    """
+
+    results: asyncio.Queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(ORG_FANOUT_CONCURRENCY)
+    tasks: List[asyncio.Task] = []
+    summary: Dict[str, Any] = {
+        "org": org, "members": 0, "completed": 0, "partial": [], "skipped": [], "failed": 0,
+        "gists": 0, "members_truncated": False,
+    }
+
+    async def fetch_member(username: str) -> None:
+        async with semaphore:
+            try:
+                outcome: Any = await _load_member_gists(username, budget)
+            except Exception as exc:  # pylint: disable=broad-except
+                outcome = exc
+        await results.put((username, outcome))
+
+    async def list_members() -> None:
+        members, page = first_members, 1
+        try:
+            while True:
+                summary["members"] += len(members)
+                tasks.extend(asyncio.create_task(fetch_member(m)) for m in members)
+                if page >= last_page:
+                    break
+                if not budget.take():
+                    summary["members_truncated"] = True
+                    break
+                page += 1
+                try:
+                    members, _ = await _fetch_org_members(org, page)
+                except (HTTPException, UpstreamQueueTimeout) as exc:
+                    await results.put((None, exc))
+                    summary["members_truncated"] = True
+                    break
+            await asyncio.gather(*tasks)
+        finally:
+            results.put_nowait(None)
+
+    lister = asyncio.create_task(list_members())
+    try:
+        while (item := await results.get()) is not None:
+            username, outcome = item
+            if username is None:
+                yield _ndjson_error(outcome, org=org)
+            elif isinstance(outcome, Exception):
+                summary["failed"] += 1
+                yield _ndjson_error(outcome, username=username)
+            else:
+                gists, _, complete = outcome
+                if complete:
+                    summary["completed"] += 1
+                else:
+                    summary["partial" if gists else "skipped"].append(username)
+                summary["gists"] += len(gists)
+                prefix = '{"username": ' + json.dumps(username) + ', "gist": '
+                yield "".join(prefix + gist.model_dump_json() + "}\n" for gist in gists)
+        summary["upstream_calls"] = budget.used
+        summary["budget"] = budget.limit
+        yield json.dumps({"summary": summary}) + "\n"
+    finally:
+        lister.cancel()
+        for task in tasks:
+            task.cancel()
+
+
+# ============================================================================
+# Timeline Cursors
+# ============================================================================
+def _encode_cursor(key: Tuple[str, str], upstream_page: Optional[int] = None) -> str:
+    """Encode a (created_at, id) position, optionally with the GitHub page it continues on, as an opaque cursor."""
+
+    value = [*key, upstream_page] if upstream_page is not None else list(key)
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip("=")
+
+
+def _decode_cursor_page(cursor: str) -> Tuple[Tuple[str, str], Optional[int]]:
+    """Decode a cursor into its position and GitHub page hint; raises 400 if it is malformed."""
+
+    try:
+        created_at, gist_id, *rest = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        upstream_page = rest[0] if rest else None
+        if (
+            not isinstance(created_at, str) or not isinstance(gist_id, str) or len(rest) > 1
+            or not (upstream_page is None or (type(upstream_page) is int and 1 <= upstream_page <= 100))  # noqa: E721
+        ):
+            raise ValueError(cursor)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return (created_at, gist_id), upstream_page
+
+
+def _decode_cursor(cursor: str) -> Tuple[str, str]:
+    """Decode a cursor from ``_encode_cursor`` into its position; raises 400 if it is malformed."""
+
+    return _decode_cursor_page(cursor)[0]
+
+
+def _position_after(gists: List[GistInfo], key: Tuple[str, str]) -> int:
+    """Index of the first gist strictly older than ``key`` in a newest-first list (binary search)."""
+
+    lo, hi = 0, len(gists)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if _timeline_key(gists[mid]) < key:
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+def _merge_timelines(
+    lists: Dict[str, List[GistInfo]], limit: int, after: Optional[Tuple[str, str]] = None
+) -> Tuple[List[TimelineGist], Optional[str]]:
+    """
+    Lazily k-way merge newest-first lists, resuming after ``after``.
+
+    Only ``limit + 1`` items are pulled from the heap, so the work is bounded
+    by the page size (plus a binary search per list), not the list lengths.
+    """
+
+    def tagged(username: str, gists: List[GistInfo]):
+        start = _position_after(gists, after) if after else 0
+        for i in range(start, len(gists)):
+            yield _timeline_key(gists[i]), username, gists[i]
+
+    merged = heapq.merge(
+        *(tagged(username, gists) for username, gists in lists.items()),
+        key=lambda item: item[0],
+        reverse=True,
+    )
+    page = list(islice(merged, limit + 1))
+    data = [TimelineGist(username=username, **gist.model_dump()) for _, username, gist in page[:limit]]
+    next_cursor = _encode_cursor(page[limit - 1][0]) if len(page) > limit else None
+    return data, next_cursor
+
+
+async def _load_cursor_page(
+    username: str, cursor: str, per_page: int, use_cache: bool = True
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Return the page of a user's gists that follows ``cursor``.
+
+    Cursors are (created_at, id) positions, so they resolve by binary search
+    in the cached full history and stay valid when it is refreshed with newer
+    gists. Past the end of a truncated history (FULL_HISTORY_MAX_GISTS),
+    pages continue lazily from GitHub's own 100-gist pages, cached as usual,
+    so cursor paging reaches as far as offset paging (100 pages of 100).
+    Such cursors also carry the GitHub page they continue on.
+    """
+
+    after, upstream_page = _decode_cursor_page(cursor) if cursor else (None, None)
+    history, cache_info = await _load_all_gists(username, use_cache)
+    gists = history["gists"]
+    start = len(gists) if upstream_page else _position_after(gists, after) if after else 0
+    page = gists[start:start + per_page]
+    has_next = start + per_page < len(gists)
+    next_page = None
+    truncated = False
+    if not has_next and history["pagination"]["truncated"]:
+        next_page = upstream_page or len(gists) // FULL_HISTORY_PER_PAGE + 1
+        last = _timeline_key(page[-1]) if page else after
+        truncated = next_page > 100
+        while not truncated:
+            data, _ = await _load_gists_page(username, next_page, FULL_HISTORY_PER_PAGE, use_cache)
+            # GitHub pages can overlap what was already served once newer gists shift them
+            older = sorted(
+                (g for g in data["gists"] if last is None or _timeline_key(g) < last), key=_timeline_key, reverse=True
+            )
+            taken = older[:per_page - len(page)]
+            page.extend(taken)
+            if taken:
+                last = _timeline_key(taken[-1])
+            if len(older) > len(taken):
+                has_next = True
+                break
+            if not data["pagination"]["has_next"]:
+                break
+            if next_page >= 100:
+                truncated = True
+                break
+            next_page += 1
+            if len(page) == per_page:
+                has_next = True
+                break
+    return {
+        "gists": page,
+        "pagination": {
+            "per_page": per_page,
+            "count": len(page),
+            "cursor": cursor or None,
+            "next_cursor": _encode_cursor(_timeline_key(page[-1]), next_page) if has_next else None,
+            "has_next": has_next,
+            "truncated": truncated,
+        },
+    }, cache_info
+
+
+# Projection spec: (field name, subfields of each ``files`` entry or None for all)
+FieldSpec = Tuple[Tuple[str, Optional[FrozenSet[str]]], ...]
+
+
+@lru_cache(maxsize=256)
+def _parse_fields(fields: str) -> FieldSpec:
+    """
+    Parse a ``fields=`` value such as ``id,url,files.language`` into a spec.
+
+    Specs are memoized, so repeated projections only pay for the walk over
+    the cached gists - the cache itself always holds the full records.
+    """
+
+    requested: Dict[str, Optional[set]] = {}
+    for item in fields.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, subfield = item.partition(".")
+        if name not in GistInfo.model_fields or (subfield and name != "files"):
+            raise ValueError(item)
+        if not subfield:
+            requested[name] = None
+        else:
+            subfields = requested.setdefault(name, set())
+            if subfields is not None:  # None (the whole field) wins over subfields
+                subfields.add(subfield)
+
+    if not requested:
+        raise ValueError(fields)
+    frozen = {name: None if subfields is None else frozenset(subfields) for name, subfields in requested.items()}
+    return tuple((name, frozen[name]) for name in GistInfo.model_fields if name in frozen)
+
+
+def _project_gist(gist: GistInfo, spec: FieldSpec) -> Dict[str, Any]:
+    """Project a gist down to the fields in ``spec``."""
+
+    projected = {}
+    for name, subfields in spec:
+        value = getattr(gist, name)
+        if subfields is not None:
+            value = {
+                filename: {k: v for k, v in file_info.items() if k in subfields}
+                for filename, file_info in value.items()
+            }
+        projected[name] = value
+    return projected
+
+
+@app.post("/batch", response_model=BatchResponse)
+async def get_batch_gists(batch: BatchRequest, request: Request) -> BatchResponse | Response:
+    """
+    Fetch gists for many users in one call.
+
+    The cache is checked for every user in one pass. Misses are fetched
+    concurrently (at most BATCH_CONCURRENCY at a time). Users still pending
+    when `deadline_seconds` runs out get a 504 error entry and `partial` is set.
+
+    With `Accept: application/x-ndjson` results are streamed as
+    `{"username": ..., "gist": {...}}` lines in the order users complete.
+
+    Example body: `{"usernames": ["octocat", "torvalds"], "per_page": 10}`
+    """
+
+    if not http_client:
+        raise HTTPException(status_code=500, detail="Service not ready")
+
+    usernames = list(dict.fromkeys(batch.usernames))
+    if _wants_ndjson(request):
+        return StreamingResponse(_stream_batch(batch, usernames), media_type=NDJSON_MEDIA_TYPE)
+
+    results: Dict[str, BatchResult] = {}
+
+    if batch.use_cache:
+        keys = {key: u for u in usernames for key in _batch_cache_keys(u, batch)}
+        for key, cached_data in gists_cache.get_many(list(keys)).items():
+            if keys[key] in results:
+                continue
+            CACHE_HITS.inc()
+            prefetch_tracker.consume(key)
+            results[keys[key]] = BatchResult(
+                data=cached_data["gists"],
+                pagination=cached_data["pagination"],
+                cache={"hit": True, "ttl_seconds": CACHE_TTL},
+            )
+
+    misses = [u for u in usernames if u not in results]
+    pending: Set[asyncio.Task] = set()
+    if misses:
+        tasks = _start_batch_fetches(batch, misses)
+        done, pending = await asyncio.wait(tasks, timeout=batch.deadline_seconds)
+        for task in pending:
+            task.cancel()
+        for task in done:
+            for username, outcome in task.result():
+                if isinstance(outcome, HTTPException):
+                    results[username] = BatchResult(error={"status": outcome.status_code, "detail": outcome.detail})
+                else:
+                    data, cache_info = outcome
+                    results[username] = BatchResult(
+                        data=data["gists"], pagination=data["pagination"], cache=cache_info
+                    )
+
+    timed_out = [u for u in misses if u not in results]
+    for username in timed_out:
+        results[username] = BatchResult(error={"status": 504, "detail": "Deadline exceeded"})
+
+    logger.info(
+        "Batch of %d users: %d cached, %d timed out",
+        len(usernames), len(usernames) - len(misses), len(timed_out),
+    )
+    return BatchResponse(results={u: results[u] for u in usernames}, partial=bool(timed_out))
+
+
+ISO_DATE_PATTERN = r"^\d{4}-\d{2}-\d{2}(T\d{2}:\d{2}:\d{2}Z)?$"
+
+
+@app.get("/orgs/{org}/gists")
+async def get_org_gists(
+    org: str = Path(..., description="GitHub organization", pattern=USERNAME_PATTERN),
+    budget: int = Query(ORG_CALL_BUDGET, ge=1, le=ORG_MAX_CALL_BUDGET, description="Max GitHub calls"),
+) -> StreamingResponse:
+    """
+    Stream the public gists of every member of an organization as NDJSON.
+
+    Members are listed page by page and their gists fetched concurrently
+    (ORG_FANOUT_CONCURRENCY at a time), reusing cached per-user entries.
+    Lines are `{"username": ..., "gist": {...}}` in the order members
+    complete. No more than `budget` GitHub calls are made; the final
+    `{"summary": {...}}` line reports completed, partial and skipped members
+    and the calls used.
+
+    Examples:
+    - `GET /orgs/github/gists`
+    - `GET /orgs/github/gists?budget=500`
+    """
+
+    if not http_client:
+        raise HTTPException(status_code=500, detail="Service not ready")
+
+    call_budget = CallBudget(budget)
+    call_budget.take()
+    try:
+        # First member page before streaming, so an unknown org is a plain 404
+        members, last_page = await _fetch_org_members(org, 1)
+    except UpstreamQueueTimeout:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many pending GitHub requests. Please try again later.",
+            headers={"Retry-After": str(max(1, int(upstream_limiter.queue_timeout)))},
+        )
+    return StreamingResponse(
+        _stream_org_gists(org, members, last_page, call_budget), media_type=NDJSON_MEDIA_TYPE
+    )
+
+
+@app.get("/gists/timeline", response_model=TimelineResponse)
+async def get_timeline(
+    usernames: str = Query(..., min_length=1, description="Comma-separated GitHub usernames"),
+    limit: int = Query(30, ge=1, le=100, description="Items per page"),
+    cursor: Optional[str] = Query(None, description="`next_cursor` from the previous page"),
+) -> TimelineResponse:
+    """
+    Latest gists across several users, newest first.
+
+    Each user's full history comes from the cache (or GitHub on a miss, as
+    for `/{username}/all`) and the lists are lazily heap-merged, so a page
+    only touches about `limit` items. Pass `next_cursor` back as `cursor` to
+    continue where the previous page stopped. Users that fail are reported
+    in `errors` and left out of the merge.
+
+    Examples:
+    - `GET /gists/timeline?usernames=octocat,defunkt&limit=20`
+    """
+
+    if not http_client:
+        raise HTTPException(status_code=500, detail="Service not ready")
+
+    names = list(dict.fromkeys(u.strip() for u in usernames.split(",") if u.strip()))
+    if not names or len(names) > TIMELINE_MAX_USERS or not all(re.match(USERNAME_PATTERN, u) for u in names):
+        raise HTTPException(status_code=422, detail=f"Provide 1-{TIMELINE_MAX_USERS} valid usernames")
+    after = _decode_cursor(cursor) if cursor else None
+
+    outcomes = await asyncio.gather(*(_load_all_gists(u) for u in names), return_exceptions=True)
+    lists, errors = {}, {}
+    for username, outcome in zip(names, outcomes):
+        if isinstance(outcome, HTTPException):
+            errors[username] = {"status": outcome.status_code, "detail": outcome.detail}
+        elif isinstance(outcome, BaseException):
+            raise outcome
+        else:
+            lists[username] = outcome[0]["gists"]
+
+    data, next_cursor = _merge_timelines(lists, limit, after)
+    return TimelineResponse(data=data, next_cursor=next_cursor, errors=errors)
+
+
+@app.get("/gists/query", response_model=PaginatedResponse)
+async def query_cached_gists(
+    language: Optional[str] = Query(None, description="File language, case-insensitive"),
+    extension: Optional[str] = Query(None, description="File name extension, e.g. 'py'"),
+    created_after: Optional[str] = Query(None, description="Inclusive lower bound", pattern=ISO_DATE_PATTERN),
+    created_before: Optional[str] = Query(None, description="Exclusive upper bound", pattern=ISO_DATE_PATTERN),
+    page: int = Query(1, ge=1, description="Page number"),
+    per_page: int = Query(30, ge=1, le=100, description="Items per page"),
+) -> PaginatedResponse:
+    """
+    Filter every cached gist by language, extension and creation date.
+
+    Answered from in-memory indexes maintained as cache entries are set and
+    evicted; GitHub is never called. Gists only held by expired entries are
+    left out once the cache sweep sees them expire. Results are newest first.
+
+    Examples:
+    - `GET /gists/query?language=python`
+    - `GET /gists/query?extension=md&created_after=2024-01-01&created_before=2024-07-01`
+    """
+
+    total, gists = filter_index.query(
+        language=language,
+        extension=extension,
+        created_after=created_after,
+        created_before=created_before,
+        offset=(page - 1) * per_page,
+        limit=per_page,
+    )
+    return PaginatedResponse(
+        data=gists,
+        pagination={
+            "page": page,
+            "per_page": per_page,
+            "count": len(gists),
+            "total": total,
+            "has_next": page * per_page < total,
+            "has_prev": page > 1,
+        },
+        cache={"hit": True, "source": "index"},
+    )
+
+
+@app.get("/gists/search", response_model=PaginatedResponse)
+async def search_cached_gists(
+    q: str = Query(..., min_length=1, max_length=256, description="Search terms"),
+    page: int = Query(1, ge=1, description="Page number"),
+    per_page: int = Query(30, ge=1, le=100, description="Items per page"),
+) -> PaginatedResponse:
+    """
+    Full-text search over the descriptions and file names of cached gists.
+
+    Results are ranked with BM25 from an inverted index maintained as cache
+    entries are set and evicted; GitHub is never called. Gists only held by
+    expired entries are left out once the cache sweep sees them expire.
+
+    Examples:
+    - `GET /gists/search?q=kubernetes`
+    - `GET /gists/search?q=helm+chart&per_page=10`
+    """
+
+    total, hits = search_index.search(q, offset=(page - 1) * per_page, limit=per_page)
+    return PaginatedResponse(
+        data=[gist for _, gist in hits],
+        pagination={
+            "page": page,
+            "per_page": per_page,
+            "count": len(hits),
+            "total": total,
+            "has_next": page * per_page < total,
+            "has_prev": page > 1,
+            "scores": [round(score, 4) for score, _ in hits],
+        },
+        cache={"hit": True, "source": "index"},
+    )
+
+
+@app.get("/gists/{gist_id}", response_model=GistInfo)
+async def get_gist(
+    gist_id: str = Path(..., description="Gist ID", pattern=r"^[0-9a-zA-Z]{1,64}$"),
+) -> GistInfo:
+    """
+    Fetch a single gist.
+
+    Served from memory when the gist is part of any cached user list (via the
+    gist id index); GitHub is only called when it is not.
+
+    Examples:
+    - `GET /gists/aa5a315d61ae9438b18d`
+    """
+
+    if not http_client:
+        raise HTTPException(status_code=500, detail="Service not ready")
+
+    return await _find_gist(gist_id)
+
+
+@app.get("/gists/{gist_id}/files/{filename}")
+async def get_gist_file(
+    gist_id: str = Path(..., description="Gist ID", pattern=r"^[0-9a-zA-Z]{1,64}$"),
+    filename: str = Path(..., description="File name within the gist"),
+) -> FileResponse:
+    """
+    Serve a gist file's content through this service.
+
+    Contents are kept in a content-addressed disk store (identical files across
+    gists and forks are stored once) with LRU eviction under
+    GIST_CONTENT_MAX_BYTES. `Range` requests are supported, and the file is
+    handed to the server for zero-copy delivery when it supports it.
+
+    Examples:
+    - `GET /gists/aa5a315d61ae9438b18d/files/hello_world.rb`
+    """
+
+    if not http_client:
+        raise HTTPException(status_code=500, detail="Service not ready")
+
+    gist = await _find_gist(gist_id)
+    file_info = gist.files.get(filename)
+    if not file_info or not file_info.get("raw_url"):
+        raise HTTPException(status_code=404, detail=f"File '{filename}' not found in gist '{gist_id}'")
+    if (file_info.get("size") or 0) > content_store.max_file_bytes:
+        raise HTTPException(status_code=413, detail="Gist file is too large to proxy")
+
+    path = await _load_content(file_info["raw_url"], gist_id)
+    # Served as plain text like raw.githubusercontent.com, so user content is never rendered
+    return FileResponse(
+        path,
+        media_type="text/plain; charset=utf-8",
+        headers={"X-Content-Type-Options": "nosniff", "Cache-Control": f"public, max-age={CACHE_TTL}"},
+    )
+
+
 @app.get("/{username}", response_model=PaginatedResponse)
 async def get_user_gists(
-    username: str = Path(..., description="GitHub username", min_length=1, max_length=39),
+    request: Request,
+    username: str = Path(..., description="GitHub username", pattern=USERNAME_PATTERN),
     page: int = Query(1, ge=1, le=100, description="Page number (1-100)"),
     per_page: int = Query(30, ge=1, le=100, description="Items per page (1-100)"),
     use_cache: bool = Query(True, description="Use cached data if available"),
-) -> PaginatedResponse:
+    fields: Optional[str] = Query(
+        None,
+        description="Comma-separated fields to return, e.g. `id,url,created_at,files.language`",
+    ),
+    cursor: Optional[str] = Query(
+        None,
+        description="Cursor pagination: empty for the first page, then `pagination.next_cursor`",
+    ),
+) -> PaginatedResponse | Response:
     """
     Fetch public gists for a GitHub user.
     
@@ -295,108 +2113,143 @@ async def get_user_gists(
     - **Pagination**: Use `page` and `per_page` to control results
     - **Caching**: Results are cached for 5 minutes (configurable via CACHE_TTL env var)
     - **Cache bypass**: Set `use_cache=false` to fetch fresh data
+    - **Sparse fieldsets**: Set `fields` to return only some gist fields
+      (`files.<name>` selects subfields of each file)
+    - **NDJSON**: Send `Accept: application/x-ndjson` to get one gist per line
+    - **Prefetch**: When there is a next page, it is fetched in the background
+      while GitHub quota and an idle upstream slot allow
+    - **Fair queueing**: Upstream calls are capped globally and queued per user;
+      when the queue wait runs out, stale cached data or a 503 is returned
+    - **Server-Timing**: The response breaks latency down into cache lookup,
+      upstream queue/wait/transfer, parse and serialize stages
+    - **Cursor pagination**: Pass `cursor` (empty for the first page) to page
+      through the cached full history by (`created_at`, `id`) instead of by
+      offset. Pages do not shift when new gists appear, and `page` is ignored.
+      Past FULL_HISTORY_MAX_GISTS, pages continue from GitHub's own pages as
+      they are reached (`pagination.truncated` is set at GitHub's page limit)
     
     Examples:
     - `GET /octocat` - Get first 30 gists (default)
     - `GET /octocat?page=2&per_page=10` - Get gists 11-20
     - `GET /octocat?use_cache=false` - Force fresh fetch from GitHub
+    - `GET /octocat?fields=id,url,created_at` - Only ids, urls and dates
+    - `GET /octocat?cursor=` - First cursor page; follow `pagination.next_cursor`
     """
 
     if not http_client:
         raise HTTPException(status_code=500, detail="Service not ready")
 
-    # Generate cache key
-    cache_key = f"gists:{username}:page{page}:per_page{per_page}"
-    cache_hit = False
-    
-    # Check cache first
-    if use_cache:
-        cached_data = gists_cache.get(cache_key)
-        if cached_data is not None:
-            logger.info("Cache hit for %s (page %d)", username, page)
-            CACHE_HITS.inc()
-            cache_hit = True
-            return PaginatedResponse(
-                data=cached_data["gists"],
-                pagination=cached_data["pagination"],
-                cache={"hit": True, "ttl_seconds": CACHE_TTL},
-            )
-    
-    CACHE_MISSES.inc()
-    
-    # Build URL with pagination parameters
-    url = f"{GITHUB_API_URL}/users/{username}/gists"
-    params = {"page": page, "per_page": per_page}
-
-    try:
-        logger.info("Fetching gists for %s (page %d, per_page %d)", username, page, per_page)
-        response = await http_client.get(url, params=params)
+    spec = None
+    if fields is not None:
+        try:
+            spec = _parse_fields(fields)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=f"Unknown field: '{exc}'")
 
-        GITHUB_API_REQUESTS.labels(status=response.status_code).inc()
+    if cursor is not None:
+        data, cache_info = await _load_cursor_page(username, cursor, per_page, use_cache)
+    else:
+        data, cache_info = await _load_gists_page(username, page, per_page, use_cache)
+        if data["pagination"].get("has_next"):
+            _maybe_prefetch(username, page + 1, per_page)
+    # Projection and response rendering from here on count as serialization
+    timing.mark_handler_done()
+
+    if _wants_ndjson(request):
+        lines = (
+            (json.dumps(_project_gist(g, spec)) if spec is not None else g.model_dump_json()) + "\n"
+            for g in data["gists"]
+        )
+        return StreamingResponse(lines, media_type=NDJSON_MEDIA_TYPE)
+
+    if spec is not None:
+        return JSONResponse(content={
+            "data": [_project_gist(g, spec) for g in data["gists"]],
+            "pagination": data["pagination"],
+            "cache": cache_info,
+        })
+
+    return PaginatedResponse(
+        data=data["gists"],
+        pagination=data["pagination"],
+        cache=cache_info,
+    )
 
-        if response.status_code == 404:
-            logger.warning("User not found: %s", username)
-            raise HTTPException(status_code=404, detail=f"User '{username}' not found")
 
-        if response.status_code == 403:
-            logger.error("GitHub API rate limit exceeded")
-            raise HTTPException(
-                status_code=429,
-                detail="GitHub API rate limit exceeded. Please try again later.",
-            )
+@app.get("/{username}/all", response_model=PaginatedResponse)
+async def get_all_user_gists(
+    request: Request,
+    username: str = Path(..., description="GitHub username", pattern=USERNAME_PATTERN),
+    use_cache: bool = Query(True, description="Use cached data if available"),
+) -> PaginatedResponse | Response:
+    """
+    Fetch a user's entire public gist history in one call.
 
-        response.raise_for_status()
-        gists_data = response.json()
+    Pages 2..N are fetched from GitHub concurrently once page 1 reveals the
+    last page. The assembled list is cached as one entry and capped at
+    FULL_HISTORY_MAX_GISTS (`pagination.truncated` is set when the cap applies).
 
-        gists = [
-            GistInfo(
-                id=g["id"],
-                description=g.get("description"),
-                url=g["html_url"],
-                created_at=g["created_at"],
-                files=g["files"],
-            )
-            for g in gists_data
-        ]
+    With `Accept: application/x-ndjson` gists are streamed one per line as
+    pages arrive. Page 1 is fetched before the response starts, so an unknown
+    user is a 404 and a queue timeout falls back to stale data as for JSON;
+    a failure on a later page ends the stream with an `{"error": ...}` line.
 
-        # Parse Link header for pagination info
-        link_header = response.headers.get("Link", "")
-        has_next = 'rel="next"' in link_header
-        has_prev = 'rel="prev"' in link_header
-        
-        pagination_info = {
-            "page": page,
-            "per_page": per_page,
-            "count": len(gists),
-            "has_next": has_next,
-            "has_prev": has_prev,
-        }
+    Examples:
+    - `GET /octocat/all` - All gists for octocat
+    """
 
-        # Cache the result
-        gists_cache.set(cache_key, {"gists": gists, "pagination": pagination_info})
+    if not http_client:
+        raise HTTPException(status_code=500, detail="Service not ready")
 
-        logger.info("Found %d gists for %s (page %d)", len(gists), username, page)
-        
-        return PaginatedResponse(
-            data=gists,
-            pagination=pagination_info,
-            cache={"hit": False, "ttl_seconds": CACHE_TTL},
+    if _wants_ndjson(request):
+        # Page 1 (or the cache) decides the status; only later failures become error lines
+        cache_key = f"gists:{username}:all"
+        cached_data = gists_cache.get(cache_key) if use_cache else None
+        if cached_data is not None:
+            CACHE_HITS.inc()
+        else:
+            CACHE_MISSES.inc()
+            pages = _iter_all_gist_pages(username)
+            try:
+                first = await anext(pages)
+            except UpstreamQueueTimeout:
+                cached_data, _ = _serve_stale_or_503(cache_key)
+            else:
+                return StreamingResponse(_stream_all_gists(username, first, pages), media_type=NDJSON_MEDIA_TYPE)
+        return StreamingResponse(
+            (gist.model_dump_json() + "\n" for gist in cached_data["gists"]), media_type=NDJSON_MEDIA_TYPE
         )
 
-    except HTTPException:
-        raise
-    except httpx.TimeoutException:
-        logger.error("Timeout fetching gists for %s", username)
-        raise HTTPException(status_code=504, detail="GitHub API timeout")
-    except httpx.HTTPStatusError as exc:
-        logger.error("HTTP error: %s", exc)
-        raise HTTPException(
-            status_code=exc.response.status_code,
-            detail=f"GitHub error: {exc.response.status_code}",
-        )
-    except Exception as exc:  # pylint: disable=broad-except
-        logger.error("Error: %s", exc)
-        raise HTTPException(status_code=500, detail="Internal error")
+    data, cache_info = await _load_all_gists(username, use_cache)
+    return PaginatedResponse(
+        data=data["gists"],
+        pagination=data["pagination"],
+        cache=cache_info,
+    )
+
+
+@app.get("/{username}/stats", response_model=UserStatsResponse)
+async def get_user_stats(
+    username: str = Path(..., description="GitHub username", pattern=USERNAME_PATTERN),
+    use_cache: bool = Query(True, description="Use cached data if available"),
+) -> UserStatsResponse:
+    """
+    Aggregate statistics over a user's gist history.
+
+    Reports gists per language, total file count and size, the files-per-gist
+    distribution and gists created per month. The aggregates are computed
+    when the full history is cached and updated with only the changed gists
+    when it is refreshed.
+
+    Examples:
+    - `GET /octocat/stats`
+    """
+
+    if not http_client:
+        raise HTTPException(status_code=500, detail="Service not ready")
+
+    data, cache_info = await _load_all_gists(username, use_cache)
+    return UserStatsResponse(username=username, cache=cache_info, **user_stats.get(username, data))
 
 
 @app.exception_handler(Exception)
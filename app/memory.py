@@ -0,0 +1,212 @@
+"""
+Memory Introspection for GitHub Gists API
+Incremental per-user cache size estimates and tracemalloc snapshot diffs
+"""
+from collections import Counter
+import os
+import sys
+import tracemalloc
+from typing import Any, Dict, List, Optional, Tuple
+
+from prometheus_client import Gauge
+
+# Configuration from environment
+CACHE_SIZE_SAMPLE = int(os.environ.get("CACHE_SIZE_SAMPLE", 32))  # Gists measured per payload; the rest extrapolated
+TRACEMALLOC_MAX_FRAMES = int(os.environ.get("TRACEMALLOC_MAX_FRAMES", 25))  # Upper bound for ?frames=
+
+# Prometheus metrics
+CACHE_ESTIMATED_BYTES = Gauge(
+    "cache_estimated_bytes",
+    "Estimated memory held by cached payloads",
+    multiprocess_mode="liveall",
+)
+
+# Owners for cache entries that don't belong to one username
+SINGLE_GIST_OWNER = "(gist)"
+OTHER_OWNER = "(other)"
+
+# Allocations made by the introspection itself are left out of snapshots
+_SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def _reachable(obj: Any) -> Dict[int, int]:
+    """Sizes of the objects reachable from ``obj``, by id, each counted once."""
+    sizes: Dict[int, int] = {}
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in sizes:
+            continue
+        sizes[id(item)] = sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif not isinstance(item, type) and hasattr(item, "__dict__"):
+            stack.append(item.__dict__)
+    return sizes
+
+
+def deep_size(obj: Any) -> int:
+    """
+    Estimate the bytes reachable from ``obj``.
+
+    Follows containers and instance ``__dict__``s (which is where pydantic
+    models keep their fields) and counts each object once. Objects shared
+    with other cache entries, such as interned strings, are counted in each.
+    """
+    return sum(_reachable(obj).values())
+
+
+def estimate_payload(payload: Any, sample: int = CACHE_SIZE_SAMPLE) -> int:
+    """
+    Estimate a cached payload's size, measuring at most ``sample`` of its gists.
+
+    Objects found in only one sampled gist are scaled up to the whole list;
+    objects found in several (language names and other strings pydantic
+    reuses) are counted once. This tracks the full deep size closely at a
+    small fraction of the cost (a few ms instead of 80ms for 3000 gists).
+    """
+    gists = payload.get("gists") if isinstance(payload, dict) else None
+    if not isinstance(gists, list) or len(gists) <= sample:
+        return deep_size(payload)
+
+    step = len(gists) / sample
+    seen: Dict[int, int] = {}  # id -> size, for objects in any sampled gist
+    shared = set()  # ids found in more than one sampled gist
+    for i in range(sample):
+        for obj_id, size in _reachable(gists[int(i * step)]).items():
+            if obj_id in seen:
+                shared.add(obj_id)
+            seen[obj_id] = size
+    per_gist = sum(size for obj_id, size in seen.items() if obj_id not in shared)
+    size = per_gist * len(gists) // sample + sum(seen[obj_id] for obj_id in shared)
+
+    size += sys.getsizeof(payload) + sys.getsizeof(gists)
+    for key, value in payload.items():
+        size += deep_size(key) + (0 if value is gists else deep_size(value))
+    return size
+
+
+def cache_owner(key: str) -> str:
+    """Username a cache key belongs to (``gists:{username}:...``), else a placeholder."""
+    prefix, _, rest = key.partition(":")
+    if prefix == "gists":
+        return rest.partition(":")[0]
+    if prefix == "gist":
+        return SINGLE_GIST_OWNER
+    return OTHER_OWNER
+
+
+class CacheSizer:
+    """
+    Keeps a byte estimate for every cache entry, totalled per username.
+
+    Subscribed to the cache: each payload is estimated once when it is set
+    and the estimate subtracted again when it is evicted, so reading the
+    totals costs nothing beyond sorting the owners.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[str, int]] = {}  # cache key -> (owner, bytes)
+        self._bytes: Counter = Counter()  # owner -> bytes
+        self._counts: Counter = Counter()  # owner -> entries
+        self.total_bytes = 0
+
+    def on_set(self, key: str, value: Any) -> None:
+        """Measure a newly cached payload."""
+        owner = cache_owner(key)
+        size = sys.getsizeof(key) + estimate_payload(value)
+        self._entries[key] = (owner, size)
+        self._bytes[owner] += size
+        self._counts[owner] += 1
+        self.total_bytes += size
+        CACHE_ESTIMATED_BYTES.set(self.total_bytes)
+
+    def on_evict(self, key: str, value: Any) -> None:
+        """Subtract an evicted payload's estimate."""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        owner, size = entry
+        self._bytes[owner] -= size
+        self._counts[owner] -= 1
+        if not self._counts[owner]:
+            del self._bytes[owner], self._counts[owner]
+        self.total_bytes -= size
+        CACHE_ESTIMATED_BYTES.set(self.total_bytes)
+
+    def top(self, limit: int) -> List[Tuple[str, int, int]]:
+        """The ``limit`` owners holding the most bytes, as (owner, entries, bytes)."""
+        return [(owner, self._counts[owner], size) for owner, size in self._bytes.most_common(limit)]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class AllocationTracker:
+    """
+    Turns tracemalloc on and off and reports allocation growth between snapshots.
+
+    Each ``diff`` compares a fresh snapshot with the previous one (or with
+    the one taken when tracing started), grouped by allocating line.
+    """
+
+    def __init__(self):
+        self._previous: Optional[tracemalloc.Snapshot] = None
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 1) -> None:
+        """Start tracing allocations (a no-op if already tracing)."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            self._previous = self._snapshot()
+
+    def stop(self) -> None:
+        """Stop tracing and drop the saved snapshot."""
+        tracemalloc.stop()
+        self._previous = None
+
+    def diff(self, limit: int) -> List[Dict[str, Any]]:
+        """Top ``limit`` allocation sites by growth since the previous snapshot."""
+        if not tracemalloc.is_tracing():
+            return []
+        current = self._snapshot()
+        stats = current.compare_to(self._previous or current, "lineno")
+        self._previous = current
+        return [
+            {
+                "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                "size_diff": stat.size_diff,
+                "size": stat.size,
+                "count_diff": stat.count_diff,
+                "count": stat.count,
+            }
+            for stat in stats[:limit]
+        ]
+
+    @staticmethod
+    def _snapshot() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+
+
+def rss_bytes() -> Optional[int]:
+    """Current resident set size, where ``/proc`` is available."""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+# Global instances (subscribed to the cache and served by /admin/memory in app.main)
+cache_sizer = CacheSizer()
+allocation_tracker = AllocationTracker()
@@ -0,0 +1,95 @@
+"""
+Sampling Profiler for GitHub Gists API
+In-process statistical profiler over all threads, emitting collapsed stacks for flamegraph tools
+"""
+from collections import Counter
+import os
+import sys
+import threading
+import time
+from types import CodeType, FrameType
+from typing import Dict, List, Optional, Tuple
+
+# Configuration from environment
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", 60))
+PROFILE_MAX_RATE = int(os.environ.get("PROFILE_MAX_RATE", 1000))  # Samples per second
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is running."""
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every thread (the event loop's included) at a fixed rate.
+
+    The sampler runs in its own thread and only reads ``sys._current_frames()``,
+    so profiled code is not instrumented and pays nothing between samples.
+    Stacks are counted as tuples of interned frame labels and joined only
+    once at the end. One profile runs at a time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._labels: Dict[Tuple[CodeType, int], str] = {}
+
+    def profile(self, seconds: float, rate: int) -> Tuple[Counter, int]:
+        """
+        Sample all threads for ``seconds`` at ``rate`` Hz (blocking).
+
+        Returns counts per stack (root first, thread name as the root frame)
+        and the number of sampling passes taken.
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("A profile is already running")
+        try:
+            return self._run(seconds, 1.0 / rate)
+        finally:
+            self._lock.release()
+
+    def _run(self, seconds: float, interval: float) -> Tuple[Counter, int]:
+        me = threading.get_ident()
+        stacks: Counter = Counter()
+        passes = 0
+        deadline = time.monotonic() + seconds
+        next_at = time.monotonic()
+        while next_at < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():  # pylint: disable=protected-access
+                if ident != me:
+                    stacks[self._stack(names.get(ident, f"thread-{ident}"), frame)] += 1
+            passes += 1
+            next_at += interval
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_at = time.monotonic()  # Fell behind; don't try to catch up with a burst
+        return stacks, passes
+
+    def _stack(self, thread_name: str, frame: Optional[FrameType]) -> Tuple[str, ...]:
+        labels: List[str] = []
+        while frame is not None:
+            key = (frame.f_code, frame.f_lineno)
+            label = self._labels.get(key)
+            if label is None:
+                code = frame.f_code
+                module = frame.f_globals.get("__name__", "?")
+                label = self._labels[key] = f"{code.co_qualname} ({module}:{frame.f_lineno})".replace(";", ":")
+            labels.append(label)
+            frame = frame.f_back
+        labels.append(thread_name.replace(";", ":"))
+        labels.reverse()
+        return tuple(labels)
+
+
+def collapse(stacks: Counter) -> str:
+    """Format stack counts as collapsed stacks (``root;...;leaf count`` per line)."""
+    return "".join(
+        f"{';'.join(stack)} {count}\n"
+        for stack, count in stacks.most_common()
+    )
+
+
+# Global profiler instance (served by /admin/profile in app.main)
+profiler = SamplingProfiler()
@@ -0,0 +1,257 @@
+"""
+Per-Client Rate Limiting for GitHub Gists API
+Token buckets keyed by API key or client IP, with a stricter bucket for cache bypass
+"""
+from collections import OrderedDict
+import hashlib
+import ipaddress
+import json
+import math
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from prometheus_client import Counter, Gauge
+
+# Configuration from environment
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_PER_MINUTE = float(os.environ.get("RATE_LIMIT_PER_MINUTE", 300))
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", 60))
+RATE_LIMIT_BYPASS_PER_MINUTE = float(os.environ.get("RATE_LIMIT_BYPASS_PER_MINUTE", 20))  # use_cache=false
+RATE_LIMIT_BYPASS_BURST = int(os.environ.get("RATE_LIMIT_BYPASS_BURST", 10))
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get("RATE_LIMIT_MAX_CLIENTS", 10000))  # Buckets kept per class
+# Proxies whose X-Forwarded-For is believed, as comma-separated CIDRs (none by default)
+RATE_LIMIT_TRUSTED_PROXIES = tuple(
+    ipaddress.ip_network(cidr.strip(), strict=False)
+    for cidr in os.environ.get("RATE_LIMIT_TRUSTED_PROXIES", "").split(",")
+    if cidr.strip()
+)
+# X-API-Key values that get their own bucket, comma-separated; other keys are ignored
+RATE_LIMIT_API_KEYS = frozenset(
+    key.strip() for key in os.environ.get("RATE_LIMIT_API_KEYS", "").split(",") if key.strip()
+)
+RATE_LIMIT_EXEMPT_PATHS = frozenset({"/", "/health", "/metrics"})
+
+# Prometheus metrics
+RATE_LIMIT_REJECTIONS = Counter(
+    "rate_limit_rejections_total",
+    "Requests rejected with 429 by per-client rate limiting",
+    ["bucket"],
+)
+RATE_LIMIT_CLIENTS = Gauge(
+    "rate_limit_clients",
+    "Clients with a partly drained token bucket",
+    ["bucket"],
+    multiprocess_mode="liveall",
+)
+
+
+class TokenBuckets:
+    """
+    Token buckets for many clients in a bounded, expiring LRU map.
+
+    Each client costs one 8-byte digest and a ``(tokens, updated_at)`` pair.
+    A bucket that has refilled completely is the same as no bucket, so idle
+    clients are dropped from the old end of the map as soon as they are full
+    again. ``max_clients`` caps the map regardless.
+    """
+
+    def __init__(self, name: str, per_minute: float, burst: int, max_clients: int):
+        self.name = name
+        self.rate = per_minute / 60.0
+        self.capacity = burst
+        self._max_clients = max_clients
+        self._buckets: "OrderedDict[bytes, Tuple[float, float]]" = OrderedDict()
+
+    def take(self, client: bytes, cost: int = 1, now: Optional[float] = None) -> Tuple[bool, float, float]:
+        """
+        Spend ``cost`` tokens for ``client`` (at most the bucket capacity).
+
+        Returns (allowed, tokens left, seconds until the bucket is full again).
+        """
+        now = time.monotonic() if now is None else now
+        cost = min(cost, self.capacity)
+        tokens, updated_at = self._buckets.pop(client, (float(self.capacity), now))
+        tokens = min(float(self.capacity), tokens + (now - updated_at) * self.rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        self._buckets[client] = (tokens, now)
+        self._expire(now)
+        return allowed, tokens, (self.capacity - tokens) / self.rate
+
+    def _expire(self, now: float) -> None:
+        while self._buckets:
+            tokens, updated_at = next(iter(self._buckets.values()))
+            refilled = tokens + (now - updated_at) * self.rate >= self.capacity
+            if not refilled and len(self._buckets) <= self._max_clients:
+                break
+            self._buckets.popitem(last=False)
+        RATE_LIMIT_CLIENTS.labels(bucket=self.name).set(len(self._buckets))
+
+    def clear(self) -> None:
+        """Drop all buckets."""
+        self._buckets.clear()
+        RATE_LIMIT_CLIENTS.labels(bucket=self.name).set(0)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+def _is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in RATE_LIMIT_TRUSTED_PROXIES)
+
+
+def client_address(scope: Dict) -> str:
+    """
+    The caller's IP: the peer address, or behind trusted proxies the rightmost untrusted hop.
+
+    ``X-Forwarded-For`` is only read when the peer is in RATE_LIMIT_TRUSTED_PROXIES;
+    hops are then skipped from the right while they are trusted proxies too,
+    since anything further left was written by the client itself.
+    """
+    address = (scope.get("client") or ("unknown",))[0]
+    if not _is_trusted_proxy(address):
+        return address
+    forwarded = b",".join(value for name, value in scope.get("headers") or () if name == b"x-forwarded-for")
+    for hop in reversed(forwarded.decode("latin-1").split(",")):
+        hop = hop.strip()
+        if not hop:
+            continue
+        address = hop
+        if not _is_trusted_proxy(hop):
+            break
+    return address
+
+
+def client_key(scope: Dict) -> bytes:
+    """Identify the caller by allowlisted API key, else by client address, as a short digest."""
+    api_key = dict(scope.get("headers") or ()).get(b"x-api-key", b"").decode("latin-1")
+    if api_key in RATE_LIMIT_API_KEYS:
+        identity = "key:" + api_key
+    else:
+        identity = "ip:" + client_address(scope)
+    return hashlib.blake2b(identity.encode(), digest_size=8).digest()
+
+
+# String spellings pydantic parses as False for a bool query parameter
+FALSE_QUERY_VALUES = frozenset({"0", "off", "f", "false", "n", "no"})
+
+
+def json_body(body: bytes) -> Dict[str, Any]:
+    """A request body parsed as a JSON object, or an empty dict if it is not one."""
+    try:
+        parsed = json.loads(body) if body else None
+    except ValueError:
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
+
+
+def bypasses_cache(scope: Dict, body: bytes = b"") -> bool:
+    """
+    True for ``use_cache=false`` requests, which always spend GitHub quota.
+
+    Reads the query string, or for requests with a JSON body (``POST /batch``)
+    the body's ``use_cache``, accepting every spelling of False pydantic does.
+    """
+    params = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    if "use_cache" in params:
+        return params["use_cache"][0].strip().lower() in FALSE_QUERY_VALUES
+    value = json_body(body).get("use_cache", True)
+    if isinstance(value, str):
+        return value.strip().lower() in FALSE_QUERY_VALUES
+    return value is False or (type(value) is int and value == 0)  # pylint: disable=unidiomatic-typecheck
+
+
+async def _buffer_body(receive) -> Tuple[bytes, Callable[[], Awaitable[Dict]]]:
+    """Read the whole request body; returns it with a ``receive`` that replays it."""
+    messages: List[Dict] = []
+    while True:
+        message = await receive()
+        messages.append(message)
+        if message["type"] != "http.request" or not message.get("more_body", False):
+            break
+    body = b"".join(m.get("body", b"") for m in messages if m["type"] == "http.request")
+
+    async def replay():
+        return messages.pop(0) if messages else await receive()
+
+    return body, replay
+
+
+class RateLimitMiddleware:
+    """
+    Pure ASGI middleware enforcing per-client token buckets.
+
+    Responses carry ``X-RateLimit-Limit``, ``X-RateLimit-Remaining`` and
+    ``X-RateLimit-Reset`` (Unix time when the bucket is full again); a client
+    with an empty bucket gets 429 with ``Retry-After``. ``OPTIONS`` requests
+    are not charged.
+
+    ``cost(scope, body)`` gives the tokens a request spends, so requests
+    fanning out to many GitHub calls pay for them; it is capped at the bucket
+    size so the largest request is still possible with a full bucket. POST
+    bodies are buffered (and replayed to the app) so both the cost and the
+    bucket can depend on them.
+    """
+
+    def __init__(
+        self, app, normal: TokenBuckets, bypass: TokenBuckets, cost: Callable[[Dict, bytes], int] = lambda s, b: 1
+    ):
+        self.app = app
+        self._normal = normal
+        self._bypass = bypass
+        self._cost = cost
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http" or not RATE_LIMIT_ENABLED or scope["path"] in RATE_LIMIT_EXEMPT_PATHS
+            or scope["method"] == "OPTIONS"  # CORS preflights are free; the request they clear is charged
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        body = b""
+        if scope["method"] == "POST":
+            body, receive = await _buffer_body(receive)
+        buckets = self._bypass if bypasses_cache(scope, body) else self._normal
+        cost = min(self._cost(scope, body), buckets.capacity)
+        allowed, tokens, refill_seconds = buckets.take(client_key(scope), cost)
+        headers = [
+            (b"x-ratelimit-limit", str(buckets.capacity).encode()),
+            (b"x-ratelimit-remaining", str(int(tokens)).encode()),
+            (b"x-ratelimit-reset", str(math.ceil(time.time() + refill_seconds)).encode()),
+        ]
+
+        if not allowed:
+            RATE_LIMIT_REJECTIONS.labels(bucket=buckets.name).inc()
+            retry_after = math.ceil((cost - tokens) / buckets.rate)
+            body = json.dumps({"detail": "Rate limit exceeded. Please slow down."}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": headers + [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(retry_after).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), *headers]
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+# Global bucket sets (installed as middleware in app.main)
+normal_buckets = TokenBuckets("normal", RATE_LIMIT_PER_MINUTE, RATE_LIMIT_BURST, RATE_LIMIT_MAX_CLIENTS)
+bypass_buckets = TokenBuckets("bypass", RATE_LIMIT_BYPASS_PER_MINUTE, RATE_LIMIT_BYPASS_BURST, RATE_LIMIT_MAX_CLIENTS)
@@ -0,0 +1,94 @@
+"""
+Per-Stage Request Timing for GitHub Gists API
+Monotonic stage timers collected per request, exported as histograms and Server-Timing
+"""
+from contextvars import ContextVar
+import time
+from typing import Dict, List, Optional
+
+from prometheus_client import Histogram
+
+# Stage names (kept fixed so the histogram's label set stays bounded)
+CACHE = "cache"
+UPSTREAM_QUEUE = "upstream_queue"
+UPSTREAM_WAIT = "upstream_wait"
+UPSTREAM_TRANSFER = "upstream_transfer"
+PARSE = "parse"
+SERIALIZE = "serialize"
+
+# Prometheus metrics
+REQUEST_STAGE_SECONDS = Histogram(
+    "http_request_stage_seconds",
+    "Time spent per request stage",
+    ["endpoint", "stage"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+# Stage durations of the current request; None outside a request (e.g. background tasks)
+_stages: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_stages", default=None)
+_HANDLER_DONE = "_handler_done"
+
+
+class stage:  # pylint: disable=invalid-name
+    """Context manager adding the time spent in its block to a stage of the current request."""
+
+    __slots__ = ("_name", "_start")
+
+    def __init__(self, name: str):
+        self._name = name
+        self._start = 0.0
+
+    def __enter__(self) -> None:
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        record(self._name, time.perf_counter() - self._start)
+
+
+def record(name: str, seconds: float) -> None:
+    """Add ``seconds`` to a stage of the current request."""
+    stages = _stages.get()
+    if stages is not None:
+        stages[name] = stages.get(name, 0.0) + seconds
+
+
+def begin_request() -> Dict[str, float]:
+    """Start collecting stages for the request running in this context."""
+    stages: Dict[str, float] = {}
+    _stages.set(stages)
+    return stages
+
+
+def detach() -> None:
+    """Stop attributing stages to the request this context was copied from."""
+    _stages.set(None)
+
+
+def mark_handler_done() -> None:
+    """Mark where the handler finished; the time until the response starts is serialization."""
+    stages = _stages.get()
+    if stages is not None:
+        stages[_HANDLER_DONE] = time.perf_counter()
+
+
+def response_started(stages: Dict[str, float]) -> None:
+    """Close the serialize stage when the response status line is sent."""
+    done = stages.pop(_HANDLER_DONE, None)
+    if done is not None:
+        stages[SERIALIZE] = stages.get(SERIALIZE, 0.0) + time.perf_counter() - done
+
+
+def server_timing(stages: Dict[str, float], total: float) -> bytes:
+    """Format stages (seconds) as a ``Server-Timing`` header value in milliseconds."""
+    parts: List[str] = [
+        f"{name};dur={seconds * 1000:.2f}" for name, seconds in stages.items() if name != _HANDLER_DONE
+    ]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts).encode("latin-1")
+
+
+def observe(endpoint: str, stages: Dict[str, float]) -> None:
+    """Record the request's stages in the histogram."""
+    for name, seconds in stages.items():
+        if name != _HANDLER_DONE:
+            REQUEST_STAGE_SECONDS.labels(endpoint=endpoint, stage=name).observe(seconds)
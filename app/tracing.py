@@ -1,51 +1,241 @@
 """
 OpenTelemetry Configuration for GitHub Gists API
-Enables distributed tracing with Tempo integration
+Enables distributed tracing with Tempo integration, head sampling and a keep-slow-or-errored tail rule
 """
+from collections import OrderedDict
+from contextlib import nullcontext
+import logging
 import os
-from typing import Optional
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from prometheus_client import Counter
 
 # OpenTelemetry imports - graceful fallback if not installed
 try:
     from opentelemetry import trace
-    from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
-    from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
-    from opentelemetry.instrumentation.httpx import HTTPXClientInstrumentor
-    from opentelemetry.instrumentation.logging import LoggingInstrumentor
     from opentelemetry.sdk.resources import Resource
-    from opentelemetry.sdk.trace import TracerProvider
-    from opentelemetry.sdk.trace.export import BatchSpanProcessor
-    from opentelemetry.propagate import set_global_textmap
-    from opentelemetry.propagators.b3 import B3MultiFormat
+    from opentelemetry.sdk.trace import ReadableSpan, SpanProcessor, TracerProvider
+    from opentelemetry.sdk.trace.sampling import (
+        ALWAYS_OFF,
+        Decision,
+        ParentBased,
+        Sampler,
+        SamplingResult,
+        TraceIdRatioBased,
+    )
+    from opentelemetry.trace import SpanContext, StatusCode, TraceFlags
     OTEL_AVAILABLE = True
 except ImportError:
     OTEL_AVAILABLE = False
 
+logger = logging.getLogger(__name__)
+
 # Configuration from environment
 OTEL_ENABLED = os.environ.get("OTEL_ENABLED", "true").lower() == "true"
 OTEL_SERVICE_NAME = os.environ.get("OTEL_SERVICE_NAME", "github-gists-api")
 OTEL_EXPORTER_OTLP_ENDPOINT = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT", "http://tempo.monitoring.svc.cluster.local:4317")
 OTEL_EXPORTER_OTLP_INSECURE = os.environ.get("OTEL_EXPORTER_OTLP_INSECURE", "true").lower() == "true"
+OTEL_TRACES_SAMPLER_ARG = float(os.environ.get("OTEL_TRACES_SAMPLER_ARG", 0.1))  # Head-sampled share of new traces
+OTEL_TRACES_KEEP_SLOW = float(os.environ.get("OTEL_TRACES_KEEP_SLOW", 1.0))  # Seconds; 0 disables the slow rule
+OTEL_TRACES_KEEP_ERRORS = os.environ.get("OTEL_TRACES_KEEP_ERRORS", "true").lower() == "true"
+OTEL_TRACES_PENDING_MAX = int(os.environ.get("OTEL_TRACES_PENDING_MAX", 2048))  # Unsampled traces held open
+
+# Prometheus metrics
+TRACES_TAIL_DECISIONS = Counter(
+    "tracing_tail_decisions_total",
+    "Traces not head-sampled, by whether the slow/error rule exported them",
+    ["decision"],
+)
+
+
+class _NoopSpan:
+    """Stands in for a span when tracing is off, so callers can set attributes unconditionally."""
+
+    __slots__ = ()
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_attributes(self, attributes: Dict[str, Any]) -> None:
+        pass
+
+    def is_recording(self) -> bool:
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+_tracer = None  # Set by setup_tracing; None means spans cost nothing
+
+
+if OTEL_AVAILABLE:
+    class RecordingSampler(Sampler):
+        """
+        Wraps a sampler so traces it drops are still recorded, but not sampled.
+
+        Recorded spans reach span processors with the sampled flag unset,
+        which lets ``TailKeepProcessor`` export the slow or failed ones after all.
+        """
+
+        def __init__(self, sampler: Sampler):
+            self._sampler = sampler
+
+        def should_sample(
+            self, parent_context, trace_id, name, kind=None, attributes=None, links=None, trace_state=None
+        ):
+            result = self._sampler.should_sample(
+                parent_context, trace_id, name, kind, attributes, links, trace_state
+            )
+            if result.decision is Decision.DROP:
+                return SamplingResult(Decision.RECORD_ONLY, attributes, result.trace_state)
+            return result
+
+        def get_description(self) -> str:
+            return f"RecordingSampler{{{self._sampler.get_description()}}}"
+
+    class TailKeepProcessor(SpanProcessor):
+        """
+        Passes sampled spans straight on and holds unsampled ones until their trace ends.
+
+        When the local root span ends, its trace is exported if the root took
+        at least ``slow_threshold`` seconds or has an error status (for a
+        server span, a 5xx response); otherwise it is dropped. At most
+        ``max_pending`` unfinished traces are held, oldest dropped first.
+        """
+
+        def __init__(self, delegate: SpanProcessor, slow_threshold: float, keep_errors: bool, max_pending: int):
+            self._delegate = delegate
+            self._slow_ns = int(slow_threshold * 1e9) if slow_threshold > 0 else None
+            self._keep_errors = keep_errors
+            self._max_pending = max_pending
+            self._pending: "OrderedDict[int, List[ReadableSpan]]" = OrderedDict()
+            self._lock = threading.Lock()
+
+        def on_start(self, span, parent_context=None) -> None:
+            self._delegate.on_start(span, parent_context=parent_context)
+
+        def on_end(self, span: "ReadableSpan") -> None:
+            if span.context.trace_flags.sampled:
+                self._delegate.on_end(span)
+                return
+
+            trace_id = span.context.trace_id
+            local_root = span.parent is None or span.parent.is_remote
+            with self._lock:
+                if not local_root:
+                    self._pending.setdefault(trace_id, []).append(span)
+                    if len(self._pending) > self._max_pending:
+                        self._pending.popitem(last=False)
+                        TRACES_TAIL_DECISIONS.labels(decision="evicted").inc()
+                    return
+                spans = self._pending.pop(trace_id, [])
+            spans.append(span)
+
+            decision = self._decide(span)
+            TRACES_TAIL_DECISIONS.labels(decision=decision).inc()
+            if decision != "dropped":
+                for pending in spans:
+                    self._delegate.on_end(_as_sampled(pending))
+
+        def _decide(self, root: "ReadableSpan") -> str:
+            # Only the root's status counts: a child error the request recovered from is not a failure
+            if self._keep_errors and root.status.status_code is StatusCode.ERROR:
+                return "kept_error"
+            if self._slow_ns is not None and root.end_time - root.start_time >= self._slow_ns:
+                return "kept_slow"
+            return "dropped"
+
+        def shutdown(self) -> None:
+            self._delegate.shutdown()
+
+        def force_flush(self, timeout_millis: int = 30000) -> bool:
+            return self._delegate.force_flush(timeout_millis)
+
+    def _as_sampled(span: "ReadableSpan") -> "ReadableSpan":
+        """Copy of a finished span with the sampled flag set, so exporting processors accept it."""
+
+        ctx = span.context
+        sampled = TraceFlags(TraceFlags.SAMPLED)
+        return ReadableSpan(
+            name=span.name,
+            context=SpanContext(ctx.trace_id, ctx.span_id, ctx.is_remote, sampled, ctx.trace_state),
+            parent=span.parent,
+            resource=span.resource,
+            attributes=span.attributes,
+            events=span.events,
+            links=span.links,
+            kind=span.kind,
+            status=span.status,
+            start_time=span.start_time,
+            end_time=span.end_time,
+            instrumentation_scope=span.instrumentation_scope,
+        )
+
+
+def build_tracer_provider(
+    export_processor,
+    ratio: float = OTEL_TRACES_SAMPLER_ARG,
+    slow_threshold: float = OTEL_TRACES_KEEP_SLOW,
+    keep_errors: bool = OTEL_TRACES_KEEP_ERRORS,
+    resource=None,
+) -> "TracerProvider":
+    """
+    Tracer provider with parent-based ratio sampling in front of ``export_processor``.
+
+    New traces are sampled with probability ``ratio``; traces with a parent
+    follow the parent's decision. With the slow or error rule on, traces that
+    lose the coin flip are recorded anyway and kept only if they turn out slow
+    or failed. With both rules off, unsampled spans are not recorded at all.
+    """
+
+    tail = slow_threshold > 0 or keep_errors
+    if tail:
+        sampler = ParentBased(
+            root=RecordingSampler(TraceIdRatioBased(ratio)),
+            remote_parent_not_sampled=RecordingSampler(ALWAYS_OFF),
+            local_parent_not_sampled=RecordingSampler(ALWAYS_OFF),
+        )
+        processor = TailKeepProcessor(export_processor, slow_threshold, keep_errors, OTEL_TRACES_PENDING_MAX)
+    else:
+        sampler = ParentBased(root=TraceIdRatioBased(ratio))
+        processor = export_processor
+
+    provider = TracerProvider(resource=resource or Resource.create({}), sampler=sampler)
+    provider.add_span_processor(processor)
+    return provider
 
 
-def setup_tracing(app=None) -> Optional[trace.Tracer]:
+def setup_tracing(app=None) -> "Optional[trace.Tracer]":
     """
     Configure OpenTelemetry tracing for the application.
-    
+
     Returns:
         Tracer instance if successful, None otherwise
     """
+    global _tracer
+
     if not OTEL_AVAILABLE:
-        print("⚠️  OpenTelemetry packages not installed. Tracing disabled.")
-        print("   Install with: pip install opentelemetry-api opentelemetry-sdk opentelemetry-exporter-otlp-proto-grpc")
-        print("                 pip install opentelemetry-instrumentation-fastapi opentelemetry-instrumentation-httpx")
+        logger.info(
+            "OpenTelemetry packages not installed - tracing disabled "
+            "(pip install opentelemetry-sdk opentelemetry-exporter-otlp-proto-grpc "
+            "opentelemetry-instrumentation-fastapi opentelemetry-instrumentation-httpx)"
+        )
         return None
-    
+
     if not OTEL_ENABLED:
-        print("ℹ️  OpenTelemetry disabled via OTEL_ENABLED=false")
+        logger.info("OpenTelemetry disabled via OTEL_ENABLED=false")
         return None
-    
+
     try:
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+        from opentelemetry.instrumentation.httpx import HTTPXClientInstrumentor
+        from opentelemetry.instrumentation.logging import LoggingInstrumentor
+        from opentelemetry.propagate import set_global_textmap
+        from opentelemetry.propagators.b3 import B3MultiFormat
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
         # Create resource with service info
         resource = Resource.create({
             "service.name": OTEL_SERVICE_NAME,
@@ -54,87 +244,82 @@ def setup_tracing(app=None) -> Optional[trace.Tracer]:
             "service.namespace": os.environ.get("POD_NAMESPACE", "default"),
             "service.instance.id": os.environ.get("POD_NAME", "unknown"),
         })
-        
-        # Create tracer provider
-        tracer_provider = TracerProvider(resource=resource)
-        
+
         # Configure OTLP exporter (sends to Tempo)
         otlp_exporter = OTLPSpanExporter(
             endpoint=OTEL_EXPORTER_OTLP_ENDPOINT,
             insecure=OTEL_EXPORTER_OTLP_INSECURE,
         )
-        
-        # Add batch processor for efficiency
-        span_processor = BatchSpanProcessor(otlp_exporter)
-        tracer_provider.add_span_processor(span_processor)
-        
+
+        # Sampled (and tail-kept) spans are exported in batches
+        tracer_provider = build_tracer_provider(BatchSpanProcessor(otlp_exporter), resource=resource)
+
         # Set global tracer provider
         trace.set_tracer_provider(tracer_provider)
-        
+
         # Use B3 propagation format (compatible with Istio)
         set_global_textmap(B3MultiFormat())
-        
-        # Auto-instrument FastAPI
+
+        # Auto-instrument FastAPI; per-message ASGI send/receive spans are skipped as noise
         if app is not None:
-            FastAPIInstrumentor.instrument_app(app)
-            print(f"✅ FastAPI instrumented for tracing")
-        
+            FastAPIInstrumentor.instrument_app(app, exclude_spans=["receive", "send"])
+
         # Auto-instrument HTTPX (outgoing HTTP calls)
         HTTPXClientInstrumentor().instrument()
-        print(f"✅ HTTPX instrumented for tracing")
-        
+
         # Auto-instrument logging (adds trace context to logs)
         LoggingInstrumentor().instrument(set_logging_format=True)
-        print(f"✅ Logging instrumented with trace context")
-        
-        print(f"🔍 OpenTelemetry tracing configured:")
-        print(f"   Service: {OTEL_SERVICE_NAME}")
-        print(f"   Exporter: {OTEL_EXPORTER_OTLP_ENDPOINT}")
-        
-        return trace.get_tracer(OTEL_SERVICE_NAME)
-    
+
+        logger.info(
+            "OpenTelemetry tracing configured: service %s, exporter %s, sample ratio %.3f, "
+            "keep slow >= %.2fs, keep errors %s",
+            OTEL_SERVICE_NAME, OTEL_EXPORTER_OTLP_ENDPOINT, OTEL_TRACES_SAMPLER_ARG,
+            OTEL_TRACES_KEEP_SLOW, OTEL_TRACES_KEEP_ERRORS,
+        )
+
+        _tracer = trace.get_tracer(OTEL_SERVICE_NAME)
+        return _tracer
+
     except Exception as e:
-        print(f"⚠️  Failed to configure OpenTelemetry: {e}")
+        logger.warning("Failed to configure OpenTelemetry: %s", e)
         return None
 
 
-def get_tracer() -> trace.Tracer:
-    """Get the configured tracer instance."""
-    if not OTEL_AVAILABLE:
-        return None
-    return trace.get_tracer(OTEL_SERVICE_NAME)
+def get_tracer() -> "Optional[trace.Tracer]":
+    """Get the configured tracer instance (None until setup_tracing succeeds)."""
+    return _tracer
 
 
-def create_span(name: str, attributes: dict = None):
+def create_span(name: str, attributes: Optional[Dict[str, Any]] = None):
     """
     Create a new span for custom instrumentation.
-    
+
     Usage:
         with create_span("operation_name", {"key": "value"}) as span:
             # Your code here
             span.set_attribute("result", "success")
+
+    Without a configured tracer this yields a no-op span.
     """
-    if not OTEL_AVAILABLE:
-        from contextlib import nullcontext
-        return nullcontext()
-    
-    tracer = get_tracer()
-    if tracer is None:
-        from contextlib import nullcontext
-        return nullcontext()
-    
-    span = tracer.start_as_current_span(name)
-    if attributes:
-        for key, value in attributes.items():
-            span.set_attribute(key, value)
-    return span
+    if _tracer is None:
+        return nullcontext(_NOOP_SPAN)
+    return _tracer.start_as_current_span(name, attributes=attributes)
+
+
+def record_span(name: str, seconds: float, attributes: Optional[Dict[str, Any]] = None) -> None:
+    """Record a child span of the current span that ended just now and lasted ``seconds``."""
+    if _tracer is None:
+        return
+    end = time.time_ns()
+    span = _tracer.start_span(name, attributes=attributes, start_time=end - int(seconds * 1e9))
+    span.end(end_time=end)
 
 
 # Decorator for tracing functions
 def traced(name: str = None, attributes: dict = None):
     """
     Decorator to automatically trace a function.
-    
+
     Usage:
         @traced("fetch_gists")
         async def fetch_gists(username: str):
@@ -145,15 +330,15 @@ def traced(name: str = None, attributes: dict = None):
             span_name = name or func.__name__
             with create_span(span_name, attributes):
                 return await func(*args, **kwargs)
-        
+
         def sync_wrapper(*args, **kwargs):
             span_name = name or func.__name__
             with create_span(span_name, attributes):
                 return func(*args, **kwargs)
-        
+
         import asyncio
         if asyncio.iscoroutinefunction(func):
             return async_wrapper
         return sync_wrapper
-    
+
     return decorator
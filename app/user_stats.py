@@ -0,0 +1,144 @@
+"""
+Per-User Gist Statistics for GitHub Gists API
+Aggregates over cached full gist histories, updated incrementally on refresh
+"""
+from collections import Counter
+from itertools import chain
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from prometheus_client import Counter as MetricCounter
+
+# Prometheus metrics
+USER_STATS_UPDATES = MetricCounter(
+    "user_stats_updates_total",
+    "Per-user aggregate updates by mode (full build or incremental refresh)",
+    ["mode"],
+)
+
+# What one gist contributes: (languages, file count, total file size, creation month)
+Contribution = Tuple[FrozenSet[str], int, int, str]
+
+
+def contribution(gist: Any) -> Contribution:
+    """Reduce a gist record to the values the aggregates are built from."""
+    files = gist.files.values()
+    languages = frozenset(f["language"] for f in files if isinstance(f, dict) and f.get("language"))
+    size = sum(f.get("size") or 0 for f in files if isinstance(f, dict))
+    return languages, len(gist.files), size, gist.created_at[:7]
+
+
+class UserAggregates:
+    """
+    Running totals for one user's gist history.
+
+    Contributions are kept per gist id, so a refresh only adds and subtracts
+    the gists that changed instead of recounting the whole history.
+    """
+
+    def __init__(self):
+        self.contributions: Dict[str, Contribution] = {}  # gist id -> contribution
+        self.languages: Counter = Counter()  # language -> gists using it
+        self.files_per_gist: Counter = Counter()  # file count -> gists
+        self.activity: Counter = Counter()  # "YYYY-MM" -> gists created
+        self.total_files = 0
+        self.total_file_size = 0
+        self.truncated = False
+
+    def apply(self, added: List[Contribution], removed: List[Contribution]) -> None:
+        """Add and subtract whole batches of contributions."""
+        for sign, batch in ((1, added), (-1, removed)):
+            if not batch:
+                continue
+            languages, file_counts, sizes, months = zip(*batch)
+            delta = (
+                Counter(chain.from_iterable(languages)),
+                Counter(file_counts),
+                Counter(months),
+            )
+            if sign > 0:
+                self.languages += delta[0]
+                self.files_per_gist += delta[1]
+                self.activity += delta[2]
+            else:
+                self.languages -= delta[0]
+                self.files_per_gist -= delta[1]
+                self.activity -= delta[2]
+            self.total_files += sign * sum(file_counts)
+            self.total_file_size += sign * sum(sizes)
+
+    def update(self, payload: Dict[str, Any]) -> "UserAggregates":
+        """Bring the totals in line with a cached full-history payload."""
+        current = {gist.id: contribution(gist) for gist in payload.get("gists", ())}
+        previous = self.contributions
+        removed = [c for gist_id, c in previous.items() if current.get(gist_id) != c]
+        added = [c for gist_id, c in current.items() if previous.get(gist_id) != c]
+        self.apply(added, removed)
+        self.contributions = current
+        self.truncated = bool(payload.get("pagination", {}).get("truncated"))
+        return self
+
+    def summary(self) -> Dict[str, Any]:
+        """Return the aggregates in response form."""
+        gist_count = len(self.contributions)
+        return {
+            "gist_count": gist_count,
+            "total_files": self.total_files,
+            "total_file_size": self.total_file_size,
+            "languages": dict(self.languages.most_common()),
+            "files_per_gist": {str(k): v for k, v in sorted(self.files_per_gist.items())},
+            "mean_files_per_gist": self.total_files / gist_count if gist_count else 0,
+            "activity": dict(sorted(self.activity.items())),
+            "truncated": self.truncated,
+        }
+
+
+class UserStatsIndex:
+    """
+    Cache listener keeping aggregates for every cached ``gists:{username}:all`` entry.
+
+    A refresh is an eviction immediately followed by a set of the same key;
+    the evicted aggregates are held over for that set, which then applies
+    only the gists that were added, removed or changed.
+    """
+
+    def __init__(self):
+        self._users: Dict[str, UserAggregates] = {}
+        self._held: Optional[Tuple[str, UserAggregates]] = None
+
+    @staticmethod
+    def _username(key: str) -> Optional[str]:
+        prefix, _, rest = key.partition(":")
+        username, _, suffix = rest.rpartition(":")
+        return username if prefix == "gists" and suffix == "all" and username else None
+
+    def on_set(self, key: str, value: Any) -> None:
+        username = self._username(key)
+        if username is None:
+            return
+        held, self._held = self._held, None
+        if held is not None and held[0] == username:
+            aggregates, mode = held[1], "incremental"
+        else:
+            aggregates, mode = UserAggregates(), "full"
+
+        self._users[username] = aggregates.update(value)
+        USER_STATS_UPDATES.labels(mode=mode).inc()
+
+    def on_evict(self, key: str, value: Any) -> None:
+        username = self._username(key)
+        if username is None:
+            return
+        aggregates = self._users.pop(username, None)
+        self._held = (username, aggregates) if aggregates is not None else None
+
+    def get(self, username: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Return the aggregates for ``username``, building them from ``payload`` if not held."""
+        aggregates = self._users.get(username)
+        if aggregates is None:
+            USER_STATS_UPDATES.labels(mode="full").inc()
+            aggregates = UserAggregates().update(payload)
+        return aggregates.summary()
+
+
+# Global stats instance (subscribed to gists_cache in app.main)
+user_stats = UserStatsIndex()
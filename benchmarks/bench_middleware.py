@@ -0,0 +1,108 @@
+"""
+Middleware Benchmark for GitHub Gists API
+Compares the old BaseHTTPMiddleware metrics hook against the pure ASGI MetricsMiddleware
+
+Each variant drives a minimal FastAPI app straight through ASGI (no sockets),
+with a distinct username per request, and reports per-request time and the
+number of http_requests_total series it left behind.
+
+Usage:
+    python benchmarks/bench_middleware.py [--requests 5000] [--rounds 3]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def build_app(variant: str):
+    """Minimal app with a ``/{username}`` route and the chosen metrics middleware."""
+    from fastapi import FastAPI, Request
+
+    from app.main import ACTIVE_REQUESTS, REQUEST_COUNT, REQUEST_LATENCY, MetricsMiddleware
+
+    bench_app = FastAPI()
+
+    @bench_app.get("/{username}")
+    async def user(username: str):
+        return {"username": username}
+
+    if variant == "before":
+        @bench_app.middleware("http")
+        async def metrics_middleware(request: Request, call_next):
+            ACTIVE_REQUESTS.inc()
+            start_time = time.time()
+            try:
+                response = await call_next(request)
+                duration = time.time() - start_time
+                REQUEST_COUNT.labels(
+                    method=request.method, endpoint=request.url.path, status=response.status_code
+                ).inc()
+                REQUEST_LATENCY.labels(method=request.method, endpoint=request.url.path).observe(duration)
+                return response
+            finally:
+                ACTIVE_REQUESTS.dec()
+    elif variant == "after":
+        bench_app.add_middleware(MetricsMiddleware)
+
+    return bench_app
+
+
+async def drive(asgi_app, requests: int, offset: int) -> float:
+    """Send ``requests`` GETs through the ASGI app; returns elapsed seconds."""
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+    for i in range(requests):
+        path = f"/user{offset + i}"
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+            "query_string": b"", "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 1),
+            "server": ("bench", 80),
+        }
+        await asgi_app(scope, receive, send)
+    return time.perf_counter() - start
+
+
+def series_count() -> int:
+    from prometheus_client import REGISTRY
+
+    return sum(
+        1 for metric in REGISTRY.collect() if metric.name == "http_requests"
+        for sample in metric.samples if sample.name == "http_requests_total"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    results = {}
+    for variant in ("none", "before", "after"):
+        asgi_app = build_app(variant)
+        series_before = series_count()
+        asyncio.run(drive(asgi_app, 200, 0))  # warm up
+        timings = [
+            asyncio.run(drive(asgi_app, args.requests, (r + 1) * args.requests)) for r in range(args.rounds)
+        ]
+        results[variant] = (min(timings) / args.requests, series_count() - series_before)
+
+    baseline = results["none"][0]
+    print(f"{'variant':<8} {'per request':>12} {'overhead':>10} {'new series':>11}")
+    for variant, (per_request, series) in results.items():
+        print(f"{variant:<8} {per_request * 1e6:>10.1f}us {(per_request - baseline) * 1e6:>8.1f}us {series:>11}")
+
+
+if __name__ == "__main__":
+    main()
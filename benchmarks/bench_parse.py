@@ -0,0 +1,148 @@
+"""
+Parse Benchmark for GitHub Gists API
+Compares response.json() + GistInfo construction against TypeAdapter.validate_json
+
+Each variant runs in a fresh subprocess so peak RSS is not polluted by the other.
+validate_json is faster and peaks lower on the Python heap, but its peak RSS is
+higher: pydantic-core builds its JSON tree outside the Python heap.
+
+Usage:
+    python benchmarks/bench_parse.py [--gists 3000] [--files 5] [--rounds 5]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def make_payload(gists: int, files: int) -> bytes:
+    """Build a GitHub-shaped /users/{user}/gists payload."""
+    owner = {
+        "login": "octocat", "id": 583231, "node_id": "MDQ6VXNlcjU4MzIzMQ==",
+        "avatar_url": "https://avatars.githubusercontent.com/u/583231?v=4",
+        "gravatar_id": "", "url": "https://api.github.com/users/octocat",
+        "html_url": "https://github.com/octocat", "type": "User", "site_admin": False,
+    }
+    items = []
+    for i in range(gists):
+        gist_id = f"{i:032x}"
+        items.append({
+            "url": f"https://api.github.com/gists/{gist_id}",
+            "forks_url": f"https://api.github.com/gists/{gist_id}/forks",
+            "commits_url": f"https://api.github.com/gists/{gist_id}/commits",
+            "id": gist_id,
+            "node_id": f"G_kwDO{gist_id[:20]}",
+            "git_pull_url": f"https://gist.github.com/{gist_id}.git",
+            "git_push_url": f"https://gist.github.com/{gist_id}.git",
+            "html_url": f"https://gist.github.com/octocat/{gist_id}",
+            "files": {
+                f"file_{j}.py": {
+                    "filename": f"file_{j}.py",
+                    "type": "application/x-python",
+                    "language": "Python",
+                    "raw_url": f"https://gist.githubusercontent.com/octocat/{gist_id}/raw/{j:040x}/file_{j}.py",
+                    "size": 1024 + j,
+                }
+                for j in range(files)
+            },
+            "public": True,
+            "created_at": "2024-01-01T00:00:00Z",
+            "updated_at": "2024-01-02T00:00:00Z",
+            "description": f"Benchmark gist number {i} with a reasonably long description",
+            "comments": 0,
+            "user": None,
+            "comments_url": f"https://api.github.com/gists/{gist_id}/comments",
+            "owner": owner,
+            "truncated": False,
+        })
+    return json.dumps(items).encode()
+
+
+def parse_before(body: bytes):
+    """Previous path: decode to dicts, then build GistInfo per gist."""
+    import httpx
+    from app.main import GistInfo
+
+    gists_data = httpx.Response(200, content=body).json()
+    return [
+        GistInfo(
+            id=g["id"],
+            description=g.get("description"),
+            url=g["html_url"],
+            created_at=g["created_at"],
+            files=g["files"],
+        )
+        for g in gists_data
+    ]
+
+
+def parse_after(body: bytes):
+    """Current path: validate straight from bytes."""
+    from app.main import UPSTREAM_GISTS_ADAPTER
+
+    return UPSTREAM_GISTS_ADAPTER.validate_json(body)
+
+
+def run_variant(name: str, gists: int, files: int, rounds: int) -> dict:
+    """Measure one variant in this process."""
+    parse = {"before": parse_before, "after": parse_after}[name]
+    body = make_payload(gists, files)
+    parse(make_payload(1, 1))  # import and warm up outside the measurement
+
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = parse(body)
+        timings.append(time.perf_counter() - start)
+        del result
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    tracemalloc.start()
+    result = parse(body)
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "variant": name,
+        "payload_kb": len(body) // 1024,
+        "best_ms": min(timings) * 1000,
+        "median_ms": sorted(timings)[len(timings) // 2] * 1000,
+        "rss_growth_kb": peak_rss - baseline_rss,
+        "python_peak_kb": traced_peak // 1024,
+        "count": len(result),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--gists", type=int, default=3000)
+    parser.add_argument("--files", type=int, default=5)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--variant", choices=["before", "after"])
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(run_variant(args.variant, args.gists, args.files, args.rounds)))
+        return
+
+    print(f"{'variant':<8} {'payload':>10} {'best':>10} {'median':>10} {'rss growth':>12} {'py peak':>10}")
+    for variant in ("before", "after"):
+        out = subprocess.run(
+            [sys.executable, __file__, "--variant", variant,
+             "--gists", str(args.gists), "--files", str(args.files), "--rounds", str(args.rounds)],
+            check=True, capture_output=True, text=True,
+        )
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        print(f"{r['variant']:<8} {r['payload_kb']:>8}KB {r['best_ms']:>8.1f}ms {r['median_ms']:>8.1f}ms "
+              f"{r['rss_growth_kb']:>10}KB {r['python_peak_kb']:>8}KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Tracing Overhead Benchmark for GitHub Gists API
+Measures per-request cost of OpenTelemetry tracing at different sampling ratios
+
+Each variant drives a minimal FastAPI app straight through ASGI (no sockets)
+with the same middleware as the service and a handler that opens the same
+cache lookup span and marks serialization as ``/{username}`` does on a cache
+hit. Spans go through a BatchSpanProcessor to an exporter that discards them.
+
+Requires opentelemetry-sdk and opentelemetry-instrumentation-fastapi.
+
+Usage:
+    python benchmarks/bench_tracing.py [--requests 5000] [--rounds 3]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# (label, sample ratio, slow/error tail rule); ratio None means tracing is off
+VARIANTS = [
+    ("off", None, False),
+    ("0%", 0.0, False),
+    ("0% + tail", 0.0, True),
+    ("1% + tail", 0.01, True),
+    ("10% + tail", 0.1, True),
+    ("100%", 1.0, False),
+]
+
+
+def build_app(ratio, tail: bool):
+    """Minimal app with a ``/{username}`` route, traced at ``ratio`` unless it is None."""
+    from fastapi import FastAPI
+    from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+
+    from app import timing, tracing
+    from app.main import MetricsMiddleware
+
+    class DiscardExporter(SpanExporter):
+        def export(self, spans):
+            return SpanExportResult.SUCCESS
+
+    bench_app = FastAPI()
+
+    @bench_app.get("/{username}")
+    async def user(username: str):
+        with tracing.create_span("cache.lookup", {"cache.key": username}) as span:
+            span.set_attribute("cache.hit", True)
+        timing.mark_handler_done()
+        return {"username": username}
+
+    bench_app.add_middleware(MetricsMiddleware)
+
+    if ratio is None:
+        tracing._tracer = None  # pylint: disable=protected-access
+        return bench_app, None
+    provider = tracing.build_tracer_provider(
+        BatchSpanProcessor(DiscardExporter()), ratio=ratio, slow_threshold=1.0 if tail else 0, keep_errors=tail
+    )
+    FastAPIInstrumentor.instrument_app(bench_app, tracer_provider=provider, exclude_spans=["receive", "send"])
+    tracing._tracer = provider.get_tracer("bench")  # pylint: disable=protected-access
+    return bench_app, provider
+
+
+async def drive(asgi_app, requests: int) -> float:
+    """Send ``requests`` GETs through the ASGI app; returns elapsed seconds."""
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+    for i in range(requests):
+        path = f"/user{i % 100}"
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+            "query_string": b"", "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 1),
+            "server": ("bench", 80),
+        }
+        await asgi_app(scope, receive, send)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    results = {}
+    for label, ratio, tail in VARIANTS:
+        asgi_app, provider = build_app(ratio, tail)
+        asyncio.run(drive(asgi_app, 200))  # warm up
+        timings = [asyncio.run(drive(asgi_app, args.requests)) for _ in range(args.rounds)]
+        results[label] = min(timings) / args.requests
+        if provider is not None:
+            provider.shutdown()
+
+    baseline = results["off"]
+    print(f"{'sampling':<11} {'per request':>12} {'overhead':>10}")
+    for label, per_request in results.items():
+        print(f"{label:<11} {per_request * 1e6:>10.1f}us {(per_request - baseline) * 1e6:>8.1f}us")
+
+
+if __name__ == "__main__":
+    main()
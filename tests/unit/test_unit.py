@@ -4,6 +4,23 @@ import time
 from unittest.mock import patch, AsyncMock
 from app.main import SimpleCache, app
 from fastapi.testclient import TestClient
+import asyncio
+import ipaddress
+import json
+import math
+import threading
+import httpx
+from prometheus_client import REGISTRY
+from app import github_graphql, rate_limit, tracing
+from app.admission import GradientLimit
+from app.content_store import ContentStore
+from app.indexes import GistFilterIndex, GistIdIndex
+from app.limiter import FairLimiter, UpstreamQueueTimeout
+from app.loop_monitor import LoopMonitor, loop_monitor
+import app.main as main
+from app.memory import CacheSizer, cache_sizer, deep_size, estimate_payload
+from app.profiler import SamplingProfiler, collapse
+from app.rate_limit import TokenBuckets, bypass_buckets, client_address, normal_buckets
 
 # ==========================================
 # Unit Tests for SimpleCache
@@ -76,3 +93,1473 @@ def test_root_route():
 # Note: Testing /{username} requires mocking httpx.AsyncClient or respx.
 # Since app.main.http_client is global, we need to mock it properly in the context of the running app or dependency.,
 # For this basic unit test coverage, we've covered the components and basic routes.
+
+# ==========================================
+# Upstream Limiter and Stale Fallback
+# ==========================================
+
+
+def sample_gist(gist_id, created_at="2024-01-01T00:00:00Z", files=None):
+    return {
+        "id": gist_id,
+        "description": f"gist {gist_id}",
+        "html_url": f"https://gist.github.com/{gist_id}",
+        "url": f"https://api.github.com/gists/{gist_id}",
+        "created_at": created_at,
+        "files": files or {"hello.py": {"filename": "hello.py", "language": "Python", "size": 10}},
+    }
+
+
+@pytest.fixture
+def github(monkeypatch):
+    """Route the app's HTTP client to a handler set by the test."""
+    main.gists_cache.clear()
+    routes = {}
+
+    def handler(request):
+        return routes["handler"](request)
+
+    monkeypatch.setattr(main, "http_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    yield routes
+    main.gists_cache.clear()
+
+
+def test_limiter_round_robin_between_keys():
+    async def scenario():
+        limiter = FairLimiter(limit=1, queue_timeout=1.0)
+        await limiter.acquire("holder")
+        order = []
+
+        async def worker(key):
+            await limiter.acquire(key)
+            order.append(key)
+            limiter.release()
+
+        tasks = [asyncio.create_task(worker(k)) for k in ["hot", "hot", "hot", "cold"]]
+        await asyncio.sleep(0)
+        limiter.release()
+        await asyncio.gather(*tasks)
+        return order, limiter.in_flight
+
+    order, in_flight = asyncio.run(scenario())
+    assert order == ["hot", "cold", "hot", "hot"]
+    assert in_flight == 0
+
+
+def test_limiter_queue_timeout():
+    async def scenario():
+        limiter = FairLimiter(limit=1, queue_timeout=0.01)
+        await limiter.acquire("a")
+        with pytest.raises(UpstreamQueueTimeout):
+            await limiter.acquire("b")
+        return limiter.queue_depth
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_cache_get_stale_within_window():
+    cache = SimpleCache(default_ttl=10, stale_ttl=30)
+    with patch("time.time") as mock_time:
+        mock_time.return_value = 1000.0
+        cache.set("k", "v")
+        mock_time.return_value = 1020.0
+        assert cache.get("k") is None
+        assert cache.get_stale("k") == "v"
+        mock_time.return_value = 1050.0
+        assert cache.get_stale("k") is None
+
+
+def test_get_user_gists_queue_timeout_serves_stale(github, monkeypatch):
+    github["handler"] = lambda request: httpx.Response(200, json=[sample_gist("abc")])
+    assert client.get("/octocat").json()["cache"]["hit"] is False
+
+    async def full(key):
+        raise UpstreamQueueTimeout("full")
+
+    monkeypatch.setattr(main.upstream_limiter, "acquire", full)
+    response = client.get("/octocat?use_cache=false")
+    assert response.status_code == 200
+    assert response.json()["cache"]["stale"] is True
+
+    response = client.get("/someoneelse")
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+
+
+def test_upstream_adapter_keeps_only_gist_fields():
+    body = httpx.Response(200, json=[sample_gist("abc")]).content
+    gists = main.UPSTREAM_GISTS_ADAPTER.validate_json(body)
+    assert gists[0].url == "https://gist.github.com/abc"
+    assert set(gists[0].model_dump()) == {"id", "description", "url", "created_at", "files"}
+
+
+# ==========================================
+# Sparse Fieldsets
+# ==========================================
+
+def test_parse_fields_spec():
+    assert main._parse_fields("url, id") == (("id", None), ("url", None))
+    assert main._parse_fields("files.size,files.language") == (("files", frozenset({"size", "language"})),)
+    assert main._parse_fields("files.size,files") == (("files", None),)
+    with pytest.raises(ValueError):
+        main._parse_fields("owner")
+    with pytest.raises(ValueError):
+        main._parse_fields("id.x")
+
+
+def test_get_user_gists_fields_projection(github):
+    github["handler"] = lambda request: httpx.Response(200, json=[sample_gist("abc")])
+    client.get("/octocat")
+
+    response = client.get("/octocat?fields=id,files.language")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["data"] == [{"id": "abc", "files": {"hello.py": {"language": "Python"}}}]
+    assert body["cache"]["hit"] is True
+    assert main.gists_cache.stats["size"] == 1
+
+    assert client.get("/octocat?fields=owner").status_code == 400
+
+
+# ==========================================
+# Full-History Endpoint
+# ==========================================
+
+def paged_handler(pages):
+    """GitHub-like handler serving ``pages`` (a list of gist lists) with Link headers."""
+    def handler(request):
+        page = int(request.url.params.get("page", 1))
+        base = str(request.url.copy_remove_param("page"))
+        links = [f'<{base}&page={len(pages)}>; rel="last"']
+        if page < len(pages):
+            links.insert(0, f'<{base}&page={page + 1}>; rel="next"')
+        return httpx.Response(200, json=pages[page - 1], headers={"Link": ", ".join(links)})
+    return handler
+
+
+def test_parse_link_header():
+    links = main._parse_link_header(
+        '<https://api.github.com/user/1/gists?per_page=100&page=2>; rel="next", '
+        '<https://api.github.com/user/1/gists?per_page=100&page=7>; rel="last"'
+    )
+    assert main._page_number(links["last"]) == 7
+    assert "prev" not in links
+
+
+def test_get_all_user_gists_assembles_pages_in_order(github):
+    # GitHub lists newest first; the assembled history keeps that order
+    pages = [[sample_gist(f"p{p}g{i}", f"2024-01-{20 - 2 * p - i:02d}T00:00:00Z") for i in range(2)]
+             for p in range(1, 4)]
+    github["handler"] = paged_handler(pages)
+
+    body = client.get("/octocat/all").json()
+    assert [g["id"] for g in body["data"]] == [g["id"] for page in pages for g in page]
+    assert body["pagination"]["pages"] == 3
+    assert body["pagination"]["truncated"] is False
+    assert "gists:octocat:all" in main.gists_cache._cache
+    assert client.get("/octocat/all").json()["cache"]["hit"] is True
+
+
+def test_get_all_user_gists_respects_max_gists(github, monkeypatch):
+    monkeypatch.setattr(main, "FULL_HISTORY_MAX_GISTS", 150)
+    pages = [[sample_gist(f"p{p}g{i}") for i in range(100)] for p in range(1, 4)]
+    github["handler"] = paged_handler(pages)
+
+    body = client.get("/octocat/all").json()
+    assert body["pagination"]["count"] == 150
+    assert body["pagination"]["pages"] == 2
+    assert body["pagination"]["truncated"] is True
+
+
+# ==========================================
+# Batch Endpoint
+# ==========================================
+
+def test_batch_mixes_cache_hits_misses_and_errors(github):
+    def handler(request):
+        if "/users/ghost/" in request.url.path:
+            return httpx.Response(404)
+        user = request.url.path.split("/")[2]
+        return httpx.Response(200, json=[sample_gist(f"{user}-1")])
+
+    github["handler"] = handler
+    client.get("/octocat")
+
+    response = client.post("/batch", json={"usernames": ["octocat", "torvalds", "ghost", "octocat"]})
+    assert response.status_code == 200
+    body = response.json()
+    assert list(body["results"]) == ["octocat", "torvalds", "ghost"]
+    assert body["results"]["octocat"]["cache"]["hit"] is True
+    assert body["results"]["torvalds"]["data"][0]["id"] == "torvalds-1"
+    assert body["results"]["ghost"]["error"]["status"] == 404
+    assert body["partial"] is False
+
+
+def test_batch_returns_partial_results_at_deadline(github, monkeypatch):
+    github["handler"] = lambda request: httpx.Response(200, json=[sample_gist("x")])
+    client.get("/fast")
+    real_fetch = main._fetch_gists_page
+
+    async def slow_fetch(username, page, per_page):
+        await asyncio.sleep(5)
+        return await real_fetch(username, page, per_page)
+
+    monkeypatch.setattr(main, "_fetch_gists_page", slow_fetch)
+    body = client.post("/batch", json={"usernames": ["fast", "slow"], "deadline_seconds": 0.05}).json()
+    assert body["partial"] is True
+    assert body["results"]["fast"]["data"][0]["id"] == "x"
+    assert body["results"]["slow"]["error"]["status"] == 504
+
+
+@pytest.mark.parametrize("username", ["a/../../gists/public", "..", "-leading", "a" * 40, "under_score", ""])
+def test_batch_rejects_names_that_are_not_github_logins(github, username):
+    github["handler"] = lambda request: pytest.fail("invalid names must not reach GitHub")
+    assert client.post("/batch", json={"usernames": ["octocat", username]}).status_code == 422
+
+
+def test_user_routes_reject_dot_segment_names(github):
+    github["handler"] = lambda request: pytest.fail("invalid names must not reach GitHub")
+    assert client.get("/%2E%2E").status_code == 422
+    assert client.get("/%2E%2E/stats").status_code == 422
+
+
+# ==========================================
+# NDJSON Streaming
+# ==========================================
+
+NDJSON = {"Accept": "application/x-ndjson"}
+
+
+def ndjson_lines(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_get_all_user_gists_ndjson_streams_and_caches(github):
+    pages = [[sample_gist(f"p{p}g{i}") for i in range(2)] for p in range(1, 4)]
+    github["handler"] = paged_handler(pages)
+
+    response = client.get("/octocat/all", headers=NDJSON)
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert [g["id"] for g in ndjson_lines(response)] == [g["id"] for page in pages for g in page]
+    assert main.gists_cache.get("gists:octocat:all")["pagination"]["count"] == 6
+
+
+def test_get_all_user_gists_ndjson_unknown_user_is_404(github):
+    github["handler"] = lambda request: httpx.Response(404)
+    response = client.get("/ghost/all", headers=NDJSON)
+    assert response.status_code == 404
+    assert response.json()["detail"] == "User 'ghost' not found"
+
+
+def test_get_all_user_gists_ndjson_error_line_after_first_page(github):
+    pages = paged_handler([[sample_gist("p1")], [sample_gist("p2")]])
+
+    def handler(request):
+        return httpx.Response(500) if request.url.params.get("page") == "2" else pages(request)
+
+    github["handler"] = handler
+    response = client.get("/octocat/all", headers=NDJSON)
+    assert response.status_code == 200
+    lines = ndjson_lines(response)
+    assert lines[0]["id"] == "p1"
+    assert "error" in lines[-1]
+    assert main.gists_cache.get("gists:octocat:all") is None
+
+
+def test_get_all_user_gists_ndjson_queue_timeout_serves_stale(github, monkeypatch):
+    github["handler"] = paged_handler([[sample_gist("abc")]])
+    client.get("/octocat/all")
+
+    async def full(key):
+        raise UpstreamQueueTimeout("full")
+
+    monkeypatch.setattr(main.upstream_limiter, "acquire", full)
+    response = client.get("/octocat/all?use_cache=false", headers=NDJSON)
+    assert [g["id"] for g in ndjson_lines(response)] == ["abc"]
+    assert client.get("/someoneelse/all", headers=NDJSON).status_code == 503
+
+
+def test_batch_ndjson_tags_lines_with_username(github):
+    def handler(request):
+        if "/users/ghost/" in request.url.path:
+            return httpx.Response(404)
+        return httpx.Response(200, json=[sample_gist("a"), sample_gist("b")])
+
+    github["handler"] = handler
+    lines = ndjson_lines(client.post("/batch", json={"usernames": ["octocat", "ghost"]}, headers=NDJSON))
+    assert [(line["username"], line.get("gist", {}).get("id")) for line in lines if "gist" in line] == [
+        ("octocat", "a"), ("octocat", "b"),
+    ]
+    assert [line["error"]["status"] for line in lines if "error" in line] == [404]
+
+
+def test_iter_all_gist_pages_cancels_pending_fetches_on_close(github, monkeypatch):
+    pages = [[sample_gist("p1")], [sample_gist("p2")], [sample_gist("p3")]]
+    github["handler"] = paged_handler(pages)
+    real_fetch = main._fetch_gists_page
+    cancelled = []
+
+    async def slow_fetch(username, page, per_page):
+        if page > 1:
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(page)
+                raise
+        return await real_fetch(username, page, per_page)
+
+    monkeypatch.setattr(main, "_fetch_gists_page", slow_fetch)
+
+    async def scenario():
+        pages_iter = main._iter_all_gist_pages("octocat")
+        first = await pages_iter.__anext__()
+        await asyncio.sleep(0)
+        await pages_iter.aclose()
+        await asyncio.sleep(0)
+        return first
+
+    assert asyncio.run(scenario())["gists"][0].id == "p1"
+    assert sorted(cancelled) == [2, 3]
+
+
+# ==========================================
+# GraphQL Backend
+# ==========================================
+
+def graphql_standin(calls):
+    """Minimal local stand-in for GitHub's GraphQL endpoint."""
+
+    def handler(request):
+        if request.url.path != "/graphql":
+            return httpx.Response(500)
+        variables = json.loads(request.content)["variables"]
+        calls.append(variables)
+        data = {}
+        for key, login in variables.items():
+            if not key.startswith("l"):
+                continue
+            alias = "u" + key[1:]
+            data[alias] = None if login == "ghost" else {"gists": {
+                "totalCount": 3,
+                "pageInfo": {"hasNextPage": variables["first"] < 3},
+                "nodes": [{
+                    "name": f"{login}1",
+                    "description": "",
+                    "url": f"https://gist.github.com/{login}1",
+                    "createdAt": "2024-01-01T00:00:00Z",
+                    "files": [{"name": "a.py", "size": 3, "language": {"name": "Python"}}],
+                }],
+            }}
+        return httpx.Response(200, json={"data": data})
+    return handler
+
+
+def test_graphql_query_aliases_users():
+    query = github_graphql.build_query(2)
+    assert "u0: user(login: $l0)" in query and "u1: user(login: $l1)" in query
+    assert "$first: Int!" in query
+
+
+def test_batch_uses_graphql_for_many_first_page_users(github, monkeypatch):
+    calls = []
+    github["handler"] = graphql_standin(calls)
+    monkeypatch.setattr(main, "GITHUB_TOKEN", "token")
+    monkeypatch.setattr(github_graphql, "GITHUB_GRAPHQL_URL", "https://graphql.local/graphql")
+    monkeypatch.setattr(github_graphql, "GRAPHQL_BATCH_SIZE", 2)
+
+    body = client.post("/batch", json={"usernames": ["a", "b", "ghost"], "per_page": 2}).json()
+    assert len(calls) == 2
+    assert body["results"]["a"]["data"][0] == {
+        "id": "a1", "description": "", "url": "https://gist.github.com/a1",
+        "created_at": "2024-01-01T00:00:00Z",
+        "files": {"a.py": {"filename": "a.py", "language": "Python", "size": 3}},
+    }
+    assert body["results"]["a"]["pagination"]["has_next"] is True
+    assert body["results"]["ghost"]["error"]["status"] == 404
+    assert main.gists_cache.get("gists:b:graphql:per_page2") is not None
+    assert main.gists_cache.get("gists:b:page1:per_page2") is None
+
+    # Served from the GraphQL entry on the next batch
+    client.post("/batch", json={"usernames": ["a", "b"], "per_page": 2})
+    assert len(calls) == 2
+
+
+def test_graphql_batch_does_not_shadow_rest_records(github, monkeypatch, tmp_path):
+    calls = []
+    graphql = graphql_standin(calls)
+    monkeypatch.setattr(main, "content_store", ContentStore(str(tmp_path), 1024, 1024))
+
+    def handler(request):
+        if request.url.path == "/graphql":
+            return graphql(request)
+        if request.url.path == "/users/a/gists":
+            return httpx.Response(200, json=[sample_gist("a1", files={"a.py": {
+                "filename": "a.py", "type": "text/x-python", "language": "Python", "size": 3,
+                "raw_url": "https://gist.githubusercontent.com/a/a1/raw/1/a.py",
+            }})])
+        if request.url.path == "/gists/a1":
+            return httpx.Response(200, json=sample_gist("a1", files={"a.py": {
+                "filename": "a.py", "size": 3, "raw_url": "https://gist.githubusercontent.com/a/a1/raw/1/a.py",
+            }}))
+        return httpx.Response(200, content=b"hi\n")
+
+    github["handler"] = handler
+    monkeypatch.setattr(main, "GITHUB_TOKEN", "token")
+    monkeypatch.setattr(github_graphql, "GITHUB_GRAPHQL_URL", "https://graphql.local/graphql")
+    client.post("/batch", json={"usernames": ["a", "b", "c"], "per_page": 30})
+    assert len(calls) == 1
+
+    response = client.get("/gists/a1/files/a.py")
+    assert response.status_code == 200 and response.text == "hi\n"
+    files = client.get("/a").json()["data"][0]["files"]
+    assert files["a.py"]["raw_url"].endswith("/a.py") and files["a.py"]["type"] == "text/x-python"
+
+
+def test_graphql_batch_falls_back_to_rest_on_unparseable_response(github, monkeypatch):
+    running, peak = [0], [0]
+
+    async def handler(request):
+        if request.url.path == "/graphql":
+            return httpx.Response(200, content=b"<html>bad gateway</html>")
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(0.01)
+        running[0] -= 1
+        return httpx.Response(200, json=[sample_gist(request.url.path.split("/")[2] + "1")])
+
+    github["handler"] = handler
+    monkeypatch.setattr(main, "GITHUB_TOKEN", "token")
+    monkeypatch.setattr(main, "BATCH_CONCURRENCY", 2)
+    monkeypatch.setattr(github_graphql, "GITHUB_GRAPHQL_URL", "https://graphql.local/graphql")
+
+    response = client.post("/batch", json={"usernames": ["a", "b", "c", "d", "e"]})
+    assert response.status_code == 200
+    assert {u: r["data"][0]["id"] for u, r in response.json()["results"].items()} == {
+        "a": "a1", "b": "b1", "c": "c1", "d": "d1", "e": "e1",
+    }
+    assert peak[0] <= 2
+
+
+def test_use_graphql_selection(monkeypatch):
+    monkeypatch.setattr(main, "GITHUB_TOKEN", "token")
+    assert main._use_graphql(page=1, user_count=5) is True
+    assert main._use_graphql(page=2, user_count=5) is False
+    assert main._use_graphql(page=1, user_count=1) is False
+    monkeypatch.setattr(main, "UPSTREAM_BACKEND", "rest")
+    assert main._use_graphql(page=1, user_count=5) is False
+    monkeypatch.setattr(main, "GITHUB_TOKEN", None)
+    monkeypatch.setattr(main, "UPSTREAM_BACKEND", "graphql")
+    assert main._use_graphql(page=1, user_count=5) is False
+
+
+# ==========================================
+# Gist File Content Proxy
+# ==========================================
+
+async def chunks_of(*parts):
+    for part in parts:
+        yield part
+
+
+def test_content_store_dedupes_and_evicts_lru(tmp_path):
+    store = ContentStore(str(tmp_path), max_bytes=10, max_file_bytes=10)
+
+    async def scenario():
+        a = await store.store("url-a", chunks_of(b"aaaa"))
+        a2 = await store.store("url-a-fork", chunks_of(b"aa", b"aa"))
+        await store.store("url-b", chunks_of(b"bbbb"))
+        store.lookup("url-a")  # a is now most recently used
+        await store.store("url-c", chunks_of(b"cccc"))
+        return a, a2
+
+    a, a2 = asyncio.run(scenario())
+    assert a == a2
+    assert store.lookup("url-b") is None
+    assert store.lookup("url-a-fork") == a and a.read_bytes() == b"aaaa"
+    assert store.stats["bytes"] == 8
+
+
+def test_get_gist_file_proxies_content_with_range(github, monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "content_store", ContentStore(str(tmp_path), 1024, 1024))
+    raw_calls = []
+
+    def handler(request):
+        if request.url.path.startswith("/gists/"):
+            gist = sample_gist("abc", files={"hello.py": {
+                "filename": "hello.py", "size": 12, "content": "print('hi')\n",
+                "raw_url": "https://gist.githubusercontent.com/u/abc/raw/1/hello.py",
+            }})
+            return httpx.Response(200, json=gist)
+        raw_calls.append(request.url)
+        return httpx.Response(200, content=b"print('hi')\n")
+
+    github["handler"] = handler
+
+    response = client.get("/gists/abc/files/hello.py")
+    assert response.status_code == 200
+    assert response.text == "print('hi')\n"
+    assert response.headers["x-content-type-options"] == "nosniff"
+    assert "content" not in main.gists_cache.get("gist:abc")["gists"][0].files["hello.py"]
+
+    response = client.get("/gists/abc/files/hello.py", headers={"Range": "bytes=0-4"})
+    assert response.status_code == 206
+    assert response.content == b"print"
+    assert len(raw_calls) == 1
+
+    assert client.get("/gists/abc/files/missing.py").status_code == 404
+
+
+# ==========================================
+# Gist Id Index and Detail Endpoint
+# ==========================================
+
+def test_cache_notifies_listeners_on_set_overwrite_and_expiry():
+    events = []
+
+    class Recorder:
+        def on_set(self, key, value):
+            events.append(("set", key, value))
+
+        def on_evict(self, key, value):
+            events.append(("evict", key, value))
+
+    cache = SimpleCache(default_ttl=10)
+    cache.subscribe(Recorder())
+    with patch("time.time") as mock_time:
+        mock_time.return_value = 1000.0
+        cache.set("k", 1)
+        cache.set("k", 2)
+        mock_time.return_value = 1011.0
+        cache.cleanup_expired()
+    assert events == [("set", "k", 1), ("evict", "k", 1), ("set", "k", 2), ("evict", "k", 2)]
+
+
+def test_gist_id_index_tracks_references():
+    index = GistIdIndex()
+    gist = main.GistInfo(id="g1", description=None, url="u", created_at="c", files={})
+    index.on_set("page1", {"gists": [gist]})
+    index.on_set("all", {"gists": [gist]})
+    index.on_evict("page1", {"gists": [gist]})
+    assert index.get("g1", lambda key: True) is gist
+    assert index.get("g1", lambda key: False) is None
+    index.on_evict("all", {"gists": [gist]})
+    assert index.get("g1", lambda key: True) is None
+    assert index.stats == {"size": 0, "hits": 1, "misses": 2, "hit_rate": 1 / 3}
+
+
+def test_get_gist_served_from_cached_list(github):
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        if request.url.path == "/gists/zzz":
+            return httpx.Response(200, json=sample_gist("zzz"))
+        return httpx.Response(200, json=[sample_gist("abc")])
+
+    github["handler"] = handler
+    client.get("/octocat")
+
+    assert client.get("/gists/abc").json()["url"] == "https://gist.github.com/abc"
+    assert calls == ["/users/octocat/gists"]
+
+    assert client.get("/gists/zzz").json()["id"] == "zzz"
+    assert calls[-1] == "/gists/zzz"
+
+    client.delete("/cache")
+    main.gists_cache.set("gists:octocat:page1:per_page30", {"gists": []})
+    assert main.gist_index.get("abc", main.gists_cache.is_fresh) is None
+
+
+# ==========================================
+# Next-Page Prefetch
+# ==========================================
+
+def prefetch_outcome(outcome):
+    return REGISTRY.get_sample_value("prefetch_outcomes_total", {"outcome": outcome}) or 0
+
+
+def test_prefetch_next_page_is_used_on_next_request(github, monkeypatch):
+    pages = [[sample_gist("p1")], [sample_gist("p2")], [sample_gist("p3")]]
+    github["handler"] = paged_handler(pages)
+    monkeypatch.setattr(main, "github_rate_remaining", 4000)
+    used_before = prefetch_outcome("used")
+
+    async def scenario():
+        main._maybe_prefetch("octocat", 2, 1)
+        await asyncio.gather(*main._prefetch_tasks)
+        data, cache_info = await main._load_gists_page("octocat", 2, 1)
+        return data, cache_info
+
+    data, cache_info = asyncio.run(scenario())
+    assert cache_info["hit"] is True
+    assert data["gists"][0].id == "p2"
+    assert prefetch_outcome("used") == used_before + 1
+
+
+def test_request_during_prefetch_waits_for_it(github, monkeypatch):
+    pages = [[sample_gist("p1")], [sample_gist("p2")], [sample_gist("p3")]]
+    served = paged_handler(pages)
+    calls = []
+
+    def handler(request):
+        calls.append(int(request.url.params.get("page", 1)))
+        return served(request)
+
+    github["handler"] = handler
+    monkeypatch.setattr(main, "github_rate_remaining", 4000)
+    used_before, wasted_before = prefetch_outcome("used"), prefetch_outcome("wasted")
+
+    async def scenario():
+        main._maybe_prefetch("octocat", 2, 1)
+        return await main._load_gists_page("octocat", 2, 1)
+
+    data, cache_info = asyncio.run(scenario())
+    assert calls == [2]
+    assert cache_info["hit"] is True and data["gists"][0].id == "p2"
+    assert prefetch_outcome("used") == used_before + 1
+    assert prefetch_outcome("wasted") == wasted_before
+
+
+def test_batch_cache_hits_count_prefetched_pages_as_used(github, monkeypatch):
+    github["handler"] = paged_handler([[sample_gist("p1")], [sample_gist("p2")], [sample_gist("p3")]])
+    monkeypatch.setattr(main, "github_rate_remaining", 4000)
+    used_before, wasted_before = prefetch_outcome("used"), prefetch_outcome("wasted")
+
+    async def scenario():
+        main._maybe_prefetch("octocat", 2, 1)
+        main._maybe_prefetch("hubot", 2, 1)
+        await asyncio.gather(*main._prefetch_tasks)
+
+    asyncio.run(scenario())
+    github["handler"] = lambda request: pytest.fail("prefetched pages must be served from the cache")
+    batch = {"usernames": ["octocat"], "page": 2, "per_page": 1}
+    assert client.post("/batch", json=batch).json()["results"]["octocat"]["cache"]["hit"] is True
+    lines = ndjson_lines(client.post("/batch", json={**batch, "usernames": ["hubot"]}, headers=NDJSON))
+    assert [line["gist"]["id"] for line in lines] == ["p2"]
+
+    main.gists_cache.clear()
+    assert prefetch_outcome("used") == used_before + 2
+    assert prefetch_outcome("wasted") == wasted_before
+
+
+def test_prefetch_respects_rate_budget_and_counts_waste(github, monkeypatch):
+    github["handler"] = paged_handler([[sample_gist("p1")], [sample_gist("p2")]])
+    monkeypatch.setattr(main, "github_rate_remaining", 5)
+    main._maybe_prefetch("octocat", 2, 1)
+    assert not main._prefetch_tasks
+
+    monkeypatch.setattr(main, "github_rate_remaining", 4000)
+    wasted_before = prefetch_outcome("wasted")
+
+    async def scenario():
+        main._maybe_prefetch("octocat", 2, 1)
+        await asyncio.gather(*main._prefetch_tasks)
+
+    asyncio.run(scenario())
+    main.gists_cache.clear()
+    assert prefetch_outcome("wasted") == wasted_before + 1
+
+
+# ==========================================
+# Cached Gist Query
+# ==========================================
+
+def cache_user_page(username, gists):
+    records = [main.GistInfo(**{**g, "url": g["html_url"]}) for g in gists]
+    main.gists_cache.set(f"gists:{username}:page1:per_page30", {"gists": records, "pagination": {}})
+
+
+def test_query_filters_by_language_extension_and_date(github):
+    cache_user_page("alice", [
+        sample_gist("a1", "2024-03-01T00:00:00Z"),
+        sample_gist("a2", "2024-01-15T00:00:00Z", files={"notes.md": {"filename": "notes.md", "language": "Markdown"}}),
+    ])
+    cache_user_page("bob", [sample_gist("b1", "2023-12-31T23:59:59Z")])
+    github["handler"] = lambda request: pytest.fail("query must not call GitHub")
+
+    body = client.get("/gists/query", params={"language": "PYTHON"}).json()
+    assert [g["id"] for g in body["data"]] == ["a1", "b1"]
+    assert body["pagination"]["total"] == 2
+
+    assert [g["id"] for g in client.get("/gists/query?extension=md").json()["data"]] == ["a2"]
+
+    params = {"extension": "py", "created_after": "2024-01-01", "created_before": "2024-04-01"}
+    assert [g["id"] for g in client.get("/gists/query", params=params).json()["data"]] == ["a1"]
+
+    body = client.get("/gists/query", params={"per_page": 1, "page": 2}).json()
+    assert [g["id"] for g in body["data"]] == ["a2"]
+    assert body["pagination"]["has_next"] is True
+
+    assert client.get("/gists/query?created_after=yesterday").status_code == 422
+
+
+def test_query_index_follows_cache_evictions(github):
+    cache_user_page("alice", [sample_gist("a1")])
+    main.gists_cache.set("gists:alice:all", {"gists": [main.GistInfo(
+        id="a1", description=None, url="u", created_at="2024-01-01T00:00:00Z", files={}
+    )]})
+    assert client.get("/gists/query?language=python").json()["data"] == []
+
+    main.gists_cache._evict("gists:alice:all")
+    assert [g["id"] for g in client.get("/gists/query?language=python").json()["data"]] == ["a1"]
+
+    main.gists_cache.clear()
+    assert main.filter_index.stats == {"gists": 0, "languages": 0, "extensions": 0}
+
+
+def test_filter_index_pages_match_a_full_scan():
+    index = GistFilterIndex()
+    records = [
+        main.GistInfo(
+            id=f"g{i}", description=None, url="u", created_at=f"2024-01-{i % 28 + 1:02d}T00:00:00Z",
+            files={"a.py" if i % 2 else "a.md": {"language": "Python" if i % 3 else "Markdown"}},
+        )
+        for i in range(40)
+    ]
+    for record in records:
+        index.add(record)
+    index.remove(records[3])
+    records.pop(3)
+
+    for created_after, created_before in ((None, None), ("2024-01-05", "2024-01-20")):
+        for language, extension in ((None, None), ("python", None), ("python", "md"), ("ruby", None)):
+            expected = sorted(
+                (
+                    (r.created_at, r.id) for r in records
+                    if r.created_at >= (created_after or "")
+                    and (created_before is None or r.created_at < created_before)
+                    and (language is None or any(f["language"].lower() == language for f in r.files.values()))
+                    and (extension is None or any(name.endswith("." + extension) for name in r.files))
+                ),
+                reverse=True,
+            )
+            for offset in (0, 7, max(0, len(expected) - 3), len(expected) + 10):
+                total, page = index.query(
+                    language=language, extension=extension, created_after=created_after,
+                    created_before=created_before, offset=offset, limit=5,
+                )
+                assert total == len(expected)
+                assert [r.id for r in page] == [gist_id for _, gist_id in expected[offset:offset + 5]]
+
+
+def test_query_and_search_leave_out_expired_entries(github):
+    cache_user_page("alice", [sample_gist("a1")])
+    github["handler"] = lambda request: pytest.fail("query must not call GitHub")
+    main.gists_cache._cache["gists:alice:page1:per_page30"].expires_at = time.time() - 1
+    assert [g["id"] for g in client.get("/gists/query").json()["data"]] == ["a1"]
+
+    assert main.gist_index.expire(main.gists_cache.is_fresh) == 1
+    assert main.gist_index.expire(main.gists_cache.is_fresh) == 0
+    assert client.get("/gists/query").json()["pagination"]["total"] == 0
+    assert client.get("/gists/query?language=python").json()["data"] == []
+    assert client.get("/gists/search?q=hello").json()["data"] == []
+
+    cache_user_page("bob", [sample_gist("a1")])
+    assert [g["id"] for g in client.get("/gists/query").json()["data"]] == ["a1"]
+
+
+# ==========================================
+# Full-Text Search
+# ==========================================
+
+def test_search_ranks_cached_gists_with_bm25(github):
+    cache_user_page("alice", [
+        {**sample_gist("k1"), "description": "kubernetes kubernetes operator notes"},
+        {**sample_gist("k2"), "description": "deploying to kubernetes with helm"},
+        {**sample_gist("x1"), "description": "unrelated", "files": {"k8s-kubernetes.yaml": {"language": "YAML"}}},
+        {**sample_gist("z1"), "description": "python snippets"},
+    ])
+    github["handler"] = lambda request: pytest.fail("search must not call GitHub")
+
+    body = client.get("/gists/search", params={"q": "Kubernetes"}).json()
+    assert [g["id"] for g in body["data"]][0] == "k1"
+    assert {g["id"] for g in body["data"]} == {"k1", "k2", "x1"}
+    assert body["pagination"]["scores"] == sorted(body["pagination"]["scores"], reverse=True)
+
+    assert [g["id"] for g in client.get("/gists/search?q=helm").json()["data"]] == ["k2"]
+    assert client.get("/gists/search?q=missing").json()["pagination"]["total"] == 0
+
+    main.gists_cache.clear()
+    assert client.get("/gists/search?q=kubernetes").json()["data"] == []
+
+
+def test_search_index_is_bounded():
+    index = main.search_index.__class__(max_docs=2)
+    for i, created in enumerate(["2024-01-01", "2024-01-02", "2024-01-03"]):
+        index.add(main.GistInfo(id=f"g{i}", description="shared term", url="u", created_at=created, files={}))
+    assert index.stats["documents"] == 2
+    total, hits = index.search("shared")
+    assert total == 2
+    assert [gist.id for _, gist in hits] == ["g2", "g1"]
+    index.remove(main.GistInfo(id="g0", description="", url="u", created_at="", files={}))
+    assert index.stats["postings"] == 4
+
+
+# ==========================================
+# Per-User Statistics
+# ==========================================
+
+def test_user_stats_aggregates_full_history(github):
+    gists = [
+        sample_gist("s1", "2024-01-05T00:00:00Z", files={
+            "a.py": {"language": "Python", "size": 100},
+            "b.md": {"language": "Markdown", "size": 50},
+        }),
+        sample_gist("s2", "2024-01-20T00:00:00Z", files={"c.py": {"language": "Python", "size": 10}}),
+        sample_gist("s3", "2024-03-01T00:00:00Z", files={"d.txt": {"language": None, "size": 1}}),
+    ]
+    github["handler"] = paged_handler([gists])
+
+    body = client.get("/octocat/stats").json()
+    assert body["gist_count"] == 3
+    assert body["total_files"] == 4
+    assert body["total_file_size"] == 161
+    assert body["languages"] == {"Python": 2, "Markdown": 1}
+    assert body["files_per_gist"] == {"1": 2, "2": 1}
+    assert body["activity"] == {"2024-01": 2, "2024-03": 1}
+    assert body["cache"]["hit"] is False
+    assert client.get("/octocat/stats").json()["cache"]["hit"] is True
+
+
+def test_user_stats_refresh_applies_only_changes(github):
+    github["handler"] = paged_handler([[sample_gist("s1"), sample_gist("s2")]])
+    client.get("/octocat/stats")
+    incremental_before = REGISTRY.get_sample_value("user_stats_updates_total", {"mode": "incremental"}) or 0
+
+    github["handler"] = paged_handler([[
+        sample_gist("s2"),
+        sample_gist("s4", "2024-02-01T00:00:00Z", files={"x.go": {"language": "Go", "size": 7}}),
+    ]])
+    body = client.get("/octocat/stats?use_cache=false").json()
+    assert body["gist_count"] == 2
+    assert body["languages"] == {"Python": 1, "Go": 1}
+    assert body["activity"] == {"2024-01": 1, "2024-02": 1}
+    assert REGISTRY.get_sample_value("user_stats_updates_total", {"mode": "incremental"}) == incremental_before + 1
+
+
+# ==========================================
+# Merged Timeline
+# ==========================================
+
+def timeline_handler(histories):
+    def handler(request):
+        username = request.url.path.split("/")[2]
+        if username not in histories:
+            return httpx.Response(404, json={"message": "Not Found"})
+        return httpx.Response(200, json=histories[username])
+    return handler
+
+
+def test_timeline_merges_users_and_continues_from_cursor(github):
+    github["handler"] = timeline_handler({
+        "alice": [sample_gist("a3", "2024-03-03T00:00:00Z"), sample_gist("a1", "2024-01-01T00:00:00Z")],
+        "bob": [sample_gist("b1", "2024-01-15T00:00:00Z"), sample_gist("b2", "2024-02-20T00:00:00Z")],
+    })
+
+    first = client.get("/gists/timeline", params={"usernames": "alice,bob,ghost", "limit": 3}).json()
+    assert [(g["username"], g["id"]) for g in first["data"]] == [("alice", "a3"), ("bob", "b2"), ("bob", "b1")]
+    assert first["errors"]["ghost"]["status"] == 404
+
+    rest = client.get("/gists/timeline", params={"usernames": "alice,bob", "cursor": first["next_cursor"]}).json()
+    assert [g["id"] for g in rest["data"]] == ["a1"]
+    assert rest["next_cursor"] is None
+
+
+def test_timeline_rejects_bad_input(github):
+    assert client.get("/gists/timeline", params={"usernames": "alice", "cursor": "not-a-cursor"}).status_code == 400
+    assert client.get("/gists/timeline", params={"usernames": ","}).status_code == 422
+    assert client.get("/gists/timeline", params={"usernames": "alice,a/../../gists/public"}).status_code == 422
+
+
+def test_position_after_uses_created_at_then_id():
+    gists = [main.GistInfo(id=i, description=None, url="u", created_at=c, files={})
+             for i, c in [("b", "2024-02"), ("a", "2024-02"), ("z", "2024-01")]]
+    assert main._position_after(gists, ("2024-02", "b")) == 1
+    assert main._position_after(gists, ("2024-02", "a")) == 2
+    assert main._position_after(gists, ("2025", "")) == 0
+    assert main._position_after(gists, ("2023", "")) == 3
+
+
+# ==========================================
+# Organization Fan-Out
+# ==========================================
+
+def org_handler(members, histories, calls):
+    def handler(request):
+        calls.append(request.url.path)
+        if request.url.path == "/orgs/acme/members":
+            page = int(request.url.params.get("page", 1))
+            base = str(request.url.copy_remove_param("page"))
+            links = f'<{base}&page={len(members)}>; rel="last"'
+            return httpx.Response(200, json=[{"login": m} for m in members[page - 1]], headers={"Link": links})
+        if request.url.path.startswith("/orgs/"):
+            return httpx.Response(404, json={"message": "Not Found"})
+        return httpx.Response(200, json=histories[request.url.path.split("/")[2]])
+    return handler
+
+
+def org_lines(resp):
+    lines = ndjson_lines(resp)
+    return [line for line in lines if "gist" in line], lines[-1]["summary"]
+
+
+def test_org_gists_streams_members_and_summary(github):
+    calls = []
+    github["handler"] = org_handler(
+        [["ann", "ben"], ["cat"]],
+        {"ann": [sample_gist("a1")], "ben": [sample_gist("b1"), sample_gist("b2")], "cat": []},
+        calls,
+    )
+    main.gists_cache.set("gists:ben:all", {"gists": [main.GistInfo(**{**sample_gist("b1"), "url": "u"})]})
+
+    gists, summary = org_lines(client.get("/orgs/acme/gists"))
+    assert sorted((g["username"], g["gist"]["id"]) for g in gists) == [("ann", "a1"), ("ben", "b1")]
+    assert summary["members"] == 3
+    assert summary["completed"] == 3
+    assert summary["upstream_calls"] == 4
+    assert "/users/ben/gists" not in calls
+
+
+def test_org_gists_stops_at_call_budget(github):
+    calls = []
+    github["handler"] = org_handler(
+        [["ann", "ben", "cat"]], {u: [sample_gist(f"{u}1")] for u in ("ann", "ben", "cat")}, calls
+    )
+
+    gists, summary = org_lines(client.get("/orgs/acme/gists?budget=2"))
+    assert len(gists) == 1
+    assert summary["completed"] == 1
+    assert len(summary["skipped"]) == 2
+    assert summary["upstream_calls"] == len(calls) == 2
+
+    assert client.get("/orgs/nobody/gists?budget=5").status_code == 404
+
+
+def test_org_route_rejects_names_that_change_the_upstream_path(github):
+    github["handler"] = lambda request: pytest.fail("invalid names must not reach GitHub")
+    assert client.get("/orgs/%2E%2E/gists?budget=1").status_code == 422
+    assert client.get("/orgs/a%3Fx=1/gists?budget=1").status_code == 422
+
+
+# ==========================================
+# Cursor Pagination
+# ==========================================
+
+def test_cursor_pages_stay_stable_when_new_gists_appear(github):
+    history = [sample_gist(f"g{i}", f"2024-01-{20 - i:02d}T00:00:00Z") for i in range(5)]
+    github["handler"] = paged_handler([history])
+
+    first = client.get("/octocat", params={"cursor": "", "per_page": 2}).json()
+    assert [g["id"] for g in first["data"]] == ["g0", "g1"]
+    assert first["pagination"]["has_next"] is True
+
+    github["handler"] = paged_handler([[sample_gist("new", "2024-02-01T00:00:00Z")] + history])
+    params = {"cursor": first["pagination"]["next_cursor"], "per_page": 2, "use_cache": "false"}
+    second = client.get("/octocat", params=params).json()
+    assert [g["id"] for g in second["data"]] == ["g2", "g3"]
+
+    params = {"cursor": second["pagination"]["next_cursor"], "per_page": 2}
+    last = client.get("/octocat", params=params).json()
+    assert [g["id"] for g in last["data"]] == ["g4"]
+    assert last["pagination"]["next_cursor"] is None
+
+
+def test_cursor_pagination_continues_past_the_history_cap(github, monkeypatch):
+    monkeypatch.setattr(main, "FULL_HISTORY_MAX_GISTS", 2)
+    monkeypatch.setattr(main, "FULL_HISTORY_PER_PAGE", 2)
+    pages = [[sample_gist(f"g{2 * p + i}", f"2024-01-{20 - 2 * p - i:02d}T00:00:00Z") for i in range(2)]
+             for p in range(3)]
+    github["handler"] = paged_handler(pages)
+
+    seen, cursor = [], ""
+    while cursor is not None:
+        body = client.get("/octocat", params={"cursor": cursor, "per_page": 3}).json()
+        seen += [g["id"] for g in body["data"]]
+        cursor = body["pagination"]["next_cursor"]
+        assert body["pagination"]["truncated"] is False
+    assert seen == [f"g{i}" for i in range(6)]
+
+
+def test_cursor_pagination_rejects_bad_cursor(github):
+    def handler(request):
+        pytest.fail("a malformed cursor must not reach GitHub")
+    github["handler"] = handler
+    assert client.get("/octocat", params={"cursor": "%%%"}).status_code == 400
+    assert client.get("/octocat", params={"cursor": "!!!garbage"}).status_code == 400
+
+
+# ==========================================
+# Request Metrics
+# ==========================================
+
+def request_count(endpoint, status):
+    labels = {"method": "GET", "endpoint": endpoint, "status": status}
+    return REGISTRY.get_sample_value("http_requests_total", labels) or 0
+
+
+def test_request_metrics_are_labelled_by_route_template(github):
+    github["handler"] = paged_handler([[sample_gist("g1")]])
+    before = request_count("/{username}", "200")
+    client.get("/octocat")
+    client.get("/hubot")
+    assert request_count("/{username}", "200") == before + 2
+    assert request_count("/octocat", "200") == 0
+
+    unmatched = request_count("unmatched", "404")
+    client.get("/a/b/c")
+    assert request_count("unmatched", "404") == unmatched + 1
+
+
+# ==========================================
+# Metrics Exposition
+# ==========================================
+
+def test_metrics_exposition_is_cached_and_gzipped(monkeypatch):
+    exposition = main.MetricsExposition(REGISTRY, min_interval=60)
+    monkeypatch.setattr(main, "metrics_exposition", exposition)
+
+    first = client.get("/metrics", headers={"Accept-Encoding": "identity"})
+    client.get("/health")
+    second = client.get("/metrics", headers={"Accept-Encoding": "identity"})
+    assert first.content == second.content
+    assert "content-encoding" not in first.headers
+
+    zipped = client.get("/metrics", headers={"Accept-Encoding": "gzip"})
+    assert zipped.headers["content-encoding"] == "gzip"
+    assert zipped.content == first.content  # decoded by the client
+
+
+def test_metrics_exposition_regenerates_after_interval():
+    exposition = main.MetricsExposition(REGISTRY, min_interval=0)
+    before = exposition.render(want_gzip=False)
+    main.CACHE_MISSES.inc()
+    assert exposition.render(want_gzip=False) != before
+
+
+# ==========================================
+# Stage Timing
+# ==========================================
+
+def server_timing_stages(resp):
+    return {part.split(";")[0] for part in resp.headers["server-timing"].split(", ")}
+
+
+def test_server_timing_breaks_down_user_gists(github):
+    github["handler"] = lambda request: httpx.Response(200, json=[sample_gist("g1")])
+
+    miss = client.get("/octocat")
+    assert server_timing_stages(miss) == {
+        "cache", "upstream_queue", "upstream_wait", "upstream_transfer", "parse", "serialize", "total",
+    }
+    hit = client.get("/octocat")
+    assert server_timing_stages(hit) == {"cache", "serialize", "total"}
+    assert "timing-allow-origin" not in hit.headers
+
+    cors = client.get("/octocat", headers={"Origin": "https://example.com"})
+    assert cors.headers["timing-allow-origin"] == "https://example.com"
+    exposed = {h.strip().lower() for h in cors.headers["access-control-expose-headers"].split(",")}
+    assert {"server-timing", "x-ratelimit-remaining", "retry-after"} <= exposed
+
+    labels = {"endpoint": "/{username}", "stage": "parse"}
+    assert REGISTRY.get_sample_value("http_request_stage_seconds_count", labels) >= 1
+
+
+def test_stage_timer_is_a_no_op_outside_requests():
+    main.timing.detach()
+    with main.timing.stage(main.timing.CACHE):
+        pass
+    stages = main.timing.begin_request()
+    with main.timing.stage(main.timing.CACHE):
+        pass
+    main.timing.detach()
+    assert list(stages) == ["cache"]
+
+
+# ==========================================
+# Event Loop Monitor
+# ==========================================
+
+def block_the_loop(seconds):
+    time.sleep(seconds)
+
+
+def test_loop_monitor_measures_lag_and_reports_blocking_stack():
+    monitor = LoopMonitor(interval=0.02, block_threshold=0.05, debug=True)
+
+    async def scenario():
+        monitor.start()
+        await asyncio.sleep(0.05)
+        block_the_loop(0.3)
+        await asyncio.sleep(0.05)
+        await monitor.stop()
+
+    asyncio.run(scenario())
+    assert "block_the_loop" in monitor.last_block
+    assert REGISTRY.get_sample_value("event_loop_blocked_total") >= 1
+    assert REGISTRY.get_sample_value("event_loop_lag_seconds_count") >= 2
+
+
+def test_loop_monitor_without_debug_has_no_watchdog():
+    monitor = LoopMonitor(interval=0.01, block_threshold=0.05)
+
+    async def scenario():
+        monitor.start()
+        await asyncio.sleep(0.05)
+        await monitor.stop()
+
+    asyncio.run(scenario())
+    assert monitor.last_block is None
+
+
+# ==========================================
+# Admission Control
+# ==========================================
+
+def shed_count(reason, kind):
+    return REGISTRY.get_sample_value("admission_shed_total", {"reason": reason, "kind": kind}) or 0
+
+
+def test_admission_sheds_misses_first_past_capacity(github, monkeypatch):
+    github["handler"] = lambda request: httpx.Response(200, json=[sample_gist("g1")])
+    client.get("/cached")
+    monkeypatch.setattr(main.admission_controller, "in_flight", math.ceil(main.admission_controller.limit))
+    before = shed_count("concurrency", "miss")
+
+    shed = client.get("/uncached")
+    assert shed.status_code == 503
+    assert shed.headers["retry-after"] == "1"
+    assert shed_count("concurrency", "miss") == before + 1
+
+    assert client.get("/cached").status_code == 200
+    assert client.get("/health").status_code == 200
+
+
+def test_shed_responses_are_counted_and_carry_cors_headers(github, monkeypatch):
+    monkeypatch.setattr(main.admission_controller, "in_flight", math.ceil(main.admission_controller.limit))
+    before = request_count("/{username}", "503")
+
+    shed = client.get("/uncached", headers={"Origin": "https://example.com"})
+    assert shed.status_code == 503
+    assert shed.headers["access-control-allow-origin"] == "https://example.com"
+    assert request_count("/{username}", "503") == before + 1
+
+
+def test_admission_sheds_on_loop_lag_and_upstream_queue(github, monkeypatch):
+    github["handler"] = lambda request: httpx.Response(200, json=[])
+    monkeypatch.setattr(loop_monitor, "lag", 10.0)
+    assert client.get("/octocat").status_code == 503
+
+    monkeypatch.setattr(loop_monitor, "lag", 0.0)
+    monkeypatch.setattr(main.upstream_limiter, "_waiting", 10_000)
+    assert client.get("/octocat").status_code == 503
+    assert client.get("/gists/search?q=x").status_code == 200
+
+
+def test_gradient_limit_shrinks_when_latency_rises():
+    limit = GradientLimit(initial=100, min_limit=10, max_limit=1000)
+    for _ in range(200):
+        limit.on_sample(0.01, in_flight=90)
+    grown = limit.limit
+    assert grown > 100
+
+    for _ in range(50):
+        limit.on_sample(0.5, in_flight=90)
+    assert limit.limit < grown / 2
+
+    idle = GradientLimit(initial=100, min_limit=10, max_limit=1000)
+    idle.on_sample(0.01, in_flight=1)
+    assert idle.limit == 100
+
+
+# ==========================================
+# Per-Client Rate Limiting
+# ==========================================
+
+@pytest.fixture(autouse=True)
+def reset_rate_limits():
+    """Every test starts with full buckets (they all share the test client's IP)."""
+    normal_buckets.clear()
+    bypass_buckets.clear()
+
+
+def test_rate_limit_headers_and_429(github, monkeypatch):
+    github["handler"] = lambda request: httpx.Response(200, json=[])
+    monkeypatch.setattr(normal_buckets, "capacity", 2)
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_API_KEYS", frozenset({"alpha", "beta"}))
+
+    first = client.get("/octocat", headers={"X-API-Key": "alpha"})
+    assert first.headers["x-ratelimit-limit"] == "2"
+    assert first.headers["x-ratelimit-remaining"] == "1"
+    assert client.get("/octocat", headers={"X-API-Key": "alpha"}).status_code == 200
+
+    limited = client.get("/octocat", headers={"X-API-Key": "alpha"})
+    assert limited.status_code == 429
+    assert int(limited.headers["retry-after"]) >= 1
+    assert client.get("/octocat", headers={"X-API-Key": "beta"}).status_code == 200
+    assert client.get("/health").status_code == 200
+
+
+def test_rate_limited_responses_are_counted_and_carry_cors_headers(github, monkeypatch):
+    github["handler"] = lambda request: httpx.Response(200, json=[])
+    monkeypatch.setattr(normal_buckets, "capacity", 1)
+    origin = {"Origin": "https://example.com"}
+    before = request_count("/{username}", "429")
+
+    for _ in range(3):
+        assert client.options("/octocat", headers={**origin, "Access-Control-Request-Method": "GET"}).status_code == 200
+        client.options("/octocat")
+    assert client.get("/octocat", headers=origin).status_code == 200
+
+    limited = client.get("/octocat", headers=origin)
+    assert limited.status_code == 429
+    assert limited.headers["access-control-allow-origin"] == "https://example.com"
+    assert request_count("/{username}", "429") == before + 1
+
+
+def test_cache_bypass_has_its_own_bucket(github, monkeypatch):
+    github["handler"] = lambda request: httpx.Response(200, json=[])
+    monkeypatch.setattr(bypass_buckets, "capacity", 1)
+    headers = {"X-Forwarded-For": "203.0.113.7, 10.0.0.1"}
+
+    assert client.get("/octocat?use_cache=false", headers=headers).status_code == 200
+    assert client.get("/octocat?use_cache=false", headers=headers).status_code == 429
+    assert client.get("/octocat", headers=headers).status_code == 200
+
+
+def test_fan_out_requests_pay_per_user_and_batch_bypass_uses_its_bucket(github):
+    github["handler"] = lambda request: httpx.Response(200, json=[])
+
+    response = client.post("/batch", json={"usernames": ["a", "b", "c"], "use_cache": False})
+    assert response.headers["x-ratelimit-limit"] == str(bypass_buckets.capacity)
+    assert response.headers["x-ratelimit-remaining"] == str(bypass_buckets.capacity - 3)
+    names = [f"u{i}" for i in range(50)]
+    assert client.post("/batch", json={"usernames": names, "use_cache": "off"}).status_code == 429
+
+    response = client.post("/batch", json={"usernames": ["a", "b"]})
+    assert response.headers["x-ratelimit-remaining"] == str(normal_buckets.capacity - 2)
+    response = client.get("/gists/timeline", params={"usernames": "a,b,c"})
+    assert response.headers["x-ratelimit-remaining"] == str(normal_buckets.capacity - 5)
+    # An org request's default budget is more than a full bucket, so it takes all of it
+    assert client.get("/orgs/acme/gists").status_code == 429
+    normal_buckets.clear()
+    assert client.get("/orgs/acme/gists").headers["x-ratelimit-remaining"] == "0"
+
+
+@pytest.mark.parametrize("spelling", ["false", "0", "no", "off", "f", "N"])
+def test_every_false_spelling_uses_the_bypass_bucket(github, monkeypatch, spelling):
+    github["handler"] = lambda request: httpx.Response(200, json=[])
+    monkeypatch.setattr(bypass_buckets, "capacity", 1)
+    assert client.get(f"/octocat?use_cache={spelling}").status_code == 200
+    assert client.get(f"/octocat?use_cache={spelling}").status_code == 429
+    # The fetched page is cached now, but a bypass must still count as a miss for admission control
+    assert main._likely_cache_hit({"path": "/octocat", "query_string": b""})
+    assert not main._likely_cache_hit({"path": "/octocat", "query_string": f"use_cache={spelling}".encode()})
+
+
+def test_rotating_client_headers_does_not_reset_the_bucket(github, monkeypatch):
+    github["handler"] = lambda request: httpx.Response(200, json=[])
+    monkeypatch.setattr(normal_buckets, "capacity", 2)
+    statuses = [
+        client.get("/octocat", headers={"X-API-Key": f"key{i}", "X-Forwarded-For": f"198.51.100.{i}"}).status_code
+        for i in range(4)
+    ]
+    assert statuses == [200, 200, 429, 429]
+
+
+def test_client_address_trusts_forwarded_only_from_proxies(monkeypatch):
+    def scope(peer, forwarded):
+        return {"client": (peer, 1), "headers": [(b"x-forwarded-for", forwarded.encode())]}
+
+    assert client_address(scope("203.0.113.9", "1.1.1.1")) == "203.0.113.9"
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_TRUSTED_PROXIES", (ipaddress.ip_network("10.0.0.0/8"),))
+    assert client_address(scope("203.0.113.9", "1.1.1.1")) == "203.0.113.9"
+    # The client wrote "1.1.1.1"; the proxies appended the real address and each other
+    assert client_address(scope("10.0.0.2", "1.1.1.1, 198.51.100.4, 10.0.0.1")) == "198.51.100.4"
+    assert client_address(scope("10.0.0.2", "10.0.0.5")) == "10.0.0.5"
+
+
+def test_token_buckets_refill_and_stay_bounded():
+    buckets = TokenBuckets("test", per_minute=60, burst=2, max_clients=3)
+    assert buckets.take(b"a", now=0)[0]
+    assert buckets.take(b"a", now=0)[0]
+    assert not buckets.take(b"a", now=0.5)[0]
+    assert buckets.take(b"a", now=1.5)[0]
+
+    for i in range(10):
+        buckets.take(bytes([i]), now=2)
+    assert len(buckets) == 3
+
+    buckets.take(b"late", now=100)
+    assert len(buckets) == 1
+
+
+# ==========================================
+# Tracing
+# ==========================================
+
+def test_create_span_without_tracer_is_noop(github):
+    github["handler"] = lambda request: httpx.Response(200, json=[sample_gist("1")])
+    with tracing.create_span("cache.lookup", {"cache.key": "k"}) as span:
+        span.set_attribute("cache.hit", True)
+    assert client.get("/octocat").status_code == 200
+
+
+@pytest.fixture
+def span_exporter(monkeypatch):
+    """Route tracing spans to memory, sampling every trace."""
+    pytest.importorskip("opentelemetry.sdk")
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+    exporter = InMemorySpanExporter()
+    provider = tracing.build_tracer_provider(SimpleSpanProcessor(exporter), ratio=1.0)
+    monkeypatch.setattr(tracing, "_tracer", provider.get_tracer("test"))
+    return exporter
+
+
+def test_user_gists_child_spans_carry_cache_hit(github, span_exporter):
+    github["handler"] = lambda request: httpx.Response(200, json=[sample_gist("1")])
+    client.get("/octocat")
+    spans = {s.name: s for s in span_exporter.get_finished_spans()}
+    assert spans["cache.lookup"].attributes["cache.hit"] is False
+    assert spans["github.fetch"].attributes["http.status_code"] == 200
+    assert "serialize" in spans
+
+    span_exporter.clear()
+    client.get("/octocat")
+    names = [s.name for s in span_exporter.get_finished_spans()]
+    assert "github.fetch" not in names
+    lookup = next(s for s in span_exporter.get_finished_spans() if s.name == "cache.lookup")
+    assert lookup.attributes["cache.hit"] is True
+
+
+def test_unsampled_traces_kept_only_when_slow_or_errored():
+    pytest.importorskip("opentelemetry.sdk")
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+    from opentelemetry.trace import Status, StatusCode, set_span_in_context
+
+    exporter = InMemorySpanExporter()
+    provider = tracing.build_tracer_provider(
+        SimpleSpanProcessor(exporter), ratio=0.0, slow_threshold=1.0, keep_errors=True
+    )
+    tracer = provider.get_tracer("test")
+
+    def request(duration_ns, error=False):
+        root = tracer.start_span("GET /{username}", start_time=0)
+        with tracer.start_as_current_span("cache.lookup", context=set_span_in_context(root)):
+            pass
+        if error:
+            root.set_status(Status(StatusCode.ERROR))
+        root.end(end_time=duration_ns)
+
+    request(10_000_000)
+    assert exporter.get_finished_spans() == ()
+    request(2_000_000_000)
+    assert sorted(s.name for s in exporter.get_finished_spans()) == ["GET /{username}", "cache.lookup"]
+    assert all(s.context.trace_flags.sampled for s in exporter.get_finished_spans())
+    exporter.clear()
+    request(10_000_000, error=True)
+    assert len(exporter.get_finished_spans()) == 2
+
+
+# ==========================================
+# Sampling Profiler
+# ==========================================
+
+def busy_profiler_target(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_profile_collapses_stacks_of_all_threads():
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_profiler_target, args=(stop,), name="busy worker")
+    worker.start()
+    try:
+        stacks, passes = SamplingProfiler().profile(0.2, rate=200)
+    finally:
+        stop.set()
+        worker.join()
+
+    assert passes > 10
+    busy = [stack for stack in stacks if "busy_profiler_target" in ";".join(stack)]
+    assert busy and all(stack[0] == "busy worker" for stack in busy)
+    assert not any("SamplingProfiler._run" in ";".join(stack) for stack in stacks)  # Sampler skips itself
+    for line in collapse(stacks).splitlines():
+        frames, count = line.rsplit(" ", 1)
+        assert int(count) >= 1 and frames.count(";") >= 1
+
+
+def test_admin_profile_requires_token(monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", None)
+    assert client.get("/admin/profile?seconds=0.05").status_code == 404
+
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "s3cret")
+    assert client.get("/admin/profile?seconds=0.05").status_code == 401
+    wrong = client.get("/admin/profile?seconds=0.05", headers={"Authorization": "Bearer nope"})
+    assert wrong.status_code == 401
+
+    response = client.get("/admin/profile?seconds=0.05&rate=100", headers={"Authorization": "Bearer s3cret"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert int(response.headers["x-profile-samples"]) >= 1
+    assert response.text.endswith("\n")
+
+
+# ==========================================
+# Memory Introspection
+# ==========================================
+
+def test_cache_sizer_tracks_sets_and_evictions_per_user(github):
+    github["handler"] = lambda request: httpx.Response(200, json=[sample_gist(str(i)) for i in range(3)])
+    assert cache_sizer.total_bytes == 0
+
+    client.get("/octocat")
+    client.get("/octocat?page=2")
+    client.get("/hubot")
+    owners = {owner: (entries, size) for owner, entries, size in cache_sizer.top(10)}
+    assert owners["octocat"][0] == 2 and owners["hubot"][0] == 1
+    assert owners["octocat"][1] > owners["hubot"][1] > 0
+
+    main.gists_cache.set("gists:hubot:page1:per_page30", {"gists": [], "pagination": {}})
+    assert dict((o, s) for o, _, s in cache_sizer.top(10))["hubot"] < owners["hubot"][1]
+    main.gists_cache.clear()
+    assert cache_sizer.total_bytes == 0 and len(cache_sizer) == 0 and cache_sizer.top(10) == []
+
+
+def test_payload_estimate_samples_large_gist_lists():
+    gists = main.UPSTREAM_GISTS_ADAPTER.validate_python([sample_gist(f"{i:04}") for i in range(400)])
+    payload = {"gists": gists, "pagination": {"count": 400}}
+    exact = deep_size(payload)
+    assert estimate_payload(payload, sample=400) == exact
+    assert 0.9 * exact < estimate_payload(payload, sample=16) < 1.1 * exact
+
+    sizer = CacheSizer()
+    sizer.on_set("gist:abc", {"gists": gists[:1]})
+    sizer.on_set("other", [1, 2, 3])
+    assert {owner for owner, _, _ in sizer.top(5)} == {"(gist)", "(other)"}
+
+
+def test_admin_memory_report_and_tracemalloc_diff(github, monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "s3cret")
+    auth = {"Authorization": "Bearer s3cret"}
+    assert client.get("/admin/memory").status_code == 401
+    github["handler"] = lambda request: httpx.Response(200, json=[sample_gist("1")])
+    client.get("/octocat")
+
+    report = client.get("/admin/memory", headers=auth).json()
+    assert report["cache_by_username"][0]["username"] == "octocat"
+    assert report["cache_estimated_bytes"] > 0 and report["metric_series"] > 0
+    assert report["tracemalloc"] is False and report["top_allocations"] == []
+
+    try:
+        assert client.post("/admin/memory/tracemalloc?enabled=true", headers=auth).json() == {"tracemalloc": True}
+        hoard = [bytearray(1000) for _ in range(500)]
+        report = client.get("/admin/memory", headers=auth).json()
+        assert report["traced_bytes"] > 0
+        assert any(site["size_diff"] >= 500_000 for site in report["top_allocations"])
+        del hoard
+    finally:
+        client.post("/admin/memory/tracemalloc?enabled=false", headers=auth)
+    assert client.get("/admin/memory", headers=auth).json()["tracemalloc"] is False